@@ -20,11 +20,64 @@ CREATE TABLE external_db_credentials (
     port INTEGER NOT NULL,
     dbname TEXT NOT NULL,
     db_user TEXT NOT NULL,
-    db_password TEXT NOT NULL, -- Prefer encrypted storage in production
+    db_password TEXT NOT NULL, -- envelope-encrypted (enc1$...) when CREDENTIAL_MASTER_KEY is set, see crypto.py
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 
+--latest background health check per external database
+CREATE TABLE connection_health (
+    credential_id UUID PRIMARY KEY REFERENCES external_db_credentials(id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL, -- 'connected' or 'failed'
+    latency_ms DOUBLE PRECISION,
+    table_count INTEGER,
+    last_error TEXT,
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    checked_at TIMESTAMP NOT NULL,
+    last_success_at TIMESTAMP,
+    next_check_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX ix_connection_health_next_check_at ON connection_health (next_check_at);
+
+
+--question -> SQL examples retrieved as few-shot prompts
+CREATE TABLE fewshot_examples (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    credential_id UUID NOT NULL REFERENCES external_db_credentials(id) ON DELETE CASCADE,
+    question TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    source VARCHAR(20) NOT NULL, -- 'executed' or 'confirmed'
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX ix_fewshot_examples_credential_id ON fewshot_examples (credential_id);
+
+CREATE TABLE conversations (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    title TEXT,
+    summary TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX ix_conversations_user_id ON conversations (user_id);
+
+CREATE TABLE conversation_turns (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    conversation_id UUID NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    question TEXT NOT NULL,
+    sql TEXT,
+    database VARCHAR(100),
+    tables TEXT[],
+    answer TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX ix_conversation_turns_conversation_id ON conversation_turns (conversation_id);
+
+
 SELECT * FROM external_db_credentials;
 
 SELECT * FROM users;
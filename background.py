@@ -0,0 +1,58 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundScheduler:
+    """
+    Bounded fire-and-forget job runner for work that should stay off the request path.
+
+    Jobs are keyed: submitting a key that is already queued or running is a no-op,
+    and once max_pending jobs are outstanding new ones are dropped rather than
+    piling up behind a slow database.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 100, name: str = "background"):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def submit(self, key: str, fn: Callable, *args, **kwargs) -> bool:
+        """Queue fn(*args, **kwargs); returns False if it was deduplicated or dropped"""
+        with self._lock:
+            if key in self._pending:
+                return False
+            if len(self._pending) >= self._max_pending:
+                logger.warning(f"Background queue full, dropping job {key}")
+                return False
+            self._pending.add(key)
+
+        self._executor.submit(self._run, key, fn, args, kwargs)
+        return True
+
+    def _run(self, key: str, fn: Callable, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Background job {key} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+scheduler = BackgroundScheduler(
+    max_workers=int(os.getenv("BACKGROUND_WORKERS", "4")),
+    max_pending=int(os.getenv("BACKGROUND_MAX_PENDING", "100")),
+)
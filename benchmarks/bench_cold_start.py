@@ -0,0 +1,108 @@
+"""
+Worker cold start: how long until a fresh process can serve traffic.
+
+Measures, each over --runs fresh interpreters:
+
+- import time of `main` (what every uvicorn/gunicorn worker pays before
+  accepting connections)
+- with --boot: time from spawning `uvicorn main:app` until /healthz answers
+  (serving) and until /readyz returns 200 (app DB and LLM pools warmed)
+
+--importtime lists the slowest modules from `python -X importtime -c "import main"`.
+DATABASE_URL and SECRET_KEY must be set as for the app; with --boot the app
+database must be reachable for /readyz to turn ready (run `python migrate.py`
+first).
+
+    python benchmarks/bench_cold_start.py --runs 10 --importtime 15
+    python benchmarks/bench_cold_start.py --boot --port 8055
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(runs: int):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import main"], cwd=ROOT, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def slowest_imports(top: int):
+    """(cumulative_us, module) for the slowest imports, from -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def _wait(url: str, deadline: float, want_ok: bool) -> float:
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(url, timeout=1)
+            if not want_ok or response.status_code == 200:
+                return time.monotonic()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    raise RuntimeError(f"{url} not ready before timeout")
+
+
+def time_boot(runs: int, port: int, timeout: float):
+    serving, ready = [], []
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(runs):
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                                    "--log-level", "warning"], cwd=ROOT)
+        try:
+            deadline = start + timeout
+            serving.append((_wait(f"{base}/healthz", deadline, want_ok=False) - start) * 1000)
+            ready.append((_wait(f"{base}/readyz", deadline, want_ok=True) - start) * 1000)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    return serving, ready
+
+
+def _summary(label: str, samples):
+    print(f"{label:<24} median {statistics.median(samples):8.1f} ms   "
+          f"min {min(samples):8.1f} ms   max {max(samples):8.1f} ms   (n={len(samples)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--boot", action="store_true", help="also time uvicorn until /healthz and /readyz")
+    parser.add_argument("--port", type=int, default=8055)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="list the N slowest imports")
+    args = parser.parse_args()
+
+    _summary("import main", time_import(args.runs))
+    if args.boot:
+        serving, ready = time_boot(args.runs, args.port, args.timeout)
+        _summary("boot -> /healthz", serving)
+        _summary("boot -> /readyz 200", ready)
+    if args.importtime:
+        print("\nslowest imports (cumulative):")
+        for cumulative, module in slowest_imports(args.importtime):
+            print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Compare the schema encodings used in the LLM prompt.
+
+For every format in getschemas.SCHEMA_FORMATS this reports the size of the full
+prompt (characters and tokens) and, with --llm-runs, the LLM latency on the
+same questions. Schemas come from live databases (--dsn, repeatable) or from a
+small built-in sample so the token numbers can be compared offline.
+
+    python benchmarks/bench_schema_formats.py
+    python benchmarks/bench_schema_formats.py --dsn postgresql://user:pw@localhost/shop --llm-runs 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2  # noqa: E402
+
+from getschemas import SCHEMA_FORMATS, format_schema_for_llm, get_column_profiles, get_detailed_schema  # noqa: E402
+from llmcall import build_enhanced_prompt, get_prompt_version, query_model  # noqa: E402
+
+QUESTIONS = [
+    "How many orders were placed last month?",
+    "Top 10 customers by total order value",
+    "Which products have never been ordered?",
+]
+
+
+def count_tokens(text: str) -> int:
+    """Exact count with tiktoken when installed, otherwise the usual ~4 chars/token estimate"""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    except ImportError:
+        return max(1, round(len(text) / 4))
+
+
+def _column(name, data_type, key_type='', foreign_table=None, foreign_column=None, nullable='YES'):
+    return {
+        'column_name': name,
+        'data_type': data_type,
+        'is_nullable': nullable,
+        'column_default': None,
+        'key_type': key_type,
+        'foreign_table': foreign_table,
+        'foreign_column': foreign_column,
+    }
+
+
+def sample_schemas():
+    """A small shop/CRM pair that looks like a typical tenant"""
+    shop = {
+        'customers': [
+            _column('id', 'integer', 'PRIMARY KEY', nullable='NO'),
+            _column('name', 'character varying'),
+            _column('email', 'character varying'),
+            _column('country', 'character varying'),
+            _column('created_at', 'timestamp without time zone'),
+        ],
+        'products': [
+            _column('id', 'integer', 'PRIMARY KEY', nullable='NO'),
+            _column('name', 'character varying'),
+            _column('category', 'character varying'),
+            _column('price', 'numeric'),
+        ],
+        'orders': [
+            _column('id', 'integer', 'PRIMARY KEY', nullable='NO'),
+            _column('customer_id', 'integer', 'FOREIGN KEY', 'customers', 'id'),
+            _column('status', 'character varying'),
+            _column('total', 'numeric'),
+            _column('created_at', 'timestamp with time zone'),
+        ],
+        'order_items': [
+            _column('id', 'integer', 'PRIMARY KEY', nullable='NO'),
+            _column('order_id', 'integer', 'FOREIGN KEY', 'orders', 'id'),
+            _column('product_id', 'integer', 'FOREIGN KEY', 'products', 'id'),
+            _column('quantity', 'integer'),
+            _column('unit_price', 'numeric'),
+        ],
+    }
+    profiles = {
+        'orders': {
+            'row_estimate': 250000,
+            'columns': {
+                'status': {'null_frac': 0.0, 'n_distinct': 4,
+                           'common_values': ['paid', 'shipped', 'pending', 'refunded']},
+            },
+        },
+    }
+    info = {'host': 'localhost', 'port': 5432, 'dbname': 'shop', 'name': 'shop'}
+    return {'shop': {'schema': shop, 'profiles': profiles, 'connection_info': info}}
+
+
+def live_schemas(dsns):
+    schemas = {}
+    for dsn in dsns:
+        conn = psycopg2.connect(dsn)
+        try:
+            schema = get_detailed_schema(conn)
+            profiles = get_column_profiles(conn)
+            name = conn.get_dsn_parameters().get('dbname', dsn)
+            schemas[name] = {
+                'schema': schema,
+                'profiles': profiles if 'error' not in profiles else {},
+                'connection_info': {'host': conn.info.host, 'port': conn.info.port, 'dbname': name, 'name': name},
+            }
+        finally:
+            conn.close()
+    return schemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", action="append", default=[], help="libpq connection string (repeatable)")
+    parser.add_argument("--llm-runs", type=int, default=0, help="LLM calls per question and format (0 = tokens only)")
+    args = parser.parse_args()
+
+    schemas = live_schemas(args.dsn) if args.dsn else sample_schemas()
+    databases = list(schemas.keys())
+
+    print(f"{'format':<8} {'version':<10} {'schema chars':>12} {'prompt tokens':>14} {'p50 ms':>8} {'p95 ms':>8}")
+    for fmt in SCHEMA_FORMATS:
+        schema_text = format_schema_for_llm(schemas, fmt)
+        prompts = [build_enhanced_prompt(q, schema_text, databases) for q in QUESTIONS]
+        tokens = statistics.mean(count_tokens(p) for p in prompts)
+
+        latencies = []
+        for _ in range(args.llm_runs):
+            for prompt in prompts:
+                start = time.perf_counter()
+                query_model(prompt=prompt)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        if latencies:
+            p50 = f"{statistics.median(latencies):.0f}"
+            p95 = f"{sorted(latencies)[max(0, int(len(latencies) * 0.95) - 1)]:.0f}"
+        else:
+            p50 = p95 = "-"
+        print(f"{fmt:<8} {get_prompt_version(fmt):<10} {len(schema_text):>12} {tokens:>14.0f} {p50:>8} {p95:>8}")
+
+
+if __name__ == "__main__":
+    main()
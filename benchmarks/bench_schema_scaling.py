@@ -0,0 +1,309 @@
+"""
+How the schema path scales with catalog size.
+
+Generates a customer-like catalog (several schemas, foreign keys, a share of
+very wide tables) at increasing sizes, 10 to 20k tables by default, and for
+each size records:
+
+- get_detailed_schema and get_column_profiles time (with --dsn only: the
+  catalog is created for real in that scratch database)
+- format_schema_for_llm time and output size for every schema format
+- full prompt size in characters and tokens
+- peak Python memory of introspection + formatting (tracemalloc)
+
+Without --dsn the schema dict is generated in memory in the shape
+get_detailed_schema returns, so formatting and prompt size can be tracked
+offline. Results are appended as JSON lines to --out so runs form curves over
+time; --baseline compares against an earlier file and exits non-zero on a
+regression beyond --tolerance.
+
+    python benchmarks/bench_schema_scaling.py --out schema_scaling.jsonl
+    python benchmarks/bench_schema_scaling.py --dsn postgresql://postgres:pw@localhost/scratch --sizes 10,1000,10000
+    python benchmarks/bench_schema_scaling.py --baseline schema_scaling.jsonl --plot scaling.png
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import psycopg2  # noqa: E402
+
+from bench_schema_formats import count_tokens  # noqa: E402
+from getschemas import SCHEMA_FORMATS, format_schema_for_llm, get_column_profiles, get_detailed_schema  # noqa: E402
+from llmcall import build_enhanced_prompt  # noqa: E402
+
+DEFAULT_SIZES = "10,100,1000,5000,10000,20000"
+QUESTION = "Top 10 customers by total order value last quarter"
+SCHEMA_PREFIX = "bench_"
+DDL_BATCH = 250
+SCHEMA_COUNT = 4
+TIMING_NOISE_MS = 10
+
+DOMAINS = ["sales", "billing", "crm", "inventory", "hr", "support", "marketing", "ledger"]
+ENTITIES = ["customer", "order", "invoice", "payment", "product", "ticket", "employee", "campaign",
+            "shipment", "account", "contract", "event", "line_item", "address", "note"]
+COLUMN_TYPES = ["integer", "bigint", "text", "character varying(100)", "numeric(12,2)", "boolean",
+                "timestamp without time zone", "date", "jsonb", "uuid"]
+SHORT_TYPE_NAMES = {"character varying(100)": "character varying", "numeric(12,2)": "numeric"}
+
+
+def generate_catalog(table_count: int, seed: int = 42, wide_ratio: float = 0.05):
+    """
+    Deterministic list of table specs; any prefix is the catalog of that size.
+    Tables rotate over SCHEMA_COUNT schemas (public first); most have 5-15
+    columns, wide_ratio of them 100-300, and each may reference up to three
+    earlier tables.
+    """
+    rng = random.Random(seed)
+    schemas = ["public"] + [f"{SCHEMA_PREFIX}s{i}" for i in range(1, SCHEMA_COUNT)]
+    tables = []
+    for i in range(table_count):
+        schema = schemas[i % SCHEMA_COUNT]
+        name = f"{SCHEMA_PREFIX}{rng.choice(DOMAINS)}_{rng.choice(ENTITIES)}_{i}"
+        width = rng.randint(100, 300) if rng.random() < wide_ratio else rng.randint(5, 15)
+        columns = [("id", "integer", "NO")]
+        columns += [
+            (f"c{j}_{rng.choice(ENTITIES)}", rng.choice(COLUMN_TYPES), rng.choice(["YES", "NO"]))
+            for j in range(width - 1)
+        ]
+        fks = []
+        if tables:
+            for k in range(rng.randint(0, 3)):
+                target = tables[rng.randrange(len(tables))]
+                fks.append((f"{target['name']}_id_{k}", target["schema"], target["name"]))
+        tables.append({"schema": schema, "name": name, "columns": columns, "fks": fks})
+    return tables
+
+
+def catalog_schema_dict(tables):
+    """What get_detailed_schema would return for the public part of the catalog"""
+    schema = {}
+    for table in tables:
+        if table["schema"] != "public":
+            continue
+        columns = []
+        for column_name, data_type, nullable in table["columns"]:
+            columns.append({
+                'column_name': column_name,
+                'data_type': SHORT_TYPE_NAMES.get(data_type, data_type),
+                'is_nullable': nullable,
+                'column_default': None,
+                'key_type': 'PRIMARY KEY' if column_name == "id" else '',
+                'foreign_table': None,
+                'foreign_column': None,
+            })
+        for column_name, _, target in table["fks"]:
+            columns.append({
+                'column_name': column_name,
+                'data_type': 'integer',
+                'is_nullable': 'YES',
+                'column_default': None,
+                'key_type': 'FOREIGN KEY',
+                'foreign_table': target,
+                'foreign_column': 'id',
+            })
+        schema[table["name"]] = columns
+    return schema
+
+
+def table_ddl(table) -> str:
+    qualified = f'"{table["schema"]}"."{table["name"]}"'
+    columns = [f'"{name}" {data_type}{" NOT NULL" if nullable == "NO" else ""}'
+               for name, data_type, nullable in table["columns"]]
+    columns[0] = '"id" integer PRIMARY KEY'
+    columns += [f'"{name}" integer REFERENCES "{schema}"."{target}"(id)' for name, schema, target in table["fks"]]
+    return f"CREATE TABLE IF NOT EXISTS {qualified} ({', '.join(columns)});"
+
+
+def create_catalog(conn, tables, start: int, end: int):
+    """Create tables[start:end] in batches (earlier tables already exist)"""
+    with conn.cursor() as cur:
+        for schema in sorted({table["schema"] for table in tables[start:end]} - {"public"}):
+            cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+        conn.commit()
+        for offset in range(start, end, DDL_BATCH):
+            cur.execute("\n".join(table_ddl(table) for table in tables[offset:min(end, offset + DDL_BATCH)]))
+            conn.commit()
+        cur.execute("ANALYZE")
+        conn.commit()
+
+
+def drop_catalog(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT nspname FROM pg_namespace WHERE nspname LIKE %s", (SCHEMA_PREFIX + "%",))
+        for (schema,) in cur.fetchall():
+            cur.execute(f'DROP SCHEMA "{schema}" CASCADE')
+        cur.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public' AND tablename LIKE %s",
+                    (SCHEMA_PREFIX + "%",))
+        for offset, (table,) in enumerate(cur.fetchall()):
+            cur.execute(f'DROP TABLE IF EXISTS "public"."{table}" CASCADE')
+            if offset % DDL_BATCH == 0:
+                conn.commit()
+    conn.commit()
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def measure(size: int, schema_dict=None, conn=None):
+    """One point on the curve"""
+    point = {"tables": size}
+    tracemalloc.start()
+    if conn is not None:
+        schema_dict, point["introspect_ms"] = _timed(get_detailed_schema, conn)
+        profiles, point["profiles_ms"] = _timed(get_column_profiles, conn)
+        if "error" in schema_dict:
+            raise RuntimeError(schema_dict["error"])
+        profiles = profiles if "error" not in profiles else {}
+    else:
+        profiles = {}
+    point["public_tables"] = len(schema_dict)
+    point["columns"] = sum(len(columns) for columns in schema_dict.values())
+
+    databases = {"bench": {
+        "schema": schema_dict,
+        "profiles": profiles,
+        "connection_info": {"host": "localhost", "port": 5432, "dbname": "bench", "name": "bench"},
+    }}
+    for fmt in SCHEMA_FORMATS:
+        text, point[f"format_{fmt}_ms"] = _timed(format_schema_for_llm, databases, fmt)
+        prompt = build_enhanced_prompt(QUESTION, text, list(databases))
+        point[f"prompt_{fmt}_chars"] = len(prompt)
+        point[f"prompt_{fmt}_tokens"] = count_tokens(prompt)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    point["peak_mb"] = round(peak / 1024 / 1024, 2)
+    return {key: round(value, 2) if isinstance(value, float) else value for key, value in point.items()}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=HERE).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def compare(points, baseline_path: str, tolerance: float):
+    """Regressions vs the most recent run in baseline_path: list of messages"""
+    runs = {}
+    with open(baseline_path) as f:
+        for line in f:
+            record = json.loads(line)
+            runs.setdefault(record["run"], {})[record["tables"]] = record
+    if not runs:
+        return []
+    baseline = runs[max(runs)]
+
+    regressions = []
+    for point in points:
+        previous = baseline.get(point["tables"])
+        if not previous:
+            continue
+        for key, value in point.items():
+            if not key.endswith(("_ms", "_mb", "_chars", "_tokens")) or key not in previous:
+                continue
+            # A few ms either way is noise at small sizes
+            if key.endswith("_ms") and value - previous[key] < TIMING_NOISE_MS:
+                continue
+            if previous[key] and value > previous[key] * (1 + tolerance):
+                regressions.append(f"{point['tables']} tables: {key} {previous[key]} -> {value}")
+    return regressions
+
+
+def plot(points, path: str):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not installed, skipping --plot", file=sys.stderr)
+        return
+    sizes = [point["tables"] for point in points]
+    fig, axes = plt.subplots(1, 3, figsize=(15, 4))
+    for key in sorted({key for point in points for key in point if key.endswith("_ms")}):
+        axes[0].plot(sizes, [point.get(key) for point in points], marker="o", label=key)
+    for fmt in SCHEMA_FORMATS:
+        axes[1].plot(sizes, [point[f"prompt_{fmt}_tokens"] for point in points], marker="o", label=fmt)
+    axes[2].plot(sizes, [point["peak_mb"] for point in points], marker="o")
+    for ax, title in zip(axes, ["time (ms)", "prompt tokens", "peak memory (MB)"]):
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("tables")
+        ax.set_title(title)
+    axes[0].legend(fontsize=7)
+    axes[1].legend(fontsize=7)
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated table counts")
+    parser.add_argument("--dsn", help="scratch database to create the catalog in (measures introspection)")
+    parser.add_argument("--keep", action="store_true", help="leave the generated tables in --dsn")
+    parser.add_argument("--wide-ratio", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="append results as JSON lines")
+    parser.add_argument("--baseline", help="JSON lines from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth vs baseline")
+    parser.add_argument("--plot", help="write curves to this image (needs matplotlib)")
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    catalog = generate_catalog(sizes[-1], args.seed, args.wide_ratio)
+    run = {"run": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(), "live": bool(args.dsn)}
+
+    conn = psycopg2.connect(args.dsn) if args.dsn else None
+    points = []
+    try:
+        if conn is not None:
+            drop_catalog(conn)
+        created = 0
+        print(f"{'tables':>7} {'columns':>8} {'introspect':>11} {'ddl fmt':>8} {'ddl tokens':>11} "
+              f"{'verbose tokens':>15} {'peak MB':>8}")
+        for size in sizes:
+            if conn is not None:
+                create_catalog(conn, catalog, created, size)
+                created = size
+                point = measure(size, conn=conn)
+            else:
+                point = measure(size, schema_dict=catalog_schema_dict(catalog[:size]))
+            points.append(point)
+            introspect = f"{point['introspect_ms']:.0f} ms" if "introspect_ms" in point else "-"
+            print(f"{size:>7} {point['columns']:>8} {introspect:>11} {point['format_ddl_ms']:>5.0f} ms "
+                  f"{point['prompt_ddl_tokens']:>11} {point['prompt_verbose_tokens']:>15} {point['peak_mb']:>8}")
+    finally:
+        if conn is not None:
+            if not args.keep:
+                drop_catalog(conn)
+            conn.close()
+
+    regressions = compare(points, args.baseline, args.tolerance) if args.baseline else []
+    if args.out:
+        with open(args.out, "a") as f:
+            for point in points:
+                f.write(json.dumps({**run, **point}) + "\n")
+    if args.plot:
+        plot(points, args.plot)
+
+    if regressions:
+        print("\nRegressions vs baseline:")
+        for message in regressions:
+            print(f"  {message}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""
+Cache storage behind schemacache, the generated-SQL cache (llmcall) and
+resultstore, so every uvicorn worker can share one set of entries.
+
+CACHE_BACKEND selects where entries live:
+    memory  (default) LRU inside each worker process
+    sqlite  one file (CACHE_SQLITE_PATH, memory-mapped) shared by all workers on the host
+    redis   CACHE_REDIS_URL, shared by all workers on all hosts (needs `pip install redis`)
+
+The shared backends keep a small per-worker near cache in front of the shared
+store (CACHE_NEAR_TTL_SECONDS). Every write and delete publishes an
+invalidation message, and the other workers drop their near copy of the key.
+That way a refreshed schema is not served stale until the near entry expires.
+
+Keys are "<namespace>:<rest>". Each namespace is capped separately
+(CACHE_MAX_ENTRIES, or limit_namespace()), so a burst of query results
+can't evict the schema entries that are expensive to rebuild. Shared values
+are pickled behind an HMAC (CACHE_SIGNING_KEY, else SECRET_KEY), and an entry
+whose signature doesn't match is dropped as a miss without being unpickled.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2000"))
+# Private to the app user by default; a world-writable path would let anyone plant entries
+CACHE_SQLITE_PATH = os.getenv(
+    "CACHE_SQLITE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "api-connect", "cache.sqlite3")
+)
+CACHE_SQLITE_MMAP_BYTES = int(os.getenv("CACHE_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_REDIS_PREFIX = os.getenv("CACHE_REDIS_PREFIX", "api-connect:")
+CACHE_NEAR_TTL_SECONDS = float(os.getenv("CACHE_NEAR_TTL_SECONDS", "5"))
+CACHE_SIGNING_KEY = os.getenv("CACHE_SIGNING_KEY") or os.getenv("SECRET_KEY", "")
+INVALIDATION_POLL_SECONDS = 0.5
+INVALIDATION_RETENTION_SECONDS = 60
+
+_namespace_limits: Dict[str, int] = {}
+
+
+def limit_namespace(namespace: str, max_entries: int):
+    """Cap one namespace at a different size than CACHE_MAX_ENTRIES"""
+    _namespace_limits[namespace] = max_entries
+
+
+def namespace_of(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+def _signing_key() -> bytes:
+    if not CACHE_SIGNING_KEY:
+        raise RuntimeError(f"CACHE_BACKEND={CACHE_BACKEND} needs CACHE_SIGNING_KEY or SECRET_KEY to sign entries")
+    # Derived, so a cache entry's MAC is never usable as anything signed with SECRET_KEY itself
+    return hashlib.sha256(b"api-connect cache entries\0" + CACHE_SIGNING_KEY.encode()).digest()
+
+
+def _dumps(value: Any, key: bytes) -> bytes:
+    """Pickled value with its HMAC-SHA256 in front"""
+    payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    return hmac.new(key, payload, hashlib.sha256).digest() + payload
+
+
+def _loads(raw: bytes, key: bytes) -> Optional[Any]:
+    """The value _dumps stored, or None if the entry wasn't written with this key"""
+    raw = bytes(raw)
+    mac, payload = raw[:32], raw[32:]
+    if not hmac.compare_digest(mac, hmac.new(key, payload, hashlib.sha256).digest()):
+        logger.warning("Dropping a shared cache entry with a bad signature")
+        metrics.incr("cache.bad_signature")
+        return None
+    return pickle.loads(payload)
+
+
+class CacheBackend:
+    """get/set/delete with per-entry TTL; subclasses implement the underscored methods"""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._get(key)
+        metrics.incr(f"cache.{namespace_of(key)}.{'hits' if value is not None else 'misses'}")
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        if ttl > 0:
+            self._set(key, value, ttl)
+
+    def delete(self, key: str):
+        self._delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+    def close(self):
+        pass
+
+    def _get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Any, ttl: float):
+        raise NotImplementedError
+
+    def _delete(self, key: str):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """Per-process LRU, one OrderedDict per namespace"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._namespaces: Dict[str, "OrderedDict[str, Tuple[Any, float]]"] = {}
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entries = self._namespaces.get(namespace_of(key))
+            entry = entries.get(key) if entries is not None else None
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: Any, ttl: float):
+        namespace = namespace_of(key)
+        limit = _namespace_limits.get(namespace, self.max_entries)
+        with self._lock:
+            entries = self._namespaces.setdefault(namespace, OrderedDict())
+            entries[key] = (value, time.monotonic() + ttl)
+            entries.move_to_end(key)
+            while len(entries) > limit:
+                entries.popitem(last=False)
+
+    def _delete(self, key: str):
+        with self._lock:
+            entries = self._namespaces.get(namespace_of(key))
+            if entries is not None:
+                entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.name, "entries": {ns: len(e) for ns, e in self._namespaces.items()}}
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Entries in a WAL-mode SQLite file that every worker on the host opens.
+    Invalidations are rows in a second table that each worker polls.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._key = _signing_key()
+        self._local = threading.local()
+        # Every thread's connection, so close() can reach the threadpool's too
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        # Created owner-only up front; SQLite gives the -wal and -shm files the same mode
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        self._writes = 0
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS cache_entries_namespace ON cache_entries (namespace, expires_at);
+                CREATE TABLE IF NOT EXISTS cache_invalidations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    origin TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Closed from whichever thread calls close(), hence check_same_thread=False
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={CACHE_SQLITE_MMAP_BYTES}")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _get(self, key: str) -> Optional[Any]:
+        row = self._connection().execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return _loads(row[0], self._key) if row else None
+
+    def _set(self, key: str, value: Any, ttl: float):
+        namespace = namespace_of(key)
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, namespace, value, expires_at) VALUES (?, ?, ?, ?)",
+            (key, namespace, _dumps(value, self._key), time.time() + ttl)
+        )
+        with self._lock:
+            self._writes += 1
+            trim = self._writes % 100 == 0
+        if trim:
+            self._trim(conn, namespace)
+
+    def _trim(self, conn: sqlite3.Connection, namespace: str):
+        """Drop expired entries, then the soonest-expiring ones over the namespace cap"""
+        conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+        conn.execute("""
+            DELETE FROM cache_entries WHERE key IN (
+                SELECT key FROM cache_entries WHERE namespace = ?
+                ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (namespace, _namespace_limits.get(namespace, self.max_entries)))
+
+    def _delete(self, key: str):
+        self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def publish_invalidation(self, key: str, origin: str):
+        self._connection().execute(
+            "INSERT INTO cache_invalidations (key, origin, created_at) VALUES (?, ?, ?)", (key, origin, time.time())
+        )
+
+    def listen_invalidations(self, origin: str, callback: Callable[[str], None]):
+        """Blocking loop: call callback(key) for every invalidation from another worker"""
+        conn = self._connection()
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM cache_invalidations").fetchone()[0]
+        last_prune = time.monotonic()
+        while True:
+            time.sleep(INVALIDATION_POLL_SECONDS)
+            rows = conn.execute(
+                "SELECT id, key, origin FROM cache_invalidations WHERE id > ? ORDER BY id", (last_id,)
+            ).fetchall()
+            for row_id, key, row_origin in rows:
+                last_id = row_id
+                if row_origin != origin:
+                    callback(key)
+            if time.monotonic() - last_prune > INVALIDATION_RETENTION_SECONDS:
+                conn.execute("DELETE FROM cache_invalidations WHERE created_at < ?",
+                             (time.time() - INVALIDATION_RETENTION_SECONDS,))
+                last_prune = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        rows = self._connection().execute(
+            "SELECT namespace, COUNT(*) FROM cache_entries WHERE expires_at > ? GROUP BY namespace", (time.time(),)
+        ).fetchall()
+        return {"backend": self.name, "path": self.path, "entries": dict(rows)}
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Closing a cache connection failed: {e}")
+        # Threads that use the cache again after close() reconnect
+        self._local = threading.local()
+
+
+class RedisCache(CacheBackend):
+    """
+    Entries in Redis (or anything speaking its protocol: Valkey, KeyDB, Dragonfly).
+    Invalidations go over pub/sub. Namespace caps are not enforced here;
+    configure maxmemory-policy allkeys-lru on the server instead.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = CACHE_REDIS_URL, prefix: str = CACHE_REDIS_PREFIX):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis needs the redis package (pip install redis)")
+        self.url = url
+        self.prefix = prefix
+        self._key = _signing_key()
+        self.channel = f"{prefix}invalidate"
+        self._client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+
+    def _get(self, key: str) -> Optional[Any]:
+        raw = self._client.get(self.prefix + key)
+        return _loads(raw, self._key) if raw is not None else None
+
+    def _set(self, key: str, value: Any, ttl: float):
+        self._client.set(self.prefix + key, _dumps(value, self._key), px=int(ttl * 1000))
+
+    def _delete(self, key: str):
+        self._client.delete(self.prefix + key)
+
+    def publish_invalidation(self, key: str, origin: str):
+        self._client.publish(self.channel, f"{origin} {key}")
+
+    def listen_invalidations(self, origin: str, callback: Callable[[str], None]):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            message_origin, _, key = message["data"].decode().partition(" ")
+            if message_origin != origin:
+                callback(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "url": self.url.rsplit("@", 1)[-1]}
+
+    def close(self):
+        self._client.close()
+
+
+class NearCache(CacheBackend):
+    """
+    Short-lived per-worker copies in front of a shared backend. Writes go
+    through to the shared store and tell the other workers to drop their copies.
+    """
+
+    def __init__(self, shared: CacheBackend, near_ttl: float = CACHE_NEAR_TTL_SECONDS):
+        self.shared = shared
+        self.name = shared.name
+        self.near_ttl = near_ttl
+        self.near = MemoryCache()
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._listener: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_listening(self):
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, name="cache-invalidations", daemon=True)
+                    self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                self.shared.listen_invalidations(self.origin, self._on_invalidation)
+            except Exception as e:
+                # Until the listener is back, near entries may be stale for up to near_ttl
+                logger.warning(f"Cache invalidation listener failed ({e}), reconnecting")
+                time.sleep(1)
+
+    def _on_invalidation(self, key: str):
+        self.near.delete(key)
+        metrics.incr("cache.invalidations_received")
+
+    def _get(self, key: str) -> Optional[Any]:
+        self._ensure_listening()
+        value = self.near._get(key)
+        if value is not None:
+            metrics.incr("cache.near_hits")
+            return value
+        try:
+            value = self.shared._get(key)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed for {key}: {e}")
+            metrics.incr("cache.errors")
+            return None
+        if value is not None and self.near_ttl > 0:
+            self.near._set(key, value, self.near_ttl)
+        return value
+
+    def _set(self, key: str, value: Any, ttl: float):
+        self._ensure_listening()
+        if self.near_ttl > 0:
+            self.near._set(key, value, min(ttl, self.near_ttl))
+        try:
+            self.shared._set(key, value, ttl)
+            self.shared.publish_invalidation(key, self.origin)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed for {key}: {e}")
+            metrics.incr("cache.errors")
+
+    def _delete(self, key: str):
+        self.near._delete(key)
+        try:
+            self.shared._delete(key)
+            self.shared.publish_invalidation(key, self.origin)
+        except Exception as e:
+            logger.warning(f"Shared cache delete failed for {key}: {e}")
+            metrics.incr("cache.errors")
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            shared = self.shared.stats()
+        except Exception as e:
+            shared = {"backend": self.shared.name, "error": str(e)}
+        return {**shared, "near": self.near.stats()["entries"]}
+
+    def close(self):
+        self.shared.close()
+
+
+_BUILDERS: Dict[str, Callable[[], CacheBackend]] = {
+    "memory": MemoryCache,
+    "sqlite": lambda: NearCache(SQLiteCache()),
+    "redis": lambda: NearCache(RedisCache()),
+}
+
+_cache: Optional[CacheBackend] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CacheBackend:
+    """The process-wide cache, built from CACHE_BACKEND on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if CACHE_BACKEND not in _BUILDERS:
+                    raise ValueError(f"Unknown CACHE_BACKEND '{CACHE_BACKEND}', expected one of {sorted(_BUILDERS)}")
+                _cache = _BUILDERS[CACHE_BACKEND]()
+    return _cache
+
+
+def delete_many(keys: List[str]):
+    cache = get_cache()
+    for key in keys:
+        cache.delete(key)
+
+
+def stats() -> Dict[str, Any]:
+    return get_cache().stats()
+
+
+def close():
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
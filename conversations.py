@@ -0,0 +1,259 @@
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.sql import func
+
+from database import SessionLocal
+from models import Conversation, ConversationTurn
+
+logger = logging.getLogger(__name__)
+
+# Turns kept verbatim in follow-up prompts; older turns are folded into the
+# conversation summary, which is capped so prompt size stays flat.
+RECENT_TURNS = 3
+SUMMARY_MAX_LINES = 8
+SUMMARY_LINE_MAX_CHARS = 160
+# Upper bound on tables sent with a follow-up, including foreign-key neighbours
+MAX_FOLLOWUP_TABLES = 12
+# Questions this short only make sense against the previous answer ("by region?", "top 5 only")
+FOLLOWUP_MAX_ELLIPTIC_WORDS = 4
+
+# Words that point back at the previous answer; "this"/"that"/"last" and possessives
+# are left out because fresh questions use them all the time ("this year", "with their salary")
+_REFERENCE_WORDS = {
+    "it", "they", "them", "those", "these", "same", "previous", "above",
+    "earlier", "instead", "again", "too", "ones", "result", "results",
+}
+_CONTINUATION = re.compile(
+    r"^\s*(and|but|or|also|now|then|only|just|what about|how about|same|instead|sort|order|group|"
+    r"filter|limit|exclude|include|without|except|break (it|that|them) down)\b",
+    re.IGNORECASE
+)
+
+
+def start_conversation(user_id, conversation_id: Optional[str] = None, title: Optional[str] = None) -> Optional[str]:
+    """
+    Id of the user's conversation, creating one when conversation_id is None.
+    Returns None if conversation_id doesn't exist or belongs to someone else.
+    """
+    db = SessionLocal()
+    try:
+        if conversation_id:
+            conversation = db.query(Conversation).filter(
+                Conversation.id == conversation_id,
+                Conversation.user_id == user_id
+            ).first()
+            return str(conversation.id) if conversation else None
+
+        conversation = Conversation(user_id=user_id, title=(title or "")[:200] or None)
+        db.add(conversation)
+        db.commit()
+        return str(conversation.id)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to open conversation: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def _recent_turns(db, conversation_id, limit: int) -> List[ConversationTurn]:
+    """Newest first"""
+    return db.query(ConversationTurn).filter(
+        ConversationTurn.conversation_id == conversation_id
+    ).order_by(ConversationTurn.created_at.desc()).limit(limit).all()
+
+
+def load_context(conversation_id: str) -> Optional[Dict[str, Any]]:
+    """
+    What a follow-up prompt needs: the last SQL, its database and tables, the
+    recent turns and the summary. None when there's no previous SQL to build on.
+    """
+    db = SessionLocal()
+    try:
+        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        if conversation is None:
+            return None
+        turns = _recent_turns(db, conversation.id, RECENT_TURNS)
+        last = next((turn for turn in turns if turn.sql), None)
+        if last is None:
+            return None
+        return {
+            "previous_question": last.question,
+            "previous_sql": last.sql,
+            "database": last.database,
+            "tables": list(last.tables or []),
+            "recent": [{"question": turn.question, "sql": turn.sql} for turn in reversed(turns)],
+            "summary": conversation.summary or "",
+        }
+    except Exception as e:
+        logger.error(f"Failed to load conversation {conversation_id}: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def _summary_line(turn: ConversationTurn) -> str:
+    question = re.sub(r"\s+", " ", turn.question).strip()
+    line = f"- {question}"
+    if turn.tables:
+        line += f" (tables: {', '.join(turn.tables)})"
+    if len(line) > SUMMARY_LINE_MAX_CHARS:
+        line = line[:SUMMARY_LINE_MAX_CHARS - 3] + "..."
+    return line
+
+
+def _fold_into_summary(summary: Optional[str], turn: ConversationTurn) -> str:
+    """Extractive summary: one line per folded turn, oldest lines dropped first"""
+    lines = [line for line in (summary or "").splitlines() if line.strip()]
+    lines.append(_summary_line(turn))
+    return "\n".join(lines[-SUMMARY_MAX_LINES:])
+
+
+def record_turn(conversation_id: str, question: str, sql: Optional[str] = None, database: Optional[str] = None,
+                tables: Optional[List[str]] = None, answer: Optional[str] = None) -> None:
+    """Persist one question/answer and fold the turn leaving the recent window into the summary"""
+    db = SessionLocal()
+    try:
+        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        if conversation is None:
+            return
+        db.add(ConversationTurn(
+            conversation_id=conversation.id,
+            question=question,
+            sql=sql or None,
+            database=database,
+            tables=tables or [],
+            answer=answer
+        ))
+        db.flush()
+
+        turns = _recent_turns(db, conversation.id, RECENT_TURNS + 1)
+        if len(turns) > RECENT_TURNS:
+            conversation.summary = _fold_into_summary(conversation.summary, turns[RECENT_TURNS])
+        if not conversation.title:
+            conversation.title = question[:200]
+        # onupdate only fires when a column changes; a new turn is activity either way
+        conversation.updated_at = func.now()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to record conversation turn: {e}")
+    finally:
+        db.close()
+
+
+def list_conversations(user_id, limit: int = 50) -> List[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        rows = db.query(Conversation).filter(
+            Conversation.user_id == user_id
+        ).order_by(Conversation.updated_at.desc()).limit(limit).all()
+        return [
+            {"id": str(row.id), "title": row.title, "created_at": row.created_at, "updated_at": row.updated_at}
+            for row in rows
+        ]
+    finally:
+        db.close()
+
+
+def get_conversation(user_id, conversation_id: str) -> Optional[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        conversation = db.query(Conversation).filter(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id
+        ).first()
+        if conversation is None:
+            return None
+        turns = db.query(ConversationTurn).filter(
+            ConversationTurn.conversation_id == conversation.id
+        ).order_by(ConversationTurn.created_at).all()
+        return {
+            "id": str(conversation.id),
+            "title": conversation.title,
+            "summary": conversation.summary,
+            "turns": [
+                {
+                    "question": turn.question,
+                    "sql": turn.sql,
+                    "database": turn.database,
+                    "tables": turn.tables or [],
+                    "answer": turn.answer,
+                    "created_at": turn.created_at
+                }
+                for turn in turns
+            ]
+        }
+    finally:
+        db.close()
+
+
+def tables_in_sql(sql: str, known_tables: Iterable[str]) -> List[str]:
+    """Known table names referenced by a SQL statement"""
+    if not sql:
+        return []
+    return [
+        table for table in known_tables
+        if re.search(rf'(?<![\w.]){re.escape(table)}(?!\w)', sql, re.IGNORECASE)
+    ]
+
+
+def _mentioned_tables(question: str, known_tables: Iterable[str]) -> Set[str]:
+    words = set(re.findall(r"[a-z0-9_]+", question.lower()))
+    text = " " + " ".join(re.findall(r"[a-z0-9]+", question.lower())) + " "
+    mentioned = set()
+    for table in known_tables:
+        name = table.lower()
+        singular = name[:-1] if name.endswith("s") else name
+        if name in words or singular in words or f" {name.replace('_', ' ')} " in text:
+            mentioned.add(table)
+    return mentioned
+
+
+def is_followup(question: str, context: Optional[Dict[str, Any]], other_databases: Iterable[str] = ()) -> bool:
+    """
+    Whether a question refers back to the previous turn (pronouns, "what about ...",
+    ellipsis) rather than starting something new. Naming another database never is.
+    """
+    if not context or not context.get("previous_sql"):
+        return False
+    lowered = question.lower()
+    if any(re.search(rf"(?<!\w){re.escape(name.lower())}(?!\w)", lowered) for name in other_databases if name):
+        return False
+    words = re.findall(r"[a-z0-9_']+", lowered)
+    if not words:
+        return False
+    return (
+        len(words) <= FOLLOWUP_MAX_ELLIPTIC_WORDS
+        or bool(_CONTINUATION.match(lowered))
+        or any(word in _REFERENCE_WORDS for word in words)
+    )
+
+
+def relevant_tables(schema: Dict[str, List[Dict]], previous_tables: List[str], question: str) -> List[str]:
+    """
+    Schema subset for a follow-up: the previous turn's tables, tables the new
+    question names, and their direct foreign-key neighbours.
+    """
+    core = [table for table in previous_tables if table in schema]
+    core += sorted(_mentioned_tables(question, schema) - set(core))
+
+    neighbours = []
+    core_set = set(core)
+    for table, columns in schema.items():
+        for column in columns:
+            foreign = column.get('foreign_table')
+            if not foreign:
+                continue
+            if table in core_set and foreign in schema and foreign not in core_set:
+                neighbours.append(foreign)
+            elif foreign in core_set and table not in core_set:
+                neighbours.append(table)
+
+    selected = []
+    for table in core + neighbours:
+        if table not in selected:
+            selected.append(table)
+    return selected[:MAX_FOLLOWUP_TABLES]
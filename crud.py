@@ -1,4 +1,5 @@
 from sqlalchemy.orm import Session 
+import crypto
 import models, schemas
 import uuid
 from datetime import datetime
@@ -41,7 +42,7 @@ def create_external_db_credential(
         port=cred.port,
         dbname=cred.dbname,
         db_user=cred.db_user,
-        db_password=cred.db_password,
+        db_password=crypto.seal(cred.db_password),
         created_at=datetime.now()
     )
     db.add(db_cred)
@@ -0,0 +1,199 @@
+"""
+Envelope encryption for stored database credentials.
+
+Each password gets its own random data key (AES-256-GCM) and that data key is
+wrapped with the master key from CREDENTIAL_MASTER_KEY. The master key is raw
+key material, not a passphrase, so no KDF runs anywhere; rotating it only
+re-wraps the small data keys (python migrate.py --encrypt-credentials).
+
+Decrypted values are cached in memory by their stored token with a sliding
+TTL: a credential whose pool keeps serving queries is decrypted once, an idle
+one drops out after CREDENTIAL_CACHE_TTL_SECONDS.
+
+Needs `pip install cryptography` once a master key is set. Without a key,
+passwords are stored and read as plaintext, as before.
+"""
+import base64
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# base64 of 32 random bytes, e.g. python -c "import os,base64;print(base64.b64encode(os.urandom(32)).decode())"
+CREDENTIAL_MASTER_KEY = os.getenv("CREDENTIAL_MASTER_KEY", "")
+# Comma-separated retired master keys, still accepted for decryption while rotating
+CREDENTIAL_PREVIOUS_MASTER_KEYS = os.getenv("CREDENTIAL_PREVIOUS_MASTER_KEYS", "")
+CREDENTIAL_CACHE_TTL_SECONDS = float(os.getenv("CREDENTIAL_CACHE_TTL_SECONDS", "300"))
+CREDENTIAL_CACHE_MAX_ENTRIES = int(os.getenv("CREDENTIAL_CACHE_MAX_ENTRIES", "1000"))
+
+TOKEN_PREFIX = "enc1$"
+_NONCE_BYTES = 12
+# Ciphertexts only decrypt as what they were sealed for
+_KEY_AAD = b"credential-data-key"
+_VALUE_AAD = b"credential-password"
+
+_lock = threading.Lock()
+_keys: Optional[Dict[str, Any]] = None  # key id -> AESGCM for each master key
+_active_key_id: Optional[str] = None
+_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+
+class CredentialKeyError(Exception):
+    """A stored credential can't be decrypted with the configured master keys"""
+
+
+def _key_id(key: bytes) -> str:
+    return hashlib.sha256(key).hexdigest()[:8]
+
+
+def _load_keys():
+    global _keys, _active_key_id
+    with _lock:
+        if _keys is not None:
+            return
+        keys = {}
+        active = None
+        encoded = [CREDENTIAL_MASTER_KEY] + CREDENTIAL_PREVIOUS_MASTER_KEYS.split(",")
+        for position, value in enumerate(encoded):
+            value = value.strip()
+            if not value:
+                continue
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+            try:
+                key = base64.b64decode(value, validate=True)
+            except ValueError:
+                # binascii.Error is a ValueError; callers only expect CredentialKeyError
+                raise CredentialKeyError("Credential master keys must be valid base64")
+            if len(key) != 32:
+                raise CredentialKeyError("Credential master keys must be 32 bytes, base64 encoded")
+            keys[_key_id(key)] = AESGCM(key)
+            if position == 0:
+                active = _key_id(key)
+        _keys, _active_key_id = keys, active
+
+
+def encryption_enabled() -> bool:
+    _load_keys()
+    return _active_key_id is not None
+
+
+def is_sealed(stored: str) -> bool:
+    return stored.startswith(TOKEN_PREFIX)
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _wrap(data_key: bytes) -> str:
+    nonce = os.urandom(_NONCE_BYTES)
+    return _b64(nonce + _keys[_active_key_id].encrypt(nonce, data_key, _KEY_AAD))
+
+
+def seal(plaintext: str) -> str:
+    """Encrypt a password for storage; returns it unchanged if no master key is configured"""
+    if not encryption_enabled():
+        return plaintext
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    data_key = AESGCM.generate_key(bit_length=256)
+    nonce = os.urandom(_NONCE_BYTES)
+    ciphertext = AESGCM(data_key).encrypt(nonce, plaintext.encode(), _VALUE_AAD)
+    return f"{TOKEN_PREFIX}{_active_key_id}${_wrap(data_key)}${_b64(nonce + ciphertext)}"
+
+
+def _parse(token: str) -> Tuple[str, bytes, bytes]:
+    try:
+        key_id, wrapped, sealed = token[len(TOKEN_PREFIX):].split("$")
+        return key_id, base64.b64decode(wrapped), base64.b64decode(sealed)
+    except ValueError:
+        raise CredentialKeyError("Malformed encrypted credential")
+
+
+def _unwrap(key_id: str, wrapped: bytes) -> bytes:
+    from cryptography.exceptions import InvalidTag
+
+    _load_keys()
+    master = _keys.get(key_id)
+    if master is None:
+        raise CredentialKeyError(f"Credential was encrypted with master key {key_id}, which is not configured")
+    try:
+        return master.decrypt(wrapped[:_NONCE_BYTES], wrapped[_NONCE_BYTES:], _KEY_AAD)
+    except InvalidTag:
+        raise CredentialKeyError(f"Credential data key failed to decrypt with master key {key_id}")
+
+
+def _decrypt(token: str) -> str:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    key_id, wrapped, sealed = _parse(token)
+    data_key = _unwrap(key_id, wrapped)
+    try:
+        return AESGCM(data_key).decrypt(sealed[:_NONCE_BYTES], sealed[_NONCE_BYTES:], _VALUE_AAD).decode()
+    except InvalidTag:
+        raise CredentialKeyError("Credential failed to decrypt")
+
+
+def reveal(stored: str) -> str:
+    """Plaintext of a stored password, from the cache when possible"""
+    if not is_sealed(stored):
+        return stored
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(stored)
+        if entry is not None and entry[1] > now:
+            _cache[stored] = (entry[0], now + CREDENTIAL_CACHE_TTL_SECONDS)
+            _cache.move_to_end(stored)
+            metrics.incr("credentials.cache_hit")
+            return entry[0]
+
+    try:
+        plaintext = _decrypt(stored)
+    except CredentialKeyError as e:
+        logger.error(f"Stored credential unusable: {e}")
+        raise
+    metrics.incr("credentials.decrypted")
+    with _lock:
+        _cache[stored] = (plaintext, now + CREDENTIAL_CACHE_TTL_SECONDS)
+        _cache.move_to_end(stored)
+        # Least recently used first, so expired entries are all at the front
+        while _cache and (len(_cache) > CREDENTIAL_CACHE_MAX_ENTRIES or next(iter(_cache.values()))[1] <= now):
+            _cache.popitem(last=False)
+    return plaintext
+
+
+def rewrap(stored: str) -> str:
+    """Seal a plaintext password, or re-wrap an encrypted one's data key under the active master key"""
+    if not is_sealed(stored):
+        return seal(stored)
+    key_id, wrapped, sealed = _parse(stored)
+    if not encryption_enabled() or key_id == _active_key_id:
+        return stored
+    return f"{TOKEN_PREFIX}{_active_key_id}${_wrap(_unwrap(key_id, wrapped))}${_b64(sealed)}"
+
+
+def forget(stored: str):
+    """Drop one credential's plaintext, e.g. once it's deleted"""
+    with _lock:
+        _cache.pop(stored, None)
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+def cache_stats() -> Dict[str, Any]:
+    enabled = encryption_enabled()
+    with _lock:
+        entries = len(_cache)
+    return {"encryption": enabled, "cached_credentials": entries}
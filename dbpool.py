@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+from psycopg2 import OperationalError
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+from preparedstatements import StatementCachingConnection
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+POOL_MIN_CONNECTIONS = int(os.getenv("EXTERNAL_POOL_MIN", "1"))
+POOL_MAX_CONNECTIONS = int(os.getenv("EXTERNAL_POOL_MAX", "5"))
+CONNECT_TIMEOUT_SECONDS = int(os.getenv("EXTERNAL_CONNECT_TIMEOUT", "10"))
+# How long a borrower waits for a busy pool before giving up with PoolExhausted
+POOL_WAIT_SECONDS = float(os.getenv("EXTERNAL_POOL_WAIT", "10"))
+
+_lock = threading.Lock()
+_pools: Dict[Tuple, "_WaitingPool"] = {}
+# Concurrent first borrowers of one DSN share a single pool creation
+_create_flight = SingleFlight("pool_create")
+
+
+class PoolExhausted(Exception):
+    """Every connection in the pool stayed busy for POOL_WAIT_SECONDS"""
+
+
+class _WaitingPool(ThreadedConnectionPool):
+    """ThreadedConnectionPool whose borrowers queue for a free connection instead of failing at once"""
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.slots = threading.BoundedSemaphore(maxconn)
+        # Our own count for stats(), rather than psycopg2's private _used
+        self.in_use = 0
+        self._count_lock = threading.Lock()
+
+    def getconn(self, key=None):
+        conn = super().getconn(key)
+        with self._count_lock:
+            self.in_use += 1
+        return conn
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        with self._count_lock:
+            self.in_use -= 1
+
+
+def pool_key(config: dict) -> Tuple:
+    """Pools are shared per DSN; the password is part of the key but never stored in it"""
+    password_digest = hashlib.sha256(str(config.get('password', '')).encode()).hexdigest()[:16]
+    return (config['host'], str(config['port']), config['dbname'], config['user'], password_digest)
+
+
+def _create_pool(key: Tuple, config: dict) -> "_WaitingPool":
+    # Connects to the database, so never under _lock: a slow host must not block other DSNs
+    pool = _WaitingPool(
+        POOL_MIN_CONNECTIONS,
+        POOL_MAX_CONNECTIONS,
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        connection_factory=StatementCachingConnection,
+        **config
+    )
+    with _lock:
+        existing = _pools.get(key)
+        if existing is None:
+            _pools[key] = pool
+            return pool
+    pool.closeall()
+    return existing
+
+
+def get_pool(config: dict) -> "_WaitingPool":
+    """Get (or lazily create) the connection pool for an external database"""
+    key = pool_key(config)
+    with _lock:
+        pool = _pools.get(key)
+    if pool is not None:
+        return pool
+    pool, _ = _create_flight.do(key, _create_pool, key, config)
+    return pool
+
+
+@contextmanager
+def connection(config: dict):
+    """
+    Borrow a pooled connection. Yields None if the database can't be reached,
+    mirroring getschemas.get_db_connection. When every connection is in use it
+    waits up to POOL_WAIT_SECONDS, then raises PoolExhausted.
+    """
+    try:
+        pool = get_pool(config)
+    except OperationalError as e:
+        logger.error(f"Database connection failed: {e}")
+        yield None
+        return
+
+    if not pool.slots.acquire(timeout=POOL_WAIT_SECONDS):
+        raise PoolExhausted(
+            f"All {pool.maxconn} connections to {config['host']}:{config['port']}/{config['dbname']} "
+            f"are busy; try again shortly"
+        )
+    try:
+        try:
+            conn = pool.getconn()
+        except (OperationalError, PoolError) as e:
+            logger.error(f"Database connection failed: {e}")
+            yield None
+            return
+
+        try:
+            yield conn
+        finally:
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    # Leave no open transaction behind for the next borrower
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            pool.putconn(conn, close=broken)
+    finally:
+        pool.slots.release()
+
+
+@contextmanager
+def read_only_session(conn):
+    """
+    Make every transaction on a borrowed connection read only for the block,
+    including ones a multi-statement string opens after its own COMMIT, which a
+    SET TRANSACTION READ ONLY wouldn't cover. Reset before the connection goes back.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SET SESSION default_transaction_read_only = on")
+    # Committed, so the rollback that ends the caller's transaction keeps it
+    conn.commit()
+    try:
+        yield conn
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+                with conn.cursor() as cur:
+                    cur.execute("RESET default_transaction_read_only")
+                conn.commit()
+            except Exception as e:
+                # Left read only; the next borrower can still read, and a broken connection is dropped anyway
+                logger.warning(f"Could not reset default_transaction_read_only: {e}")
+
+
+def stats() -> Dict[str, Dict]:
+    """Per-pool connection counts for /readyz, keyed host:port/dbname (no credentials)"""
+    with _lock:
+        pools = list(_pools.items())
+    return {
+        f"{key[0]}:{key[1]}/{key[2]}": {
+            "in_use": pool.in_use,
+            "free": pool.maxconn - pool.in_use,
+            "max": pool.maxconn,
+        }
+        for key, pool in pools
+    }
+
+
+def warm(config: dict) -> bool:
+    """Open the pool's initial connections ahead of the first request"""
+    try:
+        with connection(config) as conn:
+            return conn is not None
+    except PoolExhausted:
+        # Busy means it's already warm
+        return True
+
+
+def close_pool(config: dict):
+    """Close a DSN's pool; pools are shared, so only once no stored credential maps to it"""
+    with _lock:
+        pool = _pools.pop(pool_key(config), None)
+    if pool:
+        pool.closeall()
+
+
+def close_all():
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.closeall()
@@ -0,0 +1,305 @@
+"""
+Bulk export of a read-only query: Postgres COPY output streamed to the client.
+
+CSV is the COPY output byte for byte; no Python row objects are ever built.
+Parquet (needs `pip install pyarrow`) goes through pyarrow's streaming CSV
+reader and a ParquetWriter on another thread. Column types come from the
+query's result description, not from inference.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import metrics
+from dbpool import connection, read_only_session
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "parquet")
+MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+EXPORT_TIMEOUT_SECONDS = int(os.getenv("EXPORT_TIMEOUT_SECONDS", "900"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "4"))
+# A client that stops reading for this long is treated as gone
+EXPORT_STALL_SECONDS = 120
+# Longest wait for the worker's next chunk; past the statement timeout it can only be stuck
+CHUNK_WAIT_SECONDS = EXPORT_TIMEOUT_SECONDS + 30
+COPY_CHUNK_BYTES = 256 * 1024
+QUEUED_CHUNKS = 16
+PARQUET_BLOCK_BYTES = 8 * 1024 * 1024
+
+_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+_DONE = object()
+
+
+class ExportError(Exception):
+    """The export could not start; the message is safe to show to the user"""
+
+
+class ExportBusy(ExportError):
+    """Every export slot in this worker is in use"""
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _ActiveConnection:
+    """The connection a COPY runs on, cancellable from the response side until it goes back to the pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def set(self, conn):
+        with self._lock:
+            self._conn = conn
+
+    def clear(self):
+        with self._lock:
+            self._conn = None
+
+    def cancel(self):
+        # Under the lock, so the connection can't be handed to another borrower mid-cancel
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.cancel()
+                except Exception:
+                    pass
+
+
+class _ChunkSink:
+    """Writable file object that hands chunks to the response generator, with backpressure"""
+
+    def __init__(self, cancelled: threading.Event):
+        self.chunks: "queue.Queue" = queue.Queue(maxsize=QUEUED_CHUNKS)
+        self.closed = False
+        self._cancelled = cancelled
+        self._position = 0
+
+    def next(self):
+        """The worker's next chunk, _DONE or exception; raises ExportError if it goes quiet"""
+        try:
+            return self.chunks.get(timeout=CHUNK_WAIT_SECONDS)
+        except queue.Empty:
+            raise ExportError(f"Export stalled: no data from the database for {CHUNK_WAIT_SECONDS}s")
+
+    def put(self, item):
+        deadline = time.monotonic() + EXPORT_STALL_SECONDS
+        while True:
+            if self._cancelled.is_set():
+                raise _Cancelled()
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if time.monotonic() > deadline:
+                    self._cancelled.set()
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        if data:
+            self.put(data)
+            self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+# Postgres type OIDs -> pyarrow types; anything else stays text
+_INT_OIDS = {20: "int64", 21: "int16", 23: "int32", 26: "int64"}
+_FLOAT_OIDS = {700: "float32", 701: "float64"}
+BOOL_OID, DATE_OID, TIMESTAMP_OID, TIMESTAMPTZ_OID, NUMERIC_OID = 16, 1082, 1114, 1184, 1700
+
+
+def _arrow_types(description) -> Dict[str, Any]:
+    import pyarrow as pa
+
+    types = {}
+    for column in description:
+        oid = column.type_code
+        if oid in _INT_OIDS:
+            types[column.name] = getattr(pa, _INT_OIDS[oid])()
+        elif oid in _FLOAT_OIDS:
+            types[column.name] = getattr(pa, _FLOAT_OIDS[oid])()
+        elif oid == BOOL_OID:
+            types[column.name] = pa.bool_()
+        elif oid == DATE_OID:
+            types[column.name] = pa.date32()
+        elif oid == TIMESTAMP_OID:
+            types[column.name] = pa.timestamp("us")
+        elif oid == TIMESTAMPTZ_OID:
+            types[column.name] = pa.timestamp("us", tz="UTC")
+        elif oid == NUMERIC_OID and column.precision and column.precision <= 38 and column.scale is not None:
+            types[column.name] = pa.decimal128(column.precision, column.scale)
+        else:
+            types[column.name] = pa.string()
+    return types
+
+
+def _transcode_to_parquet(csv_in, sink: _ChunkSink, column_types: Dict[str, Any], column_names: List[str]):
+    """CSV bytes from csv_in -> Parquet row groups into sink, one Arrow record batch at a time"""
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    reader = pa_csv.open_csv(
+        csv_in,
+        read_options=pa_csv.ReadOptions(block_size=PARQUET_BLOCK_BYTES, column_names=column_names, skip_rows=1),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            true_values=["t"],
+            false_values=["f"],
+            # COPY writes NULL unquoted and empty strings quoted
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+        ),
+    )
+    writer = pq.ParquetWriter(sink, reader.schema, compression="zstd")
+    try:
+        for batch in reader:
+            writer.write_batch(batch)
+    finally:
+        writer.close()
+
+
+def _run_copy(sql: str, config: dict, fmt: str, sink: _ChunkSink, cancelled: threading.Event,
+              active: _ActiveConnection):
+    """Worker thread: COPY the query out, through the Parquet transcoder if asked"""
+    transcoder: Optional[threading.Thread] = None
+    copy_out = sink
+    errors: List[BaseException] = []
+    try:
+        with connection(config) as conn:
+            if conn is None:
+                raise ExportError("Failed to connect to database")
+            active.set(conn)
+            try:
+                with read_only_session(conn), conn.cursor() as cur:
+                    cur.execute("SET TRANSACTION READ ONLY")
+                    cur.execute("SET LOCAL statement_timeout = %s", (EXPORT_TIMEOUT_SECONDS * 1000,))
+                    cur.execute("SET LOCAL TIME ZONE 'UTC'")
+
+                    if fmt == "parquet":
+                        # Types from the planner, without running the query
+                        cur.execute(f"SELECT * FROM (\n{sql}\n) AS export_query LIMIT 0")
+                        column_types = _arrow_types(cur.description)
+                        column_names = [column.name for column in cur.description]
+                        read_fd, write_fd = os.pipe()
+                        copy_out = os.fdopen(write_fd, "wb")
+                        csv_in = os.fdopen(read_fd, "rb")
+
+                        def transcode():
+                            try:
+                                _transcode_to_parquet(csv_in, sink, column_types, column_names)
+                            except BaseException as e:
+                                errors.append(e)
+                            finally:
+                                csv_in.close()
+
+                        transcoder = threading.Thread(target=transcode, name="export-parquet", daemon=True)
+                        transcoder.start()
+
+                    # Newlines keep a trailing "-- comment" in the query from swallowing the parenthesis
+                    cur.copy_expert(f"COPY (\n{sql}\n) TO STDOUT WITH (FORMAT csv, HEADER true)", copy_out,
+                                    size=COPY_CHUNK_BYTES)
+                if transcoder is not None:
+                    copy_out.close()
+                    transcoder.join()
+                    if errors:
+                        raise errors[0]
+            finally:
+                # Before the connection goes back to the pool, so a late cancel can't hit its next borrower
+                active.clear()
+        sink.put(_DONE)
+    except _Cancelled:
+        pass
+    except Exception as e:
+        if not cancelled.is_set():
+            try:
+                # A failed transcoder shows up here as a broken pipe; report its error instead
+                sink.put(errors[0] if errors else e)
+            except _Cancelled:
+                pass
+    finally:
+        if transcoder is not None:
+            try:
+                copy_out.close()
+            except OSError:
+                pass
+            transcoder.join()
+        _slots.release()
+
+
+def open_export(sql: str, config: dict, fmt: str) -> Iterator[bytes]:
+    """
+    Start streaming sql's rows as fmt. Blocks until the first bytes are ready,
+    so errors from Postgres (bad SQL, permissions) surface as ExportError before
+    the response starts. Returns an iterator of byte chunks.
+    """
+    if not _slots.acquire(blocking=False):
+        raise ExportBusy("Too many exports are running, try again shortly")
+
+    cancelled = threading.Event()
+    sink = _ChunkSink(cancelled)
+    active = _ActiveConnection()
+    worker = threading.Thread(
+        target=_run_copy, args=(sql.strip().rstrip(";"), config, fmt, sink, cancelled, active),
+        name="export-copy", daemon=True
+    )
+    worker.start()
+
+    try:
+        first = sink.next()
+    except ExportError:
+        cancelled.set()
+        active.cancel()
+        raise
+    if isinstance(first, Exception):
+        worker.join()
+        raise ExportError(str(first).strip())
+
+    def chunks():
+        sent = 0
+        item = first
+        try:
+            while item is not _DONE:
+                if isinstance(item, Exception):
+                    # Headers are already out; ending early is the only way to signal failure
+                    logger.error(f"Export failed after {sent} bytes: {item}")
+                    metrics.incr("export.failed")
+                    return
+                sent += len(item)
+                yield item
+                try:
+                    item = sink.next()
+                except ExportError as e:
+                    logger.error(f"Export failed after {sent} bytes: {e}")
+                    metrics.incr("export.failed")
+                    return
+            metrics.incr("export.completed")
+        finally:
+            # Client went away or the export finished: stop COPY and release the connection
+            cancelled.set()
+            active.cancel()
+            worker.join(EXPORT_STALL_SECONDS)
+            metrics.incr(f"export.{fmt}_bytes", sent)
+
+    return chunks()
@@ -0,0 +1,673 @@
+"""
+Federated answers across several of a user's databases.
+
+The model returns a plan instead of one SQL statement. The plan has a
+read-only sub-query per database (with filters and column pruning pushed
+into it), plus how to combine the results:
+
+    {
+      "subqueries": [
+        {"name": "o", "database": "shop_db", "sql": "SELECT customer_id, total FROM orders WHERE ..."},
+        {"name": "c", "database": "crm_db", "sql": "SELECT id, name FROM customers WHERE region = 'EU'"}
+      ],
+      "joins": [{"right": "c", "on": [["o.customer_id", "c.id"]], "type": "inner"}],
+      "group_by": ["c.name"],
+      "aggregates": [{"func": "sum", "column": "o.total", "as": "total"}],
+      "select": ["c.name", "total"],
+      "order_by": [{"column": "total", "desc": true}],
+      "limit": 10
+    }
+
+All sub-queries start at once and stream through server-side cursors into
+bounded queues. The first sub-query is the probe side; each joined one is
+loaded into a hash table. A build side that outgrows its share of
+FEDERATION_MEMORY_LIMIT_MB is split into hash partitions on disk, and the
+probe side follows (a grace hash join). Group-by aggregation spills partial
+states the same way. Output is capped at the caller's row limit, so ORDER BY
+needs only a bounded top-k heap.
+"""
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+import pickle
+import queue
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import metrics
+import tracing
+from dbpool import read_only_session
+from getschemas import external_connection
+from models import ExternalDBCredential
+from sqlguard import validate_read_only
+
+logger = logging.getLogger(__name__)
+
+FEDERATION_MEMORY_LIMIT_MB = int(os.getenv("FEDERATION_MEMORY_LIMIT_MB", "256"))
+FEDERATION_SPILL_DIR = os.getenv("FEDERATION_SPILL_DIR") or None  # system temp dir by default
+FEDERATION_SPILL_PARTITIONS = int(os.getenv("FEDERATION_SPILL_PARTITIONS", "16"))
+FEDERATION_MAX_SUBQUERY_ROWS = int(os.getenv("FEDERATION_MAX_SUBQUERY_ROWS", "5000000"))
+FEDERATION_SUBQUERY_TIMEOUT_SECONDS = int(os.getenv("FEDERATION_SUBQUERY_TIMEOUT_SECONDS", "60"))
+MAX_SUBQUERIES = 6
+FETCH_BATCH_ROWS = 2000
+QUEUED_BATCHES = 4
+SPILL_FLUSH_ROWS = 1000
+AGGREGATE_FUNCTIONS = ("count", "sum", "avg", "min", "max")
+JOIN_TYPES = ("inner", "left")
+
+
+class FederationError(Exception):
+    """A plan that can't be run; the message is safe to show to the user"""
+
+
+# --- plan parsing ---------------------------------------------------------
+
+def _alias_of(column: str, known: set, where: str) -> str:
+    alias, dot, name = str(column).partition(".")
+    if not dot or not name or alias not in known:
+        raise FederationError(f"{where}: '{column}' must be written as <sub-query name>.<column>")
+    return alias
+
+
+def _list(container: Dict[str, Any], key: str, where: str) -> List[Any]:
+    value = container.get(key)
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise FederationError(f"{where}: '{key}' must be a list")
+    return value
+
+
+def _dict(item: Any, where: str) -> Dict[str, Any]:
+    if not isinstance(item, dict):
+        raise FederationError(f"{where} must be objects")
+    return item
+
+
+def _name(value: Any, where: str) -> str:
+    if not isinstance(value, str) or not value:
+        raise FederationError(f"{where} must be a non-empty string")
+    return value
+
+
+def parse_plan(text: str, databases: List[str]) -> Dict[str, Any]:
+    """Plan dict from the model's reply, checked against the user's databases; raises FederationError"""
+    start, end = (text or "").find("{"), (text or "").rfind("}")
+    if start < 0 or end < start:
+        raise FederationError("The model did not return a query plan")
+    try:
+        plan = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise FederationError(f"The query plan is not valid JSON: {e.msg}")
+    _dict(plan, "The query plan")
+
+    subqueries = _list(plan, "subqueries", "The query plan")
+    if not subqueries:
+        raise FederationError("The query plan has no sub-queries")
+    if len(subqueries) > MAX_SUBQUERIES:
+        raise FederationError(f"The query plan has more than {MAX_SUBQUERIES} sub-queries")
+
+    names = set()
+    for subquery in subqueries:
+        _dict(subquery, "Sub-queries")
+        name, database, sql = subquery.get("name"), subquery.get("database"), subquery.get("sql")
+        if not isinstance(name, str) or not re.fullmatch(r"[A-Za-z_]\w*", name) or name in names:
+            raise FederationError(f"Sub-query names must be unique identifiers, got '{name}'")
+        if not isinstance(database, str) or database not in databases:
+            raise FederationError(f"Sub-query '{name}' targets unknown database '{database}'")
+        _name(sql, f"The SQL of sub-query '{name}'")
+        problem = validate_read_only(sql)
+        if problem:
+            raise FederationError(f"Sub-query '{name}' was rejected: {problem}")
+        names.add(name)
+
+    joined = {subqueries[0]["name"]}
+    for join in _list(plan, "joins", "The query plan"):
+        _dict(join, "Joins")
+        right = join.get("right")
+        if right not in names or right in joined:
+            raise FederationError(f"Join target '{right}' is not a sub-query that hasn't been joined yet")
+        if join.get("type", "inner") not in JOIN_TYPES:
+            raise FederationError(f"Join type must be one of {', '.join(JOIN_TYPES)}")
+        pairs = _list(join, "on", f"Join with '{right}'")
+        if not pairs:
+            raise FederationError(f"Join with '{right}' has no join keys")
+        for pair in pairs:
+            if not isinstance(pair, list) or len(pair) != 2 or not all(isinstance(c, str) for c in pair):
+                raise FederationError(f"Join keys for '{right}' must be [left column, right column] pairs")
+            _alias_of(pair[0], joined, f"join with '{right}'")
+            if _alias_of(pair[1], {right}, f"join with '{right}'") != right:
+                raise FederationError(f"The right key of the join with '{right}' must come from '{right}'")
+        joined.add(right)
+    unjoined = names - joined
+    if unjoined:
+        raise FederationError(f"Sub-queries {sorted(unjoined)} are never joined")
+
+    group_by = _list(plan, "group_by", "The query plan")
+    for column in group_by:
+        _alias_of(_name(column, "group_by columns"), names, "group_by")
+    aggregates = _list(plan, "aggregates", "The query plan")
+    for aggregate in aggregates:
+        _dict(aggregate, "Aggregates")
+        if aggregate.get("func") not in AGGREGATE_FUNCTIONS:
+            raise FederationError(f"Aggregate must be one of {', '.join(AGGREGATE_FUNCTIONS)}")
+        column = aggregate.get("column", "*")
+        if column != "*":
+            _alias_of(_name(column, "Aggregate columns"), names, "aggregates")
+        _name(aggregate.get("as"), "Every aggregate's 'as' name")
+
+    # Columns each later step can refer to: after aggregation only its output exists
+    aggregated = set(group_by) | {aggregate["as"] for aggregate in aggregates} if group_by or aggregates else None
+
+    def check_column(column: Any, where: str) -> str:
+        column = _name(column, f"{where} columns")
+        if aggregated is None:
+            _alias_of(column, names, where)
+        elif column not in aggregated:
+            raise FederationError(f"{where}: '{column}' is not a group_by column or aggregate name")
+        return column
+
+    select = _list(plan, "select", "The query plan")
+    output = set()
+    for item in select:
+        if isinstance(item, dict):
+            column = check_column(item.get("column"), "select")
+            alias = item.get("as")
+            output.add(_name(alias, "select 'as' names") if alias is not None else column)
+        else:
+            output.add(check_column(item, "select"))
+
+    for order in _list(plan, "order_by", "The query plan"):
+        _dict(order, "order_by entries")
+        if select:
+            column = _name(order.get("column"), "order_by columns")
+            if column not in output:
+                raise FederationError(f"order_by: '{column}' is not one of the selected columns")
+        else:
+            check_column(order.get("column"), "order_by")
+
+    limit = plan.get("limit")
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+        raise FederationError("limit must be a positive integer")
+    return plan
+
+
+def render_plan(plan: Dict[str, Any]) -> str:
+    """Readable SQL-ish rendering of a plan for answers and conversation history"""
+    lines = [f"-- {s['name']} @ {s['database']}\n{s['sql'].strip().rstrip(';')}" for s in plan["subqueries"]]
+    for join in plan.get("joins") or []:
+        keys = " AND ".join(f"{left} = {right}" for left, right in join["on"])
+        lines.append(f"-- {join.get('type', 'inner').upper()} JOIN {join['right']} ON {keys}")
+    if plan.get("group_by") or plan.get("aggregates"):
+        aggregates = ", ".join(f"{a['func']}({a.get('column', '*')}) AS {a['as']}" for a in plan.get("aggregates") or [])
+        lines.append(f"-- GROUP BY {', '.join(plan.get('group_by') or []) or '()'}: {aggregates}")
+    if plan.get("order_by"):
+        order = ", ".join(f"{o['column']}{' DESC' if o.get('desc') else ''}" for o in plan["order_by"])
+        lines.append(f"-- ORDER BY {order}")
+    if plan.get("limit"):
+        lines.append(f"-- LIMIT {plan['limit']}")
+    return "\n".join(lines)
+
+
+# --- streaming sub-queries ------------------------------------------------
+
+_DONE = object()
+
+
+class _Source:
+    """One sub-query running on a worker thread, read as a stream of qualified row dicts"""
+
+    def __init__(self, name: str, database: str, sql: str, credential: ExternalDBCredential,
+                 cancelled: threading.Event):
+        self.name = name
+        self.database = database
+        self.sql = sql
+        self.credential = credential
+        self.columns: Optional[List[str]] = None
+        self.rows = 0
+        self.elapsed_ms = 0.0
+        self._cancelled = cancelled
+        self._queue: "queue.Queue" = queue.Queue(maxsize=QUEUED_BATCHES)
+        self._conn = None
+        self._conn_lock = threading.Lock()
+
+    def _set_conn(self, conn):
+        with self._conn_lock:
+            self._conn = conn
+
+    def cancel(self):
+        """Interrupt a statement still running on the server"""
+        # Under the lock, so the connection can't go back to the pool mid-cancel
+        with self._conn_lock:
+            if self._conn is not None:
+                try:
+                    self._conn.cancel()
+                except Exception:
+                    pass
+
+    def _put(self, item) -> bool:
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(self):
+        start = time.perf_counter()
+        with tracing.span("federation.subquery", **{"federation.name": self.name, "db.name": self.database}) as span:
+            try:
+                with external_connection(self.credential) as conn:
+                    if not conn:
+                        raise FederationError(f"Failed to connect to database '{self.database}'")
+                    self._set_conn(conn)
+                    try:
+                        # The sub-query text goes into DECLARE ... FOR over the simple query protocol,
+                        # so it is read only at the session level too, not just this transaction
+                        with read_only_session(conn):
+                            with conn.cursor() as cur:
+                                cur.execute("SET TRANSACTION READ ONLY")
+                                cur.execute("SET LOCAL statement_timeout = %s",
+                                            (FEDERATION_SUBQUERY_TIMEOUT_SECONDS * 1000,))
+                            with conn.cursor(name=f"federation_{self.name}_{uuid.uuid4().hex[:8]}") as cur:
+                                cur.itersize = FETCH_BATCH_ROWS
+                                cur.execute(self.sql.strip().rstrip(";"))
+                                while not self._cancelled.is_set():
+                                    batch = cur.fetchmany(FETCH_BATCH_ROWS)
+                                    if self.columns is None:
+                                        self.columns = [f"{self.name}.{d[0]}" for d in cur.description]
+                                    if not batch:
+                                        break
+                                    self.rows += len(batch)
+                                    if self.rows > FEDERATION_MAX_SUBQUERY_ROWS:
+                                        raise FederationError(
+                                            f"Sub-query '{self.name}' returned more than "
+                                            f"{FEDERATION_MAX_SUBQUERY_ROWS} rows; add filters to it"
+                                        )
+                                    if not self._put([dict(zip(self.columns, row)) for row in batch]):
+                                        break
+                    finally:
+                        # Before the connection goes back to the pool, so a late cancel can't hit its next borrower
+                        self._set_conn(None)
+                self._put(_DONE)
+            except FederationError as e:
+                span.record_error(e)
+                self._put(e)
+            except Exception as e:
+                if self._cancelled.is_set():
+                    return
+                span.record_error(e)
+                self._put(FederationError(f"Sub-query '{self.name}' on '{self.database}' failed: {e}"))
+            finally:
+                self.elapsed_ms = (time.perf_counter() - start) * 1000
+                span.set_attributes(**{"db.rows": self.rows, "federation.elapsed_ms": round(self.elapsed_ms, 1)})
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield from item
+
+
+# --- spill files ----------------------------------------------------------
+
+class _Spill:
+    """Rows hash-partitioned into pickle files under one temp directory"""
+
+    def __init__(self, directory: str, label: str, partitions: int = FEDERATION_SPILL_PARTITIONS):
+        self.partitions = partitions
+        self._paths = [os.path.join(directory, f"{label}-{i}.pickle") for i in range(partitions)]
+        self._buffers: List[List[Any]] = [[] for _ in range(partitions)]
+        self.bytes = 0
+
+    def add(self, key: Tuple, item: Any):
+        partition = hash(key) % self.partitions
+        buffer = self._buffers[partition]
+        buffer.append(item)
+        if len(buffer) >= SPILL_FLUSH_ROWS:
+            self._flush(partition)
+
+    def _flush(self, partition: int):
+        if self._buffers[partition]:
+            with open(self._paths[partition], "ab") as f:
+                start = f.tell()
+                pickle.dump(self._buffers[partition], f, pickle.HIGHEST_PROTOCOL)
+                self.bytes += f.tell() - start
+            self._buffers[partition] = []
+
+    def finish(self):
+        for partition in range(self.partitions):
+            self._flush(partition)
+        metrics.incr("federation.spilled_bytes", self.bytes)
+
+    def read(self, partition: int) -> Iterator[Any]:
+        path = self._paths[partition]
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    yield from pickle.load(f)
+                except EOFError:
+                    break
+        os.remove(path)
+
+
+class _Budget:
+    """Approximate memory accounting for one operator"""
+
+    def __init__(self, limit_bytes: int):
+        self.limit = limit_bytes
+        self.used = 0
+        self.peak = 0
+
+    def add(self, size: int) -> bool:
+        """Account for size bytes; False once the operator is over its limit"""
+        self.used += size
+        self.peak = max(self.peak, self.used)
+        return self.used <= self.limit
+
+    def reset(self):
+        self.used = 0
+
+
+def _row_size(row: Dict[str, Any]) -> int:
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values())
+
+
+def _key_value(value):
+    # Keys from different databases must compare equal: UUID columns vs text ids
+    return str(value) if isinstance(value, uuid.UUID) else value
+
+
+def _row_key(row: Dict[str, Any], columns: List[str], source: str) -> Tuple:
+    try:
+        return tuple(_key_value(row[column]) for column in columns)
+    except KeyError as e:
+        raise FederationError(f"Column {e} is not returned by {source}")
+
+
+# --- operators ------------------------------------------------------------
+
+def _hash_join(probe: Iterator[Dict], build: _Source, probe_keys: List[str], build_keys: List[str],
+               how: str, budget: _Budget, spill_dir: str, stats: Dict[str, Any]) -> Iterator[Dict]:
+    table: Dict[Tuple, List[Dict]] = defaultdict(list)
+    build_spill: Optional[_Spill] = None
+    for row in build:
+        key = _row_key(row, build_keys, f"sub-query '{build.name}'")
+        if None in key:
+            continue
+        if build_spill is not None:
+            build_spill.add(key, row)
+        elif not budget.add(_row_size(row)):
+            logger.info(f"Federated join with '{build.name}' over memory budget, spilling to disk")
+            build_spill = _Spill(spill_dir, f"build-{build.name}")
+            for spilled_key, rows in table.items():
+                for spilled in rows:
+                    build_spill.add(spilled_key, spilled)
+            build_spill.add(key, row)
+            table.clear()
+            budget.reset()
+        else:
+            table[key].append(row)
+
+    empty = dict.fromkeys(build.columns or [])
+
+    def probe_rows(rows: Iterator[Dict], lookup: Dict[Tuple, List[Dict]]):
+        for row in rows:
+            matches = lookup.get(_row_key(row, probe_keys, "the joined rows"))
+            if matches:
+                for match in matches:
+                    yield {**row, **match}
+            elif how == "left":
+                yield {**row, **empty}
+
+    if build_spill is None:
+        yield from probe_rows(probe, table)
+        return
+
+    build_spill.finish()
+    stats["spills"].append(build.name)
+    probe_spill = _Spill(spill_dir, f"probe-{build.name}")
+    for row in probe:
+        key = _row_key(row, probe_keys, "the joined rows")
+        if None in key:
+            if how == "left":
+                yield {**row, **empty}
+            continue
+        probe_spill.add(key, row)
+    probe_spill.finish()
+    stats["spilled_bytes"] += build_spill.bytes + probe_spill.bytes
+
+    for partition in range(build_spill.partitions):
+        partition_table: Dict[Tuple, List[Dict]] = defaultdict(list)
+        for row in build_spill.read(partition):
+            partition_table[_row_key(row, build_keys, f"sub-query '{build.name}'")].append(row)
+        yield from probe_rows(probe_spill.read(partition), partition_table)
+
+
+def _new_state(func: str):
+    return [0, 0] if func == "avg" else (0 if func == "count" else None)
+
+
+def _update_state(func: str, state, value):
+    if func == "count":
+        return state + 1
+    if value is None:
+        return state
+    if func == "avg":
+        state[0] += value
+        state[1] += 1
+        return state
+    if state is None:
+        return value
+    if func == "sum":
+        return state + value
+    return min(state, value) if func == "min" else max(state, value)
+
+
+def _merge_state(func: str, state, other):
+    if func == "count":
+        return state + other
+    if func == "avg":
+        return [state[0] + other[0], state[1] + other[1]]
+    if state is None or other is None:
+        return other if state is None else state
+    if func == "sum":
+        return state + other
+    return min(state, other) if func == "min" else max(state, other)
+
+
+def _final_value(func: str, state):
+    if func == "avg":
+        return state[0] / state[1] if state[1] else None
+    return state
+
+
+def _aggregate(rows: Iterator[Dict], group_by: List[str], aggregates: List[Dict], budget: _Budget,
+               spill_dir: str, stats: Dict[str, Any]) -> Iterator[Dict]:
+    funcs = [a["func"] for a in aggregates]
+    groups: Dict[Tuple, List[Any]] = {}
+    spill: Optional[_Spill] = None
+
+    def add(key, states, into):
+        existing = into.get(key)
+        if existing is None:
+            into[key] = states
+        else:
+            into[key] = [_merge_state(func, a, b) for func, a, b in zip(funcs, existing, states)]
+
+    for row in rows:
+        key = _row_key(row, group_by, "the joined rows")
+        states = groups.get(key)
+        if states is None:
+            states = groups[key] = [_new_state(func) for func in funcs]
+            if not budget.add(sys.getsizeof(key) + sum(sys.getsizeof(v) for v in key) + 64 * len(funcs)):
+                # Park partial states on disk and start over; partitions are merged at the end
+                spill = spill or _Spill(spill_dir, "aggregate")
+                for spilled_key, spilled_states in groups.items():
+                    spill.add(spilled_key, (spilled_key, spilled_states))
+                groups = {}
+                budget.reset()
+                states = groups[key] = [_new_state(func) for func in funcs]
+        for i, aggregate in enumerate(aggregates):
+            column = aggregate.get("column", "*")
+            value = None if column == "*" else _row_key(row, [column], "the joined rows")[0]
+            if funcs[i] == "count" and column != "*" and value is None:
+                continue
+            states[i] = _update_state(funcs[i], states[i], value)
+
+    if not group_by and not groups and spill is None:
+        groups[()] = [_new_state(func) for func in funcs]
+
+    def emit(key, states):
+        out = {column: value for column, value in zip(group_by, key)}
+        for aggregate, func, state in zip(aggregates, funcs, states):
+            out[aggregate["as"]] = _final_value(func, state)
+        return out
+
+    if spill is None:
+        for key, states in groups.items():
+            yield emit(key, states)
+        return
+
+    for key, states in groups.items():
+        spill.add(key, (key, states))
+    groups = {}
+    spill.finish()
+    stats["spills"].append("aggregate")
+    stats["spilled_bytes"] += spill.bytes
+    for partition in range(spill.partitions):
+        merged: Dict[Tuple, List[Any]] = {}
+        for key, states in spill.read(partition):
+            add(key, states, merged)
+        for key, states in merged.items():
+            yield emit(key, states)
+
+
+class _SortKey:
+    """Per-column ordering with DESC support; NULLs last, mixed types compared as text"""
+
+    __slots__ = ("values", "descending")
+
+    def __init__(self, values: Tuple, descending: Tuple):
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other: "_SortKey") -> bool:
+        for a, b, desc in zip(self.values, other.values, self.descending):
+            if a == b:
+                continue
+            if a is None or b is None:
+                return b is None
+            try:
+                less = a < b
+            except TypeError:
+                less = str(a) < str(b)
+            return not less if desc else less
+        return False
+
+
+def _project(rows: Iterator[Dict], select: List[Any]) -> Iterator[Dict]:
+    for row in rows:
+        out = {}
+        for item in select:
+            column, alias = (item.get("column"), item.get("as")) if isinstance(item, dict) else (item, None)
+            if column not in row:
+                raise FederationError(f"Selected column '{column}' is not in the combined result")
+            out[alias or column] = row[column]
+        yield out
+
+
+def execute_plan(plan: Dict[str, Any], credentials_by_name: Dict[str, ExternalDBCredential],
+                 limit: int) -> Dict[str, Any]:
+    """
+    Run a parse_plan() plan; returns the same shape as llmcall.execute_sql_query
+    plus "stats" (per-sub-query rows and timings, spills).
+    """
+    cancelled = threading.Event()
+    sources = {
+        s["name"]: _Source(s["name"], s["database"], s["sql"], credentials_by_name[s["database"]], cancelled)
+        for s in plan["subqueries"]
+    }
+    joins = plan.get("joins") or []
+    aggregating = bool(plan.get("group_by") or plan.get("aggregates"))
+    # Each hash table, and the aggregation, get an equal share of the memory limit
+    share = FEDERATION_MEMORY_LIMIT_MB * 1024 * 1024 // max(1, len(joins) + int(aggregating))
+    stats: Dict[str, Any] = {"spills": [], "spilled_bytes": 0}
+    budgets: List[_Budget] = []
+    spill_dir = tempfile.mkdtemp(prefix="federation-", dir=FEDERATION_SPILL_DIR)
+    start = time.perf_counter()
+
+    with tracing.span("federation.execute_plan", **{"federation.subqueries": len(sources)}) as span, \
+            ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="federation") as pool:
+        for source in sources.values():
+            pool.submit(contextvars.copy_context().run, source.produce)
+        try:
+            rows: Iterator[Dict] = iter(sources[plan["subqueries"][0]["name"]])
+            for join in joins:
+                budgets.append(_Budget(share))
+                rows = _hash_join(
+                    rows, sources[join["right"]],
+                    [left for left, _ in join["on"]], [right for _, right in join["on"]],
+                    join.get("type", "inner"), budgets[-1], spill_dir, stats
+                )
+            if aggregating:
+                budgets.append(_Budget(share))
+                rows = _aggregate(rows, plan.get("group_by") or [], plan.get("aggregates") or [],
+                                  budgets[-1], spill_dir, stats)
+            if plan.get("select"):
+                rows = _project(rows, plan["select"])
+
+            limit = min(plan.get("limit") or limit, limit)
+            order_by = plan.get("order_by") or []
+            if order_by:
+                columns = [o["column"] for o in order_by]
+                descending = tuple(bool(o.get("desc")) for o in order_by)
+
+                def sort_key(row):
+                    return _SortKey(tuple(row.get(column) for column in columns), descending)
+
+                data = heapq.nsmallest(limit, rows, key=sort_key)
+            else:
+                data = list(itertools.islice(rows, limit))
+        except FederationError as e:
+            span.record_error(e)
+            return {"error": str(e), "data": []}
+        finally:
+            # Stop producers that are still streaming (LIMIT reached or an error)
+            cancelled.set()
+            for source in sources.values():
+                source.cancel()
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+        stats.update({
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+            "peak_memory_bytes": sum(budget.peak for budget in budgets),
+            "subqueries": {
+                name: {"database": s.database, "rows": s.rows, "elapsed_ms": round(s.elapsed_ms, 1)}
+                for name, s in sources.items()
+            },
+        })
+        span.set_attributes(**{
+            "federation.spilled_bytes": stats["spilled_bytes"],
+            "federation.peak_memory_bytes": stats["peak_memory_bytes"]
+        })
+    metrics.observe("federation.execute_ms", stats["elapsed_ms"])
+    columns = list(data[0].keys()) if data else []
+    return {"data": data, "columns": columns, "row_count": len(data), "error": "", "stats": stats}
@@ -0,0 +1,195 @@
+import logging
+import re
+import threading
+import zlib
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from background import scheduler
+from database import SessionLocal
+from models import FewShotExample
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Questions are embedded as hashed word + character-trigram counts. That's cheap,
+# needs no model download and is good enough to find "the same kind of question"
+# within one database's history.
+VECTOR_DIM = 4096
+MAX_EXAMPLES_PER_DATABASE = 2000
+MIN_SIMILARITY = 0.25
+CONFIRMED_BOOST = 0.05
+
+_WORD_RE = re.compile(r"[a-z0-9_]+")
+
+
+def vectorize(text: str) -> "np.ndarray":
+    """L2-normalised hashed n-gram vector for a question"""
+    # numpy is imported on first use; it is the slowest import on the app's startup path
+    import numpy as np
+
+    vec = np.zeros(VECTOR_DIM, dtype=np.float32)
+    words = _WORD_RE.findall(text.lower())
+    for word in words:
+        vec[zlib.crc32(b"w:" + word.encode()) % VECTOR_DIM] += 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            vec[zlib.crc32(b"c:" + padded[i:i + 3].encode()) % VECTOR_DIM] += 0.5
+    for first, second in zip(words, words[1:]):
+        vec[zlib.crc32(f"b:{first} {second}".encode()) % VECTOR_DIM] += 1.0
+
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+class ExampleIndex:
+    """Question -> SQL pairs for one database with a dense matrix for top-k cosine search"""
+
+    def __init__(self, capacity: int = 64):
+        import numpy as np
+
+        self.questions: List[str] = []
+        self.sqls: List[str] = []
+        self.sources: List[str] = []
+        self._keys = set()
+        self._matrix = np.zeros((capacity, VECTOR_DIM), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.questions)
+
+    def add(self, question: str, sql: str, source: str) -> bool:
+        key = (_normalize(question), _normalize(sql))
+        if key in self._keys:
+            if source == "confirmed":
+                # A confirmation upgrades an example we already had from execution
+                self.sources[self._position(key)] = source
+            return False
+
+        if len(self.questions) >= MAX_EXAMPLES_PER_DATABASE:
+            self._drop_oldest()
+        if len(self.questions) == self._matrix.shape[0]:
+            import numpy as np
+            self._matrix = np.vstack([self._matrix, np.zeros_like(self._matrix)])
+
+        self._matrix[len(self.questions)] = vectorize(question)
+        self.questions.append(question)
+        self.sqls.append(sql)
+        self.sources.append(source)
+        self._keys.add(key)
+        return True
+
+    def _position(self, key) -> int:
+        for i, (question, sql) in enumerate(zip(self.questions, self.sqls)):
+            if (_normalize(question), _normalize(sql)) == key:
+                return i
+        raise KeyError(key)
+
+    def _drop_oldest(self):
+        self._keys.discard((_normalize(self.questions[0]), _normalize(self.sqls[0])))
+        count = len(self.questions)
+        self._matrix[:count - 1] = self._matrix[1:count]
+        del self.questions[0], self.sqls[0], self.sources[0]
+
+    def search(self, query_vec: "np.ndarray", k: int) -> List[Dict]:
+        import numpy as np
+
+        count = len(self.questions)
+        if count == 0:
+            return []
+
+        scores = self._matrix[:count] @ query_vec
+        scores += np.array([CONFIRMED_BOOST if s == "confirmed" else 0.0 for s in self.sources], dtype=np.float32)
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"question": self.questions[i], "sql": self.sqls[i], "source": self.sources[i], "score": float(scores[i])}
+            for i in top
+        ]
+
+
+_lock = threading.Lock()
+_indexes: Dict[str, ExampleIndex] = {}
+
+
+def _load_index(credential_id: str) -> ExampleIndex:
+    index = ExampleIndex()
+    db = SessionLocal()
+    try:
+        rows = db.query(FewShotExample).filter(
+            FewShotExample.credential_id == credential_id
+        ).order_by(FewShotExample.created_at.desc()).limit(MAX_EXAMPLES_PER_DATABASE).all()
+        for row in reversed(rows):
+            index.add(row.question, row.sql, row.source)
+    except Exception as e:
+        logger.error(f"Failed to load few-shot examples for {credential_id}: {e}")
+    finally:
+        db.close()
+    return index
+
+
+def _get_index(credential_id: str) -> ExampleIndex:
+    with _lock:
+        index = _indexes.get(credential_id)
+    if index is None:
+        loaded = _load_index(credential_id)
+        with _lock:
+            index = _indexes.setdefault(credential_id, loaded)
+    return index
+
+
+def _persist_example(credential_id: str, question: str, sql: str, source: str):
+    db = SessionLocal()
+    try:
+        db.add(FewShotExample(credential_id=credential_id, question=question, sql=sql, source=source))
+        db.commit()
+    finally:
+        db.close()
+
+
+def record_example(credential_id, question: str, sql: str, source: str = "executed") -> bool:
+    """Remember a question -> SQL pair that executed successfully or that a user confirmed"""
+    if not question or not question.strip() or not sql or not sql.strip():
+        return False
+
+    credential_id = str(credential_id)
+    index = _get_index(credential_id)
+    with _lock:
+        added = index.add(question, sql, source)
+    if added or source == "confirmed":
+        scheduler.submit(
+            f"fewshot:{credential_id}:{hash((_normalize(question), _normalize(sql), source))}",
+            _persist_example, credential_id, question, sql, source
+        )
+    return added
+
+
+def nearest_examples(credential_ids: List, question: str, k: int = 3,
+                     min_score: float = MIN_SIMILARITY) -> List[Dict]:
+    """Top-k most similar stored examples across the given databases"""
+    if not credential_ids or not question:
+        return []
+
+    query_vec = vectorize(question)
+    candidates = []
+    for credential_id in credential_ids:
+        index = _get_index(str(credential_id))
+        with _lock:
+            hits = index.search(query_vec, k)
+        for hit in hits:
+            hit["credential_id"] = str(credential_id)
+        candidates.extend(hits)
+
+    candidates.sort(key=lambda hit: hit["score"], reverse=True)
+    return [hit for hit in candidates if hit["score"] >= min_score][:k]
+
+
+def forget_database(credential_id):
+    """Drop the in-memory index for a deleted credential (rows cascade in the DB)"""
+    with _lock:
+        _indexes.pop(str(credential_id), None)
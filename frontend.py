@@ -1,10 +1,24 @@
 # app.py
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Any, List
 
 API_BASE = "http://localhost:8000"  # <-- change if your FastAPI runs elsewhere
+REQUEST_TIMEOUT = 15
+# Full exports run the whole query server-side, so they get longer than other calls
+EXPORT_TIMEOUT = 600
+# Bulk imports wait for every connectivity check (bounded server-side)
+BULK_IMPORT_TIMEOUT = 90
+# How long connection lists / summaries are reused across reruns. Adding or
+# deleting a connection (or pressing Refresh) clears them immediately.
+CREDENTIALS_TTL_SECONDS = 300
+SUMMARY_TTL_SECONDS = 120
+# Only the newest few answers render their tables by default; older ones are
+# behind a checkbox so long chats don't re-send every table on each rerun.
+RECENT_RESULT_TABLES = 3
 
 st.set_page_config(page_title="DataChat AI", layout="wide")
 
@@ -21,6 +35,8 @@ if "credentials" not in st.session_state:
     st.session_state.credentials = None
 if "summary" not in st.session_state:
     st.session_state.summary = None
+if "conversation_id" not in st.session_state:
+    st.session_state.conversation_id: Optional[str] = None
 
 
 # -------------------------
@@ -31,9 +47,18 @@ def auth_headers():
         return {"Authorization": f"Bearer {st.session_state.access_token}"}
     return {}
 
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One pooled keep-alive session shared by every rerun and browser session"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=20)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 def api_get(path: str, params: dict = None) -> Optional[requests.Response]:
     try:
-        resp = requests.get(f"{API_BASE}{path}", headers=auth_headers(), params=params, timeout=15)
+        resp = get_http_session().get(f"{API_BASE}{path}", headers=auth_headers(), params=params, timeout=REQUEST_TIMEOUT)
         return resp
     except Exception as e:
         st.error(f"Network error: {e}")
@@ -42,9 +67,9 @@ def api_get(path: str, params: dict = None) -> Optional[requests.Response]:
 def api_post(path: str, json: dict = None, data: dict = None) -> Optional[requests.Response]:
     try:
         if data is not None:
-            resp = requests.post(f"{API_BASE}{path}", data=data, headers=auth_headers(), timeout=15)
+            resp = get_http_session().post(f"{API_BASE}{path}", data=data, headers=auth_headers(), timeout=REQUEST_TIMEOUT)
         else:
-            resp = requests.post(f"{API_BASE}{path}", json=json, headers=auth_headers(), timeout=15)
+            resp = get_http_session().post(f"{API_BASE}{path}", json=json, headers=auth_headers(), timeout=REQUEST_TIMEOUT)
         return resp
     except Exception as e:
         st.error(f"Network error: {e}")
@@ -52,7 +77,7 @@ def api_post(path: str, json: dict = None, data: dict = None) -> Optional[reques
 
 def api_delete(path: str) -> Optional[requests.Response]:
     try:
-        resp = requests.delete(f"{API_BASE}{path}", headers=auth_headers(), timeout=15)
+        resp = get_http_session().delete(f"{API_BASE}{path}", headers=auth_headers(), timeout=REQUEST_TIMEOUT)
         return resp
     except Exception as e:
         st.error(f"Network error: {e}")
@@ -78,7 +103,7 @@ def login_user(email: str, password: str):
     # OAuth2PasswordRequestForm expects form-encoded data
     data = {"username": email, "password": password}
     try:
-        resp = requests.post(f"{API_BASE}/token", data=data, headers={"Content-Type": "application/x-www-form-urlencoded"}, timeout=15)
+        resp = get_http_session().post(f"{API_BASE}/token", data=data, headers={"Content-Type": "application/x-www-form-urlencoded"}, timeout=REQUEST_TIMEOUT)
     except Exception as e:
         st.error(f"Network error: {e}")
         return
@@ -90,9 +115,7 @@ def login_user(email: str, password: str):
             return
         st.session_state.access_token = token
         # fetch user and connection info
-        fetch_user()
-        fetch_credentials()
-        fetch_summary()
+        fetch_initial_state()
         st.rerun()
     else:
         try:
@@ -104,6 +127,7 @@ def logout():
     st.session_state.access_token = None
     st.session_state.user = None
     st.session_state.messages = []
+    st.session_state.conversation_id = None
     st.session_state.credentials = None
     st.session_state.summary = None
     st.rerun()
@@ -111,6 +135,36 @@ def logout():
 # -------------------------
 # Fetch / utility functions
 # -------------------------
+def _get_json(path: str, token: str) -> Any:
+    """Plain GET returning parsed JSON; raises on any failure so nothing bad gets cached"""
+    resp = get_http_session().get(
+        f"{API_BASE}{path}",
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=REQUEST_TIMEOUT
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+# Cached per token (i.e. per signed-in user). Safe to call from worker threads.
+@st.cache_data(ttl=CREDENTIALS_TTL_SECONDS, show_spinner=False)
+def _cached_credentials(token: str) -> Any:
+    return _get_json("/db-connections", token)
+
+@st.cache_data(ttl=SUMMARY_TTL_SECONDS, show_spinner=False)
+def _cached_summary(token: str) -> Any:
+    return _get_json("/llm-chat/summary", token)
+
+def _safe_call(fn, token: str) -> Any:
+    try:
+        return fn(token)
+    except Exception:
+        return None
+
+def invalidate_connection_cache():
+    """Call whenever the set of connections changes"""
+    _cached_credentials.clear()
+    _cached_summary.clear()
+
 def fetch_user():
     resp = api_get("/me")
     if not resp:
@@ -123,31 +177,23 @@ def fetch_user():
 
 def fetch_credentials():
     """GET /db-connections returning the stored credentials (with id)."""
-    resp = api_get("/db-connections")
-    if not resp:
-        st.session_state.credentials = None
-        return
-    if resp.status_code == 200:
-        try:
-            st.session_state.credentials = resp.json()
-        except Exception:
-            st.session_state.credentials = None
-    else:
-        st.session_state.credentials = None
+    st.session_state.credentials = _safe_call(_cached_credentials, st.session_state.access_token)
 
 def fetch_summary():
     """GET /llm-chat/summary which returns status/table counts (may not include ids)."""
-    resp = api_get("/llm-chat/summary")
-    if not resp:
-        st.session_state.summary = None
-        return
-    if resp.status_code == 200:
-        try:
-            st.session_state.summary = resp.json()
-        except Exception:
-            st.session_state.summary = None
-    else:
-        st.session_state.summary = None
+    st.session_state.summary = _safe_call(_cached_summary, st.session_state.access_token)
+
+def fetch_initial_state():
+    """Fetch user, credentials and summary concurrently right after sign-in"""
+    token = st.session_state.access_token
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        user = pool.submit(_safe_call, lambda t: _get_json("/me", t), token)
+        credentials = pool.submit(_safe_call, _cached_credentials, token)
+        summary = pool.submit(_safe_call, _cached_summary, token)
+    # session_state is only touched from the script thread
+    st.session_state.user = user.result()
+    st.session_state.credentials = credentials.result()
+    st.session_state.summary = summary.result()
 
 def add_db_connection(name, host, port, dbname, db_user, db_password, owner_username=None):
     payload = {
@@ -164,6 +210,7 @@ def add_db_connection(name, host, port, dbname, db_user, db_password, owner_user
         return
     if resp.status_code in (200, 201):
         st.success("Database connection added.")
+        invalidate_connection_cache()
         fetch_credentials()
         fetch_summary()
         st.rerun()
@@ -173,12 +220,41 @@ def add_db_connection(name, host, port, dbname, db_user, db_password, owner_user
         except Exception:
             st.error(resp.text)
 
+def import_db_connections(uploaded_file):
+    """Bulk import from a CSV/JSON file; every credential is validated server-side first"""
+    try:
+        resp = get_http_session().post(
+            f"{API_BASE}/db-connections/bulk/file",
+            files={"file": (uploaded_file.name, uploaded_file.getvalue())},
+            headers=auth_headers(),
+            timeout=BULK_IMPORT_TIMEOUT
+        )
+    except Exception as e:
+        st.error(f"Network error: {e}")
+        return
+    if resp.status_code != 200:
+        try:
+            st.error(resp.json().get("detail", resp.text))
+        except Exception:
+            st.error(resp.text)
+        return
+    result = resp.json()
+    st.success(f"Imported {result['created']} connection(s), {result['rejected']} rejected.")
+    rejected = [item for item in result["items"] if item["status"] != "created"]
+    if rejected:
+        st.dataframe(pd.DataFrame(rejected)[["index", "name", "host", "dbname", "status", "error"]])
+    if result["created"]:
+        invalidate_connection_cache()
+        fetch_credentials()
+        fetch_summary()
+
 def delete_db_connection(connection_id: str):
     resp = api_delete(f"/db-connections/{connection_id}")
     if resp is None:
         return
     if resp.status_code in (200, 204):
         st.success("Deleted connection.")
+        invalidate_connection_cache()
         fetch_credentials()
         fetch_summary()
         st.rerun()
@@ -189,15 +265,29 @@ def delete_db_connection(connection_id: str):
             st.error(resp.text)
 
 def ask_llm(question: str) -> Optional[Dict[str, Any]]:
-    resp = api_post("/llm-chat/ask", json={"question": question})
+    # Follow-ups go to the same server-side conversation, which keeps the context
+    payload = {
+        "question": question,
+        "conversation_id": st.session_state.conversation_id,
+        "new_conversation": st.session_state.conversation_id is None,
+        "federated": st.session_state.get("federated", False),
+    }
+    resp = api_post("/llm-chat/ask", json=payload)
     if resp is None:
         return None
+    if resp.status_code == 404 and st.session_state.conversation_id:
+        # Conversation is gone (e.g. deleted server-side); start a new one
+        st.session_state.conversation_id = None
+        return ask_llm(question)
     if resp.status_code == 200:
         try:
-            return resp.json()
+            res = resp.json()
         except Exception:
             st.error("Invalid response from /llm-chat/ask")
             return None
+        if res.get("conversation_id"):
+            st.session_state.conversation_id = res["conversation_id"]
+        return res
     else:
         try:
             st.error(resp.json().get("detail", resp.text))
@@ -205,6 +295,97 @@ def ask_llm(question: str) -> Optional[Dict[str, Any]]:
             st.error(resp.text)
         return None
 
+def fetch_result_page(handle: str, page: int) -> Optional[Dict[str, Any]]:
+    resp = api_get(f"/llm-chat/results/{handle}", params={"page": page})
+    if resp is None:
+        return None
+    if resp.status_code == 200:
+        return resp.json()
+    if resp.status_code == 404:
+        st.warning("These results have expired. Ask the question again to refresh them.")
+    else:
+        st.error(resp.text)
+    return None
+
+def fetch_export(sql: str, database: str, fmt: str) -> Optional[bytes]:
+    """Every row of the query as a file, from the COPY-based export endpoint"""
+    try:
+        resp = get_http_session().post(
+            f"{API_BASE}/llm-chat/export",
+            json={"sql": sql, "database": database, "format": fmt},
+            headers=auth_headers(),
+            timeout=EXPORT_TIMEOUT
+        )
+    except Exception as e:
+        st.error(f"Network error: {e}")
+        return None
+    if resp.status_code == 200:
+        return resp.content
+    try:
+        st.error(resp.json().get("detail", resp.text))
+    except Exception:
+        st.error(resp.text)
+    return None
+
+def make_result_message(res: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Result part of an assistant message: the handle plus the first page as a
+    DataFrame built once, never the full row list.
+    """
+    data = res.get("data")
+    if not data or not isinstance(data, list):
+        return None
+    try:
+        first_page = pd.DataFrame(data)
+    except Exception:
+        return None
+    return {
+        "handle": res.get("result_handle"),
+        "total_rows": res.get("total_rows") or len(data),
+        "page_size": res.get("page_size") or len(data),
+        "page": 0,
+        "first_page": first_page,
+        "page_df": first_page,
+        # Federated answers have no single SQL statement to export
+        "export": None if res.get("plan") else {"sql": res.get("sql_used"), "database": res.get("database")},
+    }
+
+def render_result(result: Dict[str, Any], key: str):
+    """Show one page of a result; other pages are fetched only when selected"""
+    total_rows = result["total_rows"]
+    page_size = result["page_size"]
+    page_count = max(1, (total_rows + page_size - 1) // page_size)
+
+    page = 0
+    if result.get("handle") and page_count > 1:
+        page = st.number_input(
+            f"Page (of {page_count}, {total_rows} rows)",
+            min_value=1, max_value=page_count, value=result["page"] + 1, step=1, key=f"page_{key}"
+        ) - 1
+
+    if page != result["page"]:
+        if page == 0:
+            result["page_df"] = result["first_page"]
+            result["page"] = 0
+        else:
+            fetched = fetch_result_page(result["handle"], page)
+            if fetched is not None:
+                # Keep only the first page and the one being viewed in the session
+                result["page_df"] = pd.DataFrame(fetched["rows"], columns=fetched["columns"])
+                result["page"] = page
+
+    st.dataframe(result["page_df"])
+
+    export_source = result.get("export")
+    if export_source and export_source.get("sql") and export_source.get("database"):
+        fmt = st.selectbox("Export format", ["csv", "parquet"], key=f"export_fmt_{key}")
+        if st.button("Prepare full export", key=f"export_{key}"):
+            content = fetch_export(export_source["sql"], export_source["database"], fmt)
+            if content is not None:
+                st.download_button(
+                    f"Download {fmt.upper()}", content, file_name=f"export.{fmt}", key=f"download_{key}"
+                )
+
 # -------------------------
 # UI: Sidebar (user + DB list + add/delete)
 # -------------------------
@@ -258,7 +439,9 @@ def render_sidebar():
                 if s:
                     status = s.get("status", "-")
                     tables = s.get("table_count", "-")
-                    st.markdown(f"<div style='margin-top:6px; font-size:13px;'>Status: {status} &nbsp;&nbsp; Tables: {tables}</div>", unsafe_allow_html=True)
+                    rows = s.get("approx_rows")
+                    rows_info = f" &nbsp;&nbsp; ~{rows:,} rows" if isinstance(rows, int) else ""
+                    st.markdown(f"<div style='margin-top:6px; font-size:13px;'>Status: {status} &nbsp;&nbsp; Tables: {tables}{rows_info}</div>", unsafe_allow_html=True)
                 st.markdown("</div>", unsafe_allow_html=True)
 
                 # delete button under each card
@@ -291,9 +474,15 @@ def render_sidebar():
             #     else:
             #         add_db_connection(add_name, add_host, add_port, add_dbname, add_user, add_pass, add_owner)
 
+        with st.expander("Import from file"):
+            st.caption("CSV with columns name,host,port,dbname,db_user,db_password, or a JSON list")
+            import_file = st.file_uploader("Credentials file", type=["csv", "json"], key="import_file")
+            if import_file is not None and st.button("Import connections", key="import_submit"):
+                import_db_connections(import_file)
         
         st.markdown("---")
         if st.button("Refresh connections", key="refresh_connections"):
+            invalidate_connection_cache()
             fetch_credentials()
             fetch_summary()
             st.rerun()
@@ -332,17 +521,26 @@ def login_register_page():
 
 def main_chat_page():
     st.title("Natural Language Database Chat")
+    if st.session_state.messages and st.button("New conversation"):
+        st.session_state.messages = []
+        st.session_state.conversation_id = None
+        st.rerun()
+    st.checkbox("Combine data from several databases", key="federated",
+                help="Plans one query per database and joins the results on the server")
     # top quick info
     if st.session_state.summary and isinstance(st.session_state.summary, dict):
         total_tables = st.session_state.summary.get("total_tables", "-")
         st.caption(f"Total tables (all connections): {total_tables}")
 
     # Render chat history using st.chat_message
-    for msg in st.session_state.messages:
+    messages = st.session_state.messages
+    result_positions = [i for i, m in enumerate(messages) if m.get("result")]
+    recent_results = set(result_positions[-RECENT_RESULT_TABLES:])
+    for i, msg in enumerate(messages):
         role = msg.get("role", "assistant")  # 'user' or 'assistant'
         content = msg.get("content", "")
         sql = msg.get("sql")
-        data = msg.get("data")
+        result = msg.get("result")
         with st.chat_message(role):
             # message text
             st.write(content)
@@ -351,12 +549,9 @@ def main_chat_page():
                 with st.expander("SQL used"):
                     st.code(sql, language="sql")
             # tabular data
-            if data and isinstance(data, list) and len(data) > 0:
-                try:
-                    df = pd.DataFrame(data)
-                    st.dataframe(df)
-                except Exception:
-                    st.write(data)
+            if result:
+                if i in recent_results or st.checkbox(f"Show results ({result['total_rows']} rows)", key=f"show_{i}"):
+                    render_result(result, key=str(i))
 
     # Chat input
     prompt = st.chat_input("Ask something about your databases...")
@@ -372,14 +567,14 @@ def main_chat_page():
         if res:
             answer = res.get("answer", res.get("message", "No answer"))
             sql_used = res.get("sql_used") or res.get("sql")
-            data = res.get("data")
+            result = make_result_message(res)
             suggestion = res.get("suggestion")
             # store assistant msg
             st.session_state.messages.append({
                 "role": "assistant",
                 "content": answer,
                 "sql": sql_used,
-                "data": data
+                "result": result
             })
             # display assistant bubble
             with st.chat_message("assistant"):
@@ -387,12 +582,8 @@ def main_chat_page():
                 if sql_used:
                     with st.expander("SQL used"):
                         st.code(sql_used, language="sql")
-                if data and isinstance(data, list) and len(data) > 0:
-                    try:
-                        df = pd.DataFrame(data)
-                        st.dataframe(df)
-                    except Exception:
-                        st.write(data)
+                if result:
+                    render_result(result, key=str(len(st.session_state.messages) - 1))
                 if suggestion:
                     st.info(suggestion)
         else:
@@ -411,11 +602,14 @@ render_sidebar()
 if not st.session_state.access_token:
     login_register_page()
 else:
-    # ensure we have current user & summaries
-    if not st.session_state.user:
-        fetch_user()
-    if st.session_state.credentials is None:
-        fetch_credentials()
-    if st.session_state.summary is None:
-        fetch_summary()
+    # ensure we have current user & summaries (served from cache across reruns)
+    if not st.session_state.user and st.session_state.credentials is None and st.session_state.summary is None:
+        fetch_initial_state()
+    else:
+        if not st.session_state.user:
+            fetch_user()
+        if st.session_state.credentials is None:
+            fetch_credentials()
+        if st.session_state.summary is None:
+            fetch_summary()
     main_chat_page()
@@ -1,13 +1,18 @@
 # Updated getschema.py
-from dotenv import load_dotenv
 import os
+import json
+from contextlib import contextmanager
 import logging
 import psycopg2
 from psycopg2 import OperationalError
 from typing import Optional, Dict, List, Tuple
 from models import ExternalDBCredential
-
-load_dotenv()
+from background import scheduler
+import crypto
+import dbpool
+import schemacache
+from singleflight import SingleFlight
+import tracing
 
 # Local DB config for FastAPI app's database
 LOCAL_DB_CONFIG = {
@@ -18,9 +23,39 @@ LOCAL_DB_CONFIG = {
     'password': os.getenv('PG_PASS')
 }
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Schema encodings for the LLM prompt: the original bullet list, a DDL-like
+# one-line-per-table form and minified JSON. The compact forms carry the same
+# information in a fraction of the tokens.
+SCHEMA_FORMATS = ("verbose", "ddl", "json")
+DEFAULT_SCHEMA_FORMAT = os.getenv("SCHEMA_PROMPT_FORMAT", "ddl")
+
+SHORT_TYPE_NAMES = {
+    'character varying': 'varchar',
+    'character': 'char',
+    'integer': 'int',
+    'bigint': 'int8',
+    'smallint': 'int2',
+    'double precision': 'float8',
+    'real': 'float4',
+    'boolean': 'bool',
+    'timestamp without time zone': 'timestamp',
+    'timestamp with time zone': 'timestamptz',
+    'time without time zone': 'time',
+    'time with time zone': 'timetz',
+    'USER-DEFINED': 'enum',
+}
+
+# Concurrent introspection of the same database (same DSN, possibly through
+# different users' credentials) runs once and is shared
+_schema_flight = SingleFlight("schema")
+
+# Column value hints shown to the LLM
+MAX_ENUM_LIKE_DISTINCT = 25
+MAX_HINT_VALUES = 5
+MAX_HINT_VALUE_LENGTH = 24
+
 def get_db_connection(config: dict = LOCAL_DB_CONFIG):
     """Create a new database connection"""
     if config is None:
@@ -34,7 +69,7 @@ def get_db_connection(config: dict = LOCAL_DB_CONFIG):
         return None
 
 def get_detailed_schema(conn) -> Dict[str, List[Dict]]:
-    """Retrieve detailed schema information organized by tables"""
+    """Retrieve detailed schema information organized by tables (the caller owns conn)"""
     if conn is None:
         return {"error": "No connection provided"}
     
@@ -87,6 +122,9 @@ def get_detailed_schema(conn) -> Dict[str, List[Dict]]:
                 table_name = row[0]
                 if table_name not in schema:
                     schema[table_name] = []
+                if row[1] is None:
+                    # A table without columns still comes back once from the LEFT JOIN
+                    continue
                 
                 column_info = {
                     'column_name': row[1],
@@ -104,9 +142,6 @@ def get_detailed_schema(conn) -> Dict[str, List[Dict]]:
     except Exception as e:
         logger.error(f"Error fetching schema: {e}")
         return {"error": str(e)}
-    finally:
-        if conn:
-            conn.close()
 
 def get_sample_data(conn, table_name: str, limit: int = 3) -> List[Tuple]:
     """Get sample data from a table to help LLM understand data patterns"""
@@ -121,27 +156,291 @@ def get_sample_data(conn, table_name: str, limit: int = 3) -> List[Tuple]:
         logger.error(f"Error fetching sample data from {table_name}: {e}")
         return []
 
-def get_external_db_connection(db_credential: ExternalDBCredential):
-    """Create connection to external database using ExternalDBCredential model"""
-    external_config = {
+def parse_pg_array(text: Optional[str]) -> List[str]:
+    """
+    Parse the text form of a Postgres array (e.g. '{a,"b c",NULL}') into strings.
+    Sub-arrays of a multi-dimensional array stay whole, in their own text form ('{1,2}').
+    """
+    if not text or len(text) < 2 or text[0] != '{':
+        return []
+
+    values = []
+    current = ''
+    quoted = False
+    was_quoted = False
+    depth = 0  # inside a sub-array, whose text is kept verbatim
+    i = 1
+    while i < len(text) - 1:
+        ch = text[i]
+        if quoted:
+            if ch == '\\' and i + 1 < len(text) - 1:
+                if depth:
+                    current += ch
+                i += 1
+                current += text[i]
+            elif ch == '"':
+                quoted = False
+                if depth:
+                    current += ch
+            else:
+                current += ch
+        elif ch == '"':
+            quoted = True
+            if depth:
+                current += ch
+            else:
+                was_quoted = True
+        elif ch == '{':
+            depth += 1
+            current += ch
+        elif ch == '}' and depth:
+            depth -= 1
+            current += ch
+        elif ch == ',' and not depth:
+            if was_quoted or current != 'NULL':
+                values.append(current)
+            current = ''
+            was_quoted = False
+        else:
+            current += ch
+        i += 1
+    if was_quoted or (current and current != 'NULL'):
+        values.append(current)
+    return values
+
+def get_column_profiles(conn) -> Dict[str, Dict]:
+    """
+    Build per-column value profiles from the planner statistics.
+
+    Only the catalog is read (pg_stats and pg_class) in a single query, so this
+    never scans user tables no matter how large they are. The caller owns conn.
+    """
+    if conn is None:
+        return {"error": "No connection provided"}
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT
+                    c.relname,
+                    c.reltuples,
+                    s.attname,
+                    s.null_frac,
+                    s.n_distinct,
+                    s.most_common_vals::text,
+                    s.histogram_bounds::text
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                LEFT JOIN pg_stats s
+                    ON s.schemaname = n.nspname AND s.tablename = c.relname
+                WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+                ORDER BY c.relname;
+            """)
+
+            profiles = {}
+            for relname, reltuples, attname, null_frac, n_distinct, common_vals, histogram in cur.fetchall():
+                table = profiles.setdefault(relname, {
+                    'row_estimate': int(reltuples) if reltuples is not None and reltuples >= 0 else None,
+                    'columns': {}
+                })
+                if attname is None:
+                    continue
+
+                bounds = parse_pg_array(histogram)
+                table['columns'][attname] = {
+                    'null_frac': null_frac,
+                    'n_distinct': n_distinct,
+                    'common_values': parse_pg_array(common_vals),
+                    'histogram_min': bounds[0] if bounds else None,
+                    'histogram_max': bounds[-1] if bounds else None
+                }
+
+            return profiles
+
+    except Exception as e:
+        logger.error(f"Error fetching column profiles: {e}")
+        return {"error": str(e)}
+
+def get_database_stats(conn) -> Dict:
+    """Table count, approximate rows and on-disk size from the catalog only (the caller owns conn)"""
+    if conn is None:
+        return {"error": "No connection provided"}
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT
+                    COUNT(*),
+                    COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint,
+                    pg_database_size(current_database())
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p');
+            """)
+            table_count, approx_rows, total_size = cur.fetchone()
+            return {
+                'table_count': table_count,
+                'approx_rows': approx_rows,
+                'total_size_bytes': total_size
+            }
+    except Exception as e:
+        logger.error(f"Error fetching database stats: {e}")
+        return {"error": str(e)}
+
+def _estimated_distinct(column_profile: Dict, row_estimate: Optional[int]) -> Optional[float]:
+    """pg_stats stores n_distinct as a negative fraction of the row count for large domains"""
+    n_distinct = column_profile.get('n_distinct')
+    if n_distinct is None:
+        return None
+    if n_distinct >= 0:
+        return n_distinct
+    if row_estimate:
+        return -n_distinct * row_estimate
+    return None
+
+def format_column_hint(column_profile: Optional[Dict], row_estimate: Optional[int] = None) -> str:
+    """Compact value hint for one column, e.g. values: 'paid'|'pending' or range: 2019-01-02..2024-06-30"""
+    if not column_profile:
+        return ""
+
+    hints = []
+    distinct = _estimated_distinct(column_profile, row_estimate)
+    common_values = column_profile.get('common_values') or []
+
+    if column_profile.get('n_distinct') == -1:
+        hints.append("unique")
+    elif common_values and distinct is not None and distinct <= MAX_ENUM_LIKE_DISTINCT:
+        shown = [f"'{value[:MAX_HINT_VALUE_LENGTH]}'" for value in common_values[:MAX_HINT_VALUES]]
+        more = "|…" if len(common_values) > MAX_HINT_VALUES or distinct > len(shown) else ""
+        hints.append(f"values: {'|'.join(shown)}{more}")
+    elif column_profile.get('histogram_min') is not None:
+        low = column_profile['histogram_min'][:MAX_HINT_VALUE_LENGTH]
+        high = column_profile['histogram_max'][:MAX_HINT_VALUE_LENGTH]
+        hints.append(f"range: {low}..{high}")
+
+    null_frac = column_profile.get('null_frac') or 0
+    if null_frac >= 0.5:
+        hints.append(f"{round(null_frac * 100)}% null")
+
+    return "; ".join(hints)
+
+def _profile_database(config: dict, key: str):
+    """Background job: refresh the column profiles for one database"""
+    with dbpool.connection(config) as conn:
+        profiles = get_column_profiles(conn)
+    if profiles and 'error' not in profiles:
+        schemacache.set_profiles(key, profiles)
+
+def schedule_profiling(db_credential: ExternalDBCredential):
+    """Queue a profile refresh unless one is already cached or running"""
+    key = schemacache.credential_key(db_credential)
+    if schemacache.get_profiles(key) is not None:
+        return
+    config = usable_config(db_credential)
+    if config is None:
+        return
+    # Hand the worker a plain config so it never touches the request's ORM session
+    scheduler.submit(f"profile:{key}", _profile_database, config, key)
+
+def credential_config(db_credential: ExternalDBCredential) -> dict:
+    """psycopg2 connection parameters for an ExternalDBCredential"""
+    return {
         'host': db_credential.host,
         'port': db_credential.port,
         'dbname': db_credential.dbname,
         'user': db_credential.db_user,
-        'password': db_credential.db_password
+        'password': crypto.reveal(db_credential.db_password)
     }
-    return get_db_connection(external_config)
+
+def usable_config(db_credential: ExternalDBCredential) -> Optional[dict]:
+    """credential_config, or None if the stored password can't be decrypted (treat as unreachable)"""
+    try:
+        return credential_config(db_credential)
+    except crypto.CredentialKeyError:
+        return None
+
+def get_external_db_connection(db_credential: ExternalDBCredential):
+    """Create connection to external database using ExternalDBCredential model"""
+    return get_db_connection(credential_config(db_credential))
+
+@contextmanager
+def external_connection(db_credential: ExternalDBCredential):
+    """Borrow a pooled connection to an external database (yields None on failure)"""
+    config = usable_config(db_credential)
+    if config is None:
+        yield None
+        return
+    with dbpool.connection(config) as conn:
+        yield conn
+
+def _introspect(config: dict) -> Optional[Dict]:
+    try:
+        with dbpool.connection(config) as conn:
+            if not conn:
+                return None
+            return get_detailed_schema(conn)
+    except dbpool.PoolExhausted as e:
+        logger.warning(f"Schema introspection skipped: {e}")
+        return None
+
+def get_credential_schema(db_credential: ExternalDBCredential) -> Optional[Dict]:
+    """Cached schema for one database; None if it can't be reached"""
+    key = schemacache.credential_key(db_credential)
+    with tracing.span("getschemas.get_credential_schema", **{"db.id": key}) as span:
+        schema = schemacache.get_schema(key)
+        if schema is not None:
+            span.set_attributes(**{"cache": "hit", "db.tables": len(schema)})
+            return schema
+
+        config = usable_config(db_credential)
+        if config is None:
+            span.record_error("Credential can't be decrypted")
+            return None
+        schema, shared = _schema_flight.do(dbpool.pool_key(config), _introspect, config)
+        span.set_attribute("cache", "coalesced" if shared else "miss")
+        if schema is None:
+            span.record_error("Connection failed")
+            return None
+        if 'error' not in schema:
+            span.set_attribute("db.tables", len(schema))
+            schemacache.set_schema(key, schema)
+        return schema
+
+def get_credential_stats(db_credential: ExternalDBCredential) -> Dict:
+    """Cached catalog stats for one database; {'error': ...} if it can't be reached"""
+    key = schemacache.credential_key(db_credential)
+    stats = schemacache.get_stats(key)
+    if stats is not None:
+        return stats
+
+    try:
+        with external_connection(db_credential) as conn:
+            if not conn:
+                return {"error": "Connection failed"}
+            stats = get_database_stats(conn)
+    except dbpool.PoolExhausted as e:
+        return {"error": str(e)}
+    if 'error' not in stats:
+        schemacache.set_stats(key, stats)
+    return stats
 
 def get_user_database_schemas(user_db_credentials: List[ExternalDBCredential]) -> Dict[str, Dict]:
     """Get schemas for all databases accessible to the authenticated user"""
+    with tracing.span("getschemas.get_user_database_schemas", databases=len(user_db_credentials)):
+        return _get_user_database_schemas(user_db_credentials)
+
+def _get_user_database_schemas(user_db_credentials: List[ExternalDBCredential]) -> Dict[str, Dict]:
     user_schemas = {}
     
     for credential in user_db_credentials:
-        conn = get_external_db_connection(credential)
-        if conn:
-            schema = get_detailed_schema(conn)
+        key = schemacache.credential_key(credential)
+        schema = get_credential_schema(credential)
+
+        if schema is not None:
+            schedule_profiling(credential)
             user_schemas[credential.name or f"DB_{credential.id}"] = {
                 'schema': schema,
+                'profiles': schemacache.get_profiles(key) or {},
                 'connection_info': {
                     'host': credential.host,
                     'port': credential.port,
@@ -156,8 +455,8 @@ def get_user_database_schemas(user_db_credentials: List[ExternalDBCredential]) -
     
     return user_schemas
 
-def format_schema_for_llm(schema_dict: Dict[str, Dict]) -> str:
-    """Format schema information in a way that's optimal for LLM understanding"""
+def _format_schema_verbose(schema_dict: Dict[str, Dict]) -> str:
+    """Original emoji bullet-list layout, one line per column"""
     formatted_schema = "DATABASE SCHEMAS AVAILABLE TO USER:\n\n"
     
     for db_name, db_info in schema_dict.items():
@@ -176,16 +475,106 @@ def format_schema_for_llm(schema_dict: Dict[str, Dict]) -> str:
             formatted_schema += "   No tables found.\n\n"
             continue
             
+        profiles = db_info.get('profiles') or {}
         formatted_schema += "   TABLES:\n"
         for table_name, columns in schema.items():
-            formatted_schema += f"   📋 {table_name}:\n"
-            for col in columns:
+            table_profile = profiles.get(table_name, {})
+            row_estimate = table_profile.get('row_estimate')
+            size_info = f" (~{row_estimate:,} rows)" if row_estimate else ""
+            formatted_schema += f"   📋 {table_name}{size_info}:\n"
+            for col in _real_columns(columns):
                 key_info = f" ({col['key_type']})" if col['key_type'] else ""
                 nullable = "NULL" if col['is_nullable'] == 'YES' else "NOT NULL"
-                formatted_schema += f"      • {col['column_name']}: {col['data_type']} {nullable}{key_info}\n"
+                hint = ""
+                if col['key_type'] != 'PRIMARY KEY':
+                    hint = format_column_hint(table_profile.get('columns', {}).get(col['column_name']), row_estimate)
+                hint_info = f" [{hint}]" if hint else ""
+                formatted_schema += f"      • {col['column_name']}: {col['data_type']} {nullable}{key_info}{hint_info}\n"
                 
                 if col['foreign_table']:
                     formatted_schema += f"        ↳ References {col['foreign_table']}.{col['foreign_column']}\n"
             formatted_schema += "\n"
     
-    return formatted_schema
\ No newline at end of file
+    return formatted_schema
+
+def _real_columns(columns: List[Dict]) -> List[Dict]:
+    """Drops the all-NULL row a table without columns gets from the LEFT JOIN, e.g. in older cached schemas"""
+    return [col for col in columns if col['column_name'] is not None]
+
+def _column_description(col: Dict, table_profile: Dict) -> str:
+    """Everything after the name in compact form, e.g. int -> customers.id"""
+    parts = [SHORT_TYPE_NAMES.get(col['data_type'], col['data_type'])]
+    if col['key_type'] == 'PRIMARY KEY':
+        parts.append('pk')
+    if col['foreign_table']:
+        parts.append(f"-> {col['foreign_table']}.{col['foreign_column']}")
+    elif col['key_type'] != 'PRIMARY KEY':
+        hint = format_column_hint(
+            table_profile.get('columns', {}).get(col['column_name']),
+            table_profile.get('row_estimate')
+        )
+        if hint:
+            parts.append(f"[{hint}]")
+    return " ".join(parts)
+
+def _compact_column(col: Dict, table_profile: Dict) -> str:
+    """One column in compact form, e.g. customer_id int -> customers.id"""
+    return f"{col['column_name']} {_column_description(col, table_profile)}"
+
+def _format_schema_ddl(schema_dict: Dict[str, Dict]) -> str:
+    """One line per table: table(col type pk, col type -> other.col)"""
+    lines = ["DATABASE SCHEMAS (table(column type [pk] [-> ref_table.column] [value hint])):"]
+
+    for db_name, db_info in schema_dict.items():
+        if 'error' in db_info:
+            lines.append(f"-- {db_name}: {db_info['error']}")
+            continue
+
+        lines.append(f"DATABASE {db_name}")
+        schema = db_info.get('schema', {})
+        if not schema:
+            lines.append("-- no tables")
+            continue
+
+        profiles = db_info.get('profiles') or {}
+        for table_name, columns in schema.items():
+            table_profile = profiles.get(table_name, {})
+            column_text = ", ".join(_compact_column(col, table_profile) for col in _real_columns(columns))
+            row_estimate = table_profile.get('row_estimate')
+            size_info = f" -- ~{row_estimate} rows" if row_estimate else ""
+            lines.append(f"{table_name}({column_text}){size_info}")
+
+    return "\n".join(lines) + "\n"
+
+def _format_schema_json(schema_dict: Dict[str, Dict]) -> str:
+    """Minified JSON: {db: {table: {column: "type pk -> ref"}}}"""
+    payload = {}
+    for db_name, db_info in schema_dict.items():
+        if 'error' in db_info:
+            payload[db_name] = {"error": db_info['error']}
+            continue
+
+        profiles = db_info.get('profiles') or {}
+        tables = {}
+        for table_name, columns in db_info.get('schema', {}).items():
+            table_profile = profiles.get(table_name, {})
+            tables[table_name] = {
+                col['column_name']: _column_description(col, table_profile)
+                for col in _real_columns(columns)
+            }
+        payload[db_name] = tables
+
+    return "DATABASE SCHEMAS (JSON):\n" + json.dumps(payload, separators=(',', ':'), ensure_ascii=False) + "\n"
+
+_SCHEMA_FORMATTERS = {
+    "verbose": _format_schema_verbose,
+    "ddl": _format_schema_ddl,
+    "json": _format_schema_json,
+}
+
+def format_schema_for_llm(schema_dict: Dict[str, Dict], fmt: Optional[str] = None) -> str:
+    """Format schema information in a way that's optimal for LLM understanding"""
+    fmt = fmt or DEFAULT_SCHEMA_FORMAT
+    if fmt not in _SCHEMA_FORMATTERS:
+        raise ValueError(f"Unknown schema format '{fmt}', expected one of {', '.join(SCHEMA_FORMATS)}")
+    return _SCHEMA_FORMATTERS[fmt](schema_dict)
@@ -1,98 +1,88 @@
 import gradio as gr
-import requests
+import httpx
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional
 import os
 
 # API Configuration
 API_BASE_URL = "http://localhost:8000"  # Adjust if your API runs on different port
+REQUEST_TIMEOUT = 60.0
 
 class APIClient:
+    """
+    Async client with one persistent, pooled HTTP connection pool shared by all
+    Gradio event handlers, so many concurrent users don't each open sockets.
+    """
+
     def __init__(self, base_url: str = API_BASE_URL):
         self.base_url = base_url
         self.token = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._stream_supported = True
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+    def get_headers(self):
+        """Get headers with authentication token"""
+        if self.token:
+            return {"Authorization": f"Bearer {self.token}"}
+        return {}
+
+    async def _request(self, method: str, path: str, ok_status: int = 200, **kwargs) -> Dict[str, Any]:
+        try:
+            response = await self.client.request(method, path, headers=self.get_headers(), **kwargs)
+            return {
+                "success": response.status_code == ok_status,
+                "data": response.json() if response.status_code == ok_status else response.text,
+                "status_code": response.status_code
+            }
+        except Exception as e:
+            return {"success": False, "data": str(e), "status_code": 500}
     
-    def register_user(self, name: str, email: str, password: str) -> Dict[str, Any]:
+    async def register_user(self, name: str, email: str, password: str) -> Dict[str, Any]:
         """Register a new user"""
-        url = f"{self.base_url}/users/"
         data = {
             "name": name,
             "email": email,
             "password": password
         }
-        try:
-            response = requests.post(url, json=data)
-            return {
-                "success": response.status_code == 201,
-                "data": response.json() if response.status_code == 201 else response.text,
-                "status_code": response.status_code
-            }
-        except Exception as e:
-            return {"success": False, "data": str(e), "status_code": 500}
+        return await self._request("POST", "/users/", ok_status=201, json=data)
     
-    def login_user(self, email: str, password: str) -> Dict[str, Any]:
+    async def login_user(self, email: str, password: str) -> Dict[str, Any]:
         """Login user and get access token"""
-        url = f"{self.base_url}/token"
         data = {
             "username": email,
             "password": password
         }
-        try:
-            response = requests.post(url, data=data)
-            if response.status_code == 200:
-                token_data = response.json()
-                self.token = token_data["access_token"]
-                return {
-                    "success": True,
-                    "data": token_data,
-                    "status_code": response.status_code
-                }
-            else:
-                return {
-                    "success": False,
-                    "data": response.text,
-                    "status_code": response.status_code
-                }
-        except Exception as e:
-            return {"success": False, "data": str(e), "status_code": 500}
+        result = await self._request("POST", "/token", data=data)
+        if result["success"]:
+            self.token = result["data"]["access_token"]
+        return result
     
-    def get_headers(self):
-        """Get headers with authentication token"""
-        if self.token:
-            return {"Authorization": f"Bearer {self.token}"}
-        return {}
-    
-    def get_user_info(self) -> Dict[str, Any]:
+    async def get_user_info(self) -> Dict[str, Any]:
         """Get current user information"""
-        url = f"{self.base_url}/me"
-        try:
-            response = requests.get(url, headers=self.get_headers())
-            return {
-                "success": response.status_code == 200,
-                "data": response.json() if response.status_code == 200 else response.text,
-                "status_code": response.status_code
-            }
-        except Exception as e:
-            return {"success": False, "data": str(e), "status_code": 500}
+        return await self._request("GET", "/me")
     
-    def get_database_connections(self, include_status: bool = True) -> Dict[str, Any]:
-        """Get user's database connections"""
-        url = f"{self.base_url}/db-connections/"
-        params = {"include_status": include_status}
-        try:
-            response = requests.get(url, headers=self.get_headers(), params=params)
-            return {
-                "success": response.status_code == 200,
-                "data": response.json() if response.status_code == 200 else response.text,
-                "status_code": response.status_code
-            }
-        except Exception as e:
-            return {"success": False, "data": str(e), "status_code": 500}
+    async def get_database_connections(self, include_status: bool = False, refresh: bool = False) -> Dict[str, Any]:
+        """Get user's database connections (with cached health status; refresh re-checks them live)"""
+        return await self._request("GET", "/db-connections/",
+                                   params={"include_status": include_status, "refresh": refresh})
     
-    def add_database_connection(self, name: str, host: str, port: int, dbname: str, 
+    async def add_database_connection(self, name: str, host: str, port: int, dbname: str, 
                                db_user: str, db_password: str, db_owner_username: str = "") -> Dict[str, Any]:
         """Add a new database connection"""
-        url = f"{self.base_url}/db-connections/"
         data = {
             "name": name,
             "host": host,
@@ -102,59 +92,69 @@ class APIClient:
             "db_password": db_password,
             "db_owner_username": db_owner_username
         }
-        try:
-            response = requests.post(url, json=data, headers=self.get_headers())
-            return {
-                "success": response.status_code == 200,
-                "data": response.json() if response.status_code == 200 else response.text,
-                "status_code": response.status_code
-            }
-        except Exception as e:
-            return {"success": False, "data": str(e), "status_code": 500}
+        return await self._request("POST", "/db-connections/", json=data)
     
-    def delete_database_connection(self, connection_id: str) -> Dict[str, Any]:
+    async def delete_database_connection(self, connection_id: str) -> Dict[str, Any]:
         """Delete a database connection"""
-        url = f"{self.base_url}/db-connections/{connection_id}"
-        try:
-            response = requests.delete(url, headers=self.get_headers())
-            return {
-                "success": response.status_code == 200,
-                "data": response.json() if response.status_code == 200 else response.text,
-                "status_code": response.status_code
-            }
-        except Exception as e:
-            return {"success": False, "data": str(e), "status_code": 500}
+        return await self._request("DELETE", f"/db-connections/{connection_id}")
     
-    def get_database_summary(self) -> Dict[str, Any]:
+    async def get_database_summary(self) -> Dict[str, Any]:
         """Get database summary and sample questions"""
-        url = f"{self.base_url}/llm-chat/summary"
-        try:
-            response = requests.get(url, headers=self.get_headers())
-            return {
-                "success": response.status_code == 200,
-                "data": response.json() if response.status_code == 200 else response.text,
-                "status_code": response.status_code
-            }
-        except Exception as e:
-            return {"success": False, "data": str(e), "status_code": 500}
+        return await self._request("GET", "/llm-chat/summary")
     
-    def ask_question(self, question: str) -> Dict[str, Any]:
+    async def ask_question(self, question: str) -> Dict[str, Any]:
         """Ask a question about the database"""
-        url = f"{self.base_url}/llm-chat/ask"
-        data = {"question": question}
-        try:
-            response = requests.post(url, json=data, headers=self.get_headers())
-            return {
-                "success": response.status_code == 200,
-                "data": response.json() if response.status_code == 200 else response.text,
-                "status_code": response.status_code
-            }
-        except Exception as e:
-            return {"success": False, "data": str(e), "status_code": 500}
+        return await self._request("POST", "/llm-chat/ask", json={"question": question})
+
+    async def ask_question_stream(self, question: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield progress events from /llm-chat/ask/stream, ending with an "answer"
+        event. Falls back to /llm-chat/ask on servers without the stream route.
+        """
+        if self._stream_supported:
+            try:
+                async with self.client.stream(
+                    "POST", "/llm-chat/ask/stream", json={"question": question}, headers=self.get_headers()
+                ) as response:
+                    if response.status_code == 404:
+                        self._stream_supported = False
+                    elif response.status_code != 200:
+                        await response.aread()
+                        yield {"event": "error", "message": response.text}
+                        return
+                    else:
+                        async for line in response.aiter_lines():
+                            if line.strip():
+                                yield json.loads(line)
+                        return
+            except Exception as e:
+                yield {"event": "error", "message": str(e)}
+                return
+
+        result = await self.ask_question(question)
+        if result["success"]:
+            yield {"event": "answer", **result["data"]}
+        else:
+            yield {"event": "error", "message": result["data"]}
 
 # Initialize API client
 api_client = APIClient()
 
+def format_database_list(data: List[Dict[str, Any]]) -> str:
+    """Format the plain connection listing (no live status)"""
+    if not data:
+        return "No database connections found."
+
+    result = []
+    for db in data:
+        result.append(f"⚪ **{db.get('name') or 'Unnamed'}**")
+        result.append(f"   Host: {db.get('host', 'Unknown')}:{db.get('port', 'Unknown')}")
+        result.append(f"   Database: {db.get('dbname', 'Unknown')}")
+        result.append("")
+    result.append("_Use \"Check status\" to test the connections._")
+
+    return "\n".join(result)
+
 def format_database_info(data: Dict[str, Any]) -> str:
     """Format database information for display"""
     if not data.get("databases"):
@@ -162,12 +162,14 @@ def format_database_info(data: Dict[str, Any]) -> str:
     
     result = []
     for db in data["databases"]:
-        status_emoji = "🟢" if db.get("connection_status") == "connected" else "🔴"
+        status_emoji = {"connected": "🟢", "unknown": "⚪"}.get(db.get("connection_status"), "🔴")
         result.append(f"{status_emoji} **{db.get('name', 'Unknown')}**")
         result.append(f"   Host: {db.get('db_host', 'Unknown')}:{db.get('db_port', 'Unknown')}")
         result.append(f"   Database: {db.get('db_name', 'Unknown')}")
         result.append(f"   Status: {db.get('connection_status', 'Unknown')}")
         result.append(f"   Tables: {db.get('table_count', 0)}")
+        if db.get("checked_at"):
+            result.append(f"   Checked: {db['checked_at']}")
         if db.get("error"):
             result.append(f"   Error: {db['error']}")
         result.append("")
@@ -185,14 +187,16 @@ def format_chat_response(data: Dict[str, Any]) -> str:
         result.append(f"\n**SQL Query:**\n```sql\n{data['sql_used']}\n```")
     
     if data.get("data"):
-        result.append(f"\n**Data ({len(data['data'])} rows):**")
+        # data is only the first page; total_rows counts the whole result
+        total_rows = data.get("total_rows") or len(data['data'])
+        result.append(f"\n**Data ({total_rows} rows):**")
         if data['data']:
             # Show first few rows as example
             sample_data = data['data'][:3]
             for i, row in enumerate(sample_data, 1):
                 result.append(f"Row {i}: {row}")
-            if len(data['data']) > 3:
-                result.append(f"... and {len(data['data']) - 3} more rows")
+            if total_rows > 3:
+                result.append(f"... and {total_rows - 3} more rows")
     
     if data.get("suggestion"):
         result.append(f"\n**Suggestion:** {data['suggestion']}")
@@ -203,19 +207,19 @@ def format_chat_response(data: Dict[str, Any]) -> str:
     return "\n".join(result)
 
 # Gradio Interface Functions
-def register_user(name, email, password):
+async def register_user(name, email, password):
     """Register a new user"""
-    result = api_client.register_user(name, email, password)
+    result = await api_client.register_user(name, email, password)
     if result["success"]:
         return f"✅ User registered successfully!\nUser ID: {result['data'].get('id', 'N/A')}"
     else:
         return f"❌ Registration failed: {result['data']}"
 
-def login_user(email, password):
+async def login_user(email, password):
     """Login user"""
-    result = api_client.login_user(email, password)
+    result = await api_client.login_user(email, password)
     if result["success"]:
-        user_info = api_client.get_user_info()
+        user_info = await api_client.get_user_info()
         if user_info["success"]:
             return f"✅ Login successful!\nWelcome, {user_info['data']['name']} ({user_info['data']['email']})"
         else:
@@ -223,30 +227,38 @@ def login_user(email, password):
     else:
         return f"❌ Login failed: {result['data']}"
 
-def get_databases():
-    """Get user's database connections"""
-    result = api_client.get_database_connections()
+async def get_databases():
+    """Get user's database connections (cheap listing, no live probes)"""
+    result = await api_client.get_database_connections(include_status=False)
+    if result["success"]:
+        return format_database_list(result["data"])
+    else:
+        return f"❌ Failed to get databases: {result['data']}"
+
+async def get_databases_with_status():
+    """Get user's database connections with freshly checked connection status"""
+    result = await api_client.get_database_connections(include_status=True, refresh=True)
     if result["success"]:
         return format_database_info(result["data"])
     else:
         return f"❌ Failed to get databases: {result['data']}"
 
-def add_database(name, host, port, dbname, db_user, db_password, db_owner_username):
+async def add_database(name, host, port, dbname, db_user, db_password, db_owner_username):
     """Add a new database connection"""
     try:
         port = int(port)
     except ValueError:
         return "❌ Port must be a number"
     
-    result = api_client.add_database_connection(name, host, port, dbname, db_user, db_password, db_owner_username)
+    result = await api_client.add_database_connection(name, host, port, dbname, db_user, db_password, db_owner_username)
     if result["success"]:
         return f"✅ Database connection added successfully!\nConnection ID: {result['data'].get('id', 'N/A')}"
     else:
         return f"❌ Failed to add database: {result['data']}"
 
-def get_database_summary():
+async def get_database_summary():
     """Get database summary and sample questions"""
-    result = api_client.get_database_summary()
+    result = await api_client.get_database_summary()
     if result["success"]:
         data = result["data"]
         summary = f"**Database Summary:**\n"
@@ -262,16 +274,20 @@ def get_database_summary():
     else:
         return f"❌ Failed to get summary: {result['data']}"
 
-def ask_question(question):
-    """Ask a question about the database"""
+async def ask_question(question):
+    """Ask a question about the database, showing progress as events arrive"""
     if not question.strip():
-        return "Please enter a question."
+        yield "Please enter a question."
+        return
     
-    result = api_client.ask_question(question)
-    if result["success"]:
-        return format_chat_response(result["data"])
-    else:
-        return f"❌ Failed to get answer: {result['data']}"
+    yield "⏳ Generating SQL..."
+    async for event in api_client.ask_question_stream(question):
+        if event.get("event") == "sql":
+            yield f"⏳ Running query on **{event.get('database')}**...\n```sql\n{event.get('sql')}\n```"
+        elif event.get("event") == "answer":
+            yield format_chat_response(event)
+        elif event.get("event") == "error":
+            yield f"❌ Failed to get answer: {event.get('message')}"
 
 # Create Gradio Interface
 with gr.Blocks(title="API Connection Manager", theme=gr.themes.Soft()) as demo:
@@ -321,11 +337,14 @@ with gr.Blocks(title="API Connection Manager", theme=gr.themes.Soft()) as demo:
                 
                 with gr.Column():
                     gr.Markdown("#### Your Database Connections")
-                    refresh_button = gr.Button("🔄 Refresh", variant="secondary")
+                    with gr.Row():
+                        refresh_button = gr.Button("🔄 Refresh", variant="secondary")
+                        status_button = gr.Button("🩺 Check status", variant="secondary")
                     databases_output = gr.Markdown(label="Database List")
             
             add_db_button.click(add_database, [db_name, db_host, db_port, db_database, db_user, db_password, db_owner], add_db_output)
             refresh_button.click(get_databases, [], databases_output)
+            status_button.click(get_databases_with_status, [], databases_output)
         
         # Chat Tab
         with gr.TabItem("💬 Chat with Your Data"):
@@ -0,0 +1,284 @@
+"""
+Background health checks for external databases.
+
+Every registered credential is probed on a schedule and the outcome (status,
+latency, table count, last error) is kept in the connection_health table, so
+listing endpoints answer from there instead of connecting to each database on
+the request path. Failing hosts are re-checked with exponential backoff.
+Workers share the table; an advisory lock lets only one of them sweep at a time.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+from sqlalchemy import or_, text
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+from crypto import CredentialKeyError
+from database import SessionLocal, engine
+from getschemas import credential_config
+from models import ConnectionHealth, ExternalDBCredential
+
+logger = logging.getLogger(__name__)
+
+HEALTH_MONITOR_ENABLED = os.getenv("HEALTH_MONITOR_ENABLED", "true").lower() == "true"
+# Healthy databases are re-checked this often
+HEALTH_CHECK_INTERVAL_SECONDS = int(os.getenv("HEALTH_CHECK_INTERVAL_SECONDS", "300"))
+# Failing ones after 1x, 2x, 4x ... this, up to the max
+HEALTH_RETRY_SECONDS = int(os.getenv("HEALTH_RETRY_SECONDS", "60"))
+HEALTH_MAX_BACKOFF_SECONDS = int(os.getenv("HEALTH_MAX_BACKOFF_SECONDS", "3600"))
+HEALTH_CHECK_TIMEOUT_SECONDS = int(os.getenv("HEALTH_CHECK_TIMEOUT_SECONDS", "5"))
+HEALTH_CHECK_CONCURRENCY = int(os.getenv("HEALTH_CHECK_CONCURRENCY", "8"))
+# How often the monitor looks for due checks, and how many it takes per sweep
+HEALTH_MONITOR_TICK_SECONDS = float(os.getenv("HEALTH_MONITOR_TICK_SECONDS", "15"))
+HEALTH_SWEEP_BATCH = int(os.getenv("HEALTH_SWEEP_BATCH", "200"))
+# A forced refresh skips databases checked more recently than this
+HEALTH_REFRESH_MIN_AGE_SECONDS = int(os.getenv("HEALTH_REFRESH_MIN_AGE_SECONDS", "10"))
+HEALTH_REFRESH_DEADLINE_SECONDS = float(os.getenv("HEALTH_REFRESH_DEADLINE_SECONDS", "10"))
+
+# pg advisory lock key held by whichever worker is sweeping
+_SWEEP_LOCK_KEY = 0x6865616C7468
+
+_TABLE_COUNT_SQL = """
+    SELECT count(*)
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+"""
+
+_probe_pool = ThreadPoolExecutor(max_workers=HEALTH_CHECK_CONCURRENCY, thread_name_prefix="healthcheck")
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+_state: Dict[str, Any] = {"last_sweep_at": None, "last_sweep_checked": 0, "last_error": None}
+
+
+def check_database(config: dict, timeout: int = HEALTH_CHECK_TIMEOUT_SECONDS) -> Dict[str, Any]:
+    """Connect, count the public tables and time it"""
+    start = time.perf_counter()
+    try:
+        conn = psycopg2.connect(
+            connect_timeout=timeout, options=f"-c statement_timeout={timeout * 1000}", **config
+        )
+        try:
+            with conn.cursor() as cur:
+                cur.execute(_TABLE_COUNT_SQL)
+                table_count = cur.fetchone()[0]
+        finally:
+            conn.close()
+    except Exception as e:
+        return {
+            "status": "failed",
+            "error": str(e).strip(),
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+    return {
+        "status": "connected",
+        "table_count": table_count,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+def _check_credential(credential: ExternalDBCredential, timeout: int = HEALTH_CHECK_TIMEOUT_SECONDS) -> Dict[str, Any]:
+    try:
+        config = credential_config(credential)
+    except CredentialKeyError as e:
+        # Recorded like any failing host, so it backs off instead of blocking the sweep
+        return {"status": "failed", "error": f"Stored password can't be decrypted: {e}", "latency_ms": None}
+    return check_database(config, timeout)
+
+
+def _next_check(now: datetime, consecutive_failures: int) -> datetime:
+    if consecutive_failures == 0:
+        delay = HEALTH_CHECK_INTERVAL_SECONDS
+    else:
+        delay = min(HEALTH_RETRY_SECONDS * 2 ** (consecutive_failures - 1), HEALTH_MAX_BACKOFF_SECONDS)
+    # Jitter keeps databases added together from being probed together forever
+    return now + timedelta(seconds=delay * random.uniform(0.9, 1.1))
+
+
+def record_results(results: Dict[str, Dict[str, Any]]):
+    """Store check outcomes keyed by credential id and schedule each one's next check"""
+    if not results:
+        return
+    db = SessionLocal()
+    try:
+        existing = {
+            str(row.credential_id): row
+            for row in db.query(ConnectionHealth).filter(ConnectionHealth.credential_id.in_(list(results)))
+        }
+        now = datetime.now()
+        for credential_id, result in results.items():
+            row = existing.get(credential_id)
+            if row is None:
+                row = ConnectionHealth(credential_id=credential_id, consecutive_failures=0)
+                db.add(row)
+            row.status = result["status"]
+            row.latency_ms = result.get("latency_ms")
+            row.checked_at = now
+            if result["status"] == "connected":
+                row.table_count = result["table_count"]
+                row.last_error = None
+                row.consecutive_failures = 0
+                row.last_success_at = now
+            else:
+                # Keep the last known table count; the database is probably still there
+                row.last_error = result.get("error")
+                row.consecutive_failures = (row.consecutive_failures or 0) + 1
+                metrics.incr("health.failed")
+            row.next_check_at = _next_check(now, row.consecutive_failures)
+        db.commit()
+        metrics.incr("health.checked", len(results))
+    except IntegrityError:
+        # A credential was deleted mid-check; the rest are simply due again next sweep
+        db.rollback()
+        logger.info("Skipped recording health checks for a deleted credential")
+    finally:
+        db.close()
+
+
+def _due_credentials(limit: int) -> List[ExternalDBCredential]:
+    db = SessionLocal()
+    try:
+        credentials = (
+            db.query(ExternalDBCredential)
+            .outerjoin(ConnectionHealth, ConnectionHealth.credential_id == ExternalDBCredential.id)
+            .filter(or_(ConnectionHealth.next_check_at.is_(None), ConnectionHealth.next_check_at <= datetime.now()))
+            .order_by(ConnectionHealth.next_check_at.asc().nullsfirst())
+            .limit(limit)
+            .all()
+        )
+        db.expunge_all()
+        return credentials
+    finally:
+        db.close()
+
+
+def run_sweep(limit: int = HEALTH_SWEEP_BATCH) -> int:
+    """Check every due database, unless another worker is already sweeping; returns how many were checked"""
+    with engine.connect() as lock_conn:
+        locked = lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _SWEEP_LOCK_KEY}).scalar()
+        # The lock is per session; don't sit idle in a transaction while probing
+        lock_conn.commit()
+        if not locked:
+            return 0
+        try:
+            start = time.perf_counter()
+            credentials = _due_credentials(limit)
+            outcomes = list(_probe_pool.map(_check_credential, credentials))
+            record_results({str(credential.id): outcome for credential, outcome in zip(credentials, outcomes)})
+            if credentials:
+                metrics.observe("health.sweep_ms", (time.perf_counter() - start) * 1000)
+            return len(credentials)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _SWEEP_LOCK_KEY})
+            lock_conn.commit()
+
+
+def _run():
+    while not _stop.is_set():
+        try:
+            checked = run_sweep()
+            _state.update(last_sweep_at=time.time(), last_sweep_checked=checked, last_error=None)
+            # A full batch means more are due; carry on without waiting
+            if checked >= HEALTH_SWEEP_BATCH:
+                continue
+        except Exception as e:
+            _state["last_error"] = str(e)
+            logger.warning(f"Health sweep failed: {e}")
+        _stop.wait(HEALTH_MONITOR_TICK_SECONDS)
+
+
+def start():
+    global _thread
+    if not HEALTH_MONITOR_ENABLED or (_thread is not None and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="health-monitor", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 5):
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+    _probe_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def monitor_state() -> Dict[str, Any]:
+    return {"running": _thread is not None and _thread.is_alive(), **_state}
+
+
+def _recently_checked(credential_ids: List) -> set:
+    """Ids (as strings) of these credentials checked within HEALTH_REFRESH_MIN_AGE_SECONDS"""
+    db = SessionLocal()
+    try:
+        cutoff = datetime.now() - timedelta(seconds=HEALTH_REFRESH_MIN_AGE_SECONDS)
+        return {
+            str(credential_id)
+            for (credential_id,) in db.query(ConnectionHealth.credential_id).filter(
+                ConnectionHealth.credential_id.in_(credential_ids),
+                ConnectionHealth.checked_at > cutoff,
+            )
+        }
+    finally:
+        db.close()
+
+
+async def refresh(credentials: List[ExternalDBCredential], deadline_seconds: float = HEALTH_REFRESH_DEADLINE_SECONDS):
+    """
+    Check these databases now and store the results. Ones checked within the
+    last few seconds are skipped, and ones that haven't answered by the
+    deadline keep their cached status.
+    """
+    loop = asyncio.get_running_loop()
+    recent = await loop.run_in_executor(None, _recently_checked, [credential.id for credential in credentials])
+    credentials = [credential for credential in credentials if str(credential.id) not in recent]
+    if not credentials:
+        return
+
+    timeout = max(1, min(HEALTH_CHECK_TIMEOUT_SECONDS, int(deadline_seconds)))
+    futures = {
+        str(credential.id): loop.run_in_executor(_probe_pool, _check_credential, credential, timeout)
+        for credential in credentials
+    }
+    done, _ = await asyncio.wait(futures.values(), timeout=deadline_seconds)
+    results = {credential_id: future.result() for credential_id, future in futures.items() if future in done}
+    for future in futures.values():
+        future.cancel()
+    await loop.run_in_executor(None, record_results, results)
+
+
+def cached_status(db, credentials: List[ExternalDBCredential]) -> Dict[str, Dict[str, Any]]:
+    """Latest stored check per credential id; never-checked databases report status 'unknown'"""
+    rows = {
+        str(row.credential_id): row
+        for row in db.query(ConnectionHealth).filter(
+            ConnectionHealth.credential_id.in_([credential.id for credential in credentials])
+        )
+    } if credentials else {}
+
+    statuses = {}
+    for credential in credentials:
+        row = rows.get(str(credential.id))
+        if row is None:
+            statuses[str(credential.id)] = {
+                "connection_status": "unknown", "table_count": 0, "error": None,
+                "latency_ms": None, "checked_at": None, "next_check_at": None,
+            }
+            continue
+        statuses[str(credential.id)] = {
+            "connection_status": row.status,
+            "table_count": row.table_count or 0,
+            "error": row.last_error,
+            "latency_ms": row.latency_ms,
+            "checked_at": row.checked_at,
+            "next_check_at": row.next_check_at,
+        }
+    return statuses
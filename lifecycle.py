@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+import cachebackend
+import crypto
+import dbpool
+import healthmonitor
+import metrics
+from background import scheduler
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+# Seconds between event-loop lag samples (see metrics.monitor_event_loop); 0 disables
+EVENT_LOOP_MONITOR_INTERVAL = float(os.getenv("EVENT_LOOP_MONITOR_INTERVAL", "0.5"))
+# App DB connections opened during startup, and how long to keep retrying a down DB
+STARTUP_DB_CONNECTIONS = int(os.getenv("STARTUP_DB_CONNECTIONS", "2"))
+STARTUP_DB_RETRY_SECONDS = float(os.getenv("STARTUP_DB_RETRY_SECONDS", "60"))
+# /readyz re-checks the app DB at most this often
+READINESS_DB_CHECK_SECONDS = float(os.getenv("READINESS_DB_CHECK_SECONDS", "5"))
+
+_lock = threading.Lock()
+_state: Dict[str, Any] = {
+    "started_at": None,
+    "prewarm": "pending",
+    "app_db": {"ok": False, "checked_at": None, "error": "not checked yet"},
+    "llm_backend": "pending",
+}
+
+
+def _check_app_db() -> Dict[str, Any]:
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        result = {"ok": True, "checked_at": time.time(), "error": None}
+    except Exception as e:
+        result = {"ok": False, "checked_at": time.time(), "error": str(getattr(e, "orig", e))}
+    with _lock:
+        _state["app_db"] = result
+    return result
+
+
+def _warm_app_db():
+    """Retry until the app DB answers, then open a few pooled connections"""
+    deadline = time.monotonic() + STARTUP_DB_RETRY_SECONDS
+    delay = 0.5
+    while not _check_app_db()["ok"] and time.monotonic() + delay < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
+
+    if _state["app_db"]["ok"]:
+        connections = []
+        try:
+            for _ in range(STARTUP_DB_CONNECTIONS):
+                connections.append(engine.connect())
+        finally:
+            for conn in connections:
+                conn.close()
+    else:
+        logger.error(f"App database unreachable after startup retries: {_state['app_db']['error']}")
+
+
+def _warm_llm_backend():
+    from llmbackends import get_backend
+
+    try:
+        backend = get_backend()
+        status = "reachable" if backend.warm() else "unreachable"
+    except Exception as e:
+        status = f"error: {e}"
+    with _lock:
+        _state["llm_backend"] = status
+
+
+def prewarm():
+    """Runs once per worker after it starts serving: app DB pool and the LLM HTTP pool"""
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_warm_app_db), threading.Thread(target=_warm_llm_backend)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with _lock:
+        _state["prewarm"] = "done"
+    metrics.observe("startup.prewarm_ms", (time.perf_counter() - start) * 1000)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Worker startup/shutdown. Nothing here blocks the worker from accepting
+    requests: prewarming runs in the background and /readyz reports when done.
+    """
+    with _lock:
+        _state["started_at"] = time.time()
+    tasks = [asyncio.create_task(run_in_threadpool(prewarm))]
+    if EVENT_LOOP_MONITOR_INTERVAL > 0:
+        tasks.append(asyncio.create_task(metrics.monitor_event_loop(EVENT_LOOP_MONITOR_INTERVAL)))
+    healthmonitor.start()
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        healthmonitor.stop()
+        scheduler.shutdown()
+        dbpool.close_all()
+        crypto.clear_cache()
+        from llmbackends import close_all as close_llm_backends
+        close_llm_backends()
+        cachebackend.close()
+        engine.dispose()
+
+
+def health() -> Dict[str, Any]:
+    started_at = _state["started_at"]
+    return {"status": "ok", "uptime_seconds": round(time.time() - started_at, 1) if started_at else 0}
+
+
+def readiness() -> Dict[str, Any]:
+    """Ready once prewarming finished and the app DB answered recently; blocking, call off the loop"""
+    with _lock:
+        app_db = dict(_state["app_db"])
+        prewarm_state = _state["prewarm"]
+        llm_backend = _state["llm_backend"]
+    if prewarm_state == "done" and (app_db["checked_at"] is None or
+                                    time.time() - app_db["checked_at"] > READINESS_DB_CHECK_SECONDS):
+        app_db = _check_app_db()
+
+    from llmresilience import breaker_states
+
+    return {
+        "ready": prewarm_state == "done" and app_db["ok"],
+        "prewarm": prewarm_state,
+        "app_db": {**app_db, "pool": engine.pool.status()},
+        "external_pools": dbpool.stats(),
+        "cache": cachebackend.stats(),
+        "credentials": crypto.cache_stats(),
+        "background_pending": scheduler.pending_count(),
+        "health_monitor": healthmonitor.monitor_state(),
+        "llm": {"backend": llm_backend, "breakers": breaker_states()},
+    }
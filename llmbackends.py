@@ -0,0 +1,200 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+SYSTEM_PROMPT = "You are an expert SQL query generator."
+
+DEFAULT_BACKEND = os.getenv("LLM_BACKEND", "openrouter")
+
+
+class LLMBackend:
+    """
+    A text-completion provider. Each backend owns its own pooled HTTP session and
+    timeouts so a slow remote provider can't starve a local model of connections.
+    """
+
+    name = "base"
+
+    def __init__(self, base_url: str, model: str, timeout: float = 60, connect_timeout: float = 5,
+                 pool_size: int = 10):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = (connect_timeout, timeout)
+        # requests is imported with the first backend rather than at app import
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    health_path: Optional[str] = None
+
+    def complete(self, prompt: str, model: Optional[str] = None, system: str = SYSTEM_PROMPT,
+                 timeout: Optional[float] = None) -> str:
+        """timeout caps this call's HTTP timeouts, e.g. to what's left of the caller's deadline"""
+        raise NotImplementedError
+
+    def _request_timeout(self, timeout: Optional[float]) -> Tuple[float, float]:
+        if timeout is None:
+            return self.timeout
+        timeout = max(0.1, timeout)
+        return min(self.timeout[0], timeout), min(self.timeout[1], timeout)
+
+    def warm(self) -> bool:
+        """Open a keep-alive connection (TCP + TLS) with a cheap request; True if the provider answered"""
+        if not self.health_path:
+            return False
+        try:
+            response = self.session.get(f"{self.base_url}{self.health_path}", timeout=self.timeout[0] + 2)
+            return response.status_code < 500
+        except Exception:
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Any server speaking the OpenAI chat-completions API (vLLM, llama.cpp, LM Studio, ...)"""
+
+    name = "openai"
+    health_path = "/models"
+
+    def __init__(self, base_url: str, model: str, api_key: Optional[str] = None, **kwargs):
+        super().__init__(base_url, model, **kwargs)
+        self.api_key = api_key
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def complete(self, prompt: str, model: Optional[str] = None, system: str = SYSTEM_PROMPT,
+                 timeout: Optional[float] = None) -> str:
+        payload = {
+            "model": model or self.model,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0,
+            "max_tokens": 1024
+        }
+
+        response = self.session.post(
+            f"{self.base_url}/chat/completions",
+            headers=self._headers(),
+            json=payload,
+            timeout=self._request_timeout(timeout)
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        return data["choices"][0]["message"]["content"].strip()
+
+
+class OpenRouterBackend(OpenAICompatibleBackend):
+    name = "openrouter"
+
+    def _headers(self) -> Dict[str, str]:
+        if not self.api_key:
+            raise ValueError("Missing OPENROUTER_API_KEY environment variable")
+        return super()._headers()
+
+
+class OllamaBackend(LLMBackend):
+    """Local Ollama server via /api/generate"""
+
+    name = "ollama"
+    health_path = "/api/tags"
+
+    def __init__(self, base_url: str, model: str, num_ctx: int = 4096, **kwargs):
+        super().__init__(base_url, model, **kwargs)
+        self.num_ctx = num_ctx
+
+    def complete(self, prompt: str, model: Optional[str] = None, system: str = SYSTEM_PROMPT,
+                 timeout: Optional[float] = None) -> str:
+        payload = {
+            "model": model or self.model,
+            "system": system,
+            "prompt": prompt,
+            "stream": False,
+            "options": {  # Settings below are required for deterministic responses
+                "seed": 123,
+                "temperature": 0,
+                "num_ctx": self.num_ctx
+            }
+        }
+
+        response = self.session.post(f"{self.base_url}/api/generate", json=payload,
+                                     timeout=self._request_timeout(timeout))
+        response.raise_for_status()
+
+        return response.json().get("response", "").strip()
+
+
+def _build_openrouter() -> LLMBackend:
+    return OpenRouterBackend(
+        base_url=os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1"),
+        model=os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-20b"),
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        timeout=float(os.getenv("OPENROUTER_TIMEOUT", "60")),
+        pool_size=int(os.getenv("OPENROUTER_POOL_SIZE", "20")),
+    )
+
+
+def _build_openai() -> LLMBackend:
+    return OpenAICompatibleBackend(
+        base_url=os.getenv("OPENAI_COMPAT_URL", "http://localhost:8001/v1"),
+        model=os.getenv("OPENAI_COMPAT_MODEL", "local"),
+        api_key=os.getenv("OPENAI_COMPAT_API_KEY"),
+        timeout=float(os.getenv("OPENAI_COMPAT_TIMEOUT", "30")),
+        connect_timeout=1,
+        pool_size=int(os.getenv("OPENAI_COMPAT_POOL_SIZE", "10")),
+    )
+
+
+def _build_ollama() -> LLMBackend:
+    return OllamaBackend(
+        base_url=os.getenv("OLLAMA_URL", "http://localhost:11434"),
+        model=os.getenv("OLLAMA_MODEL", "llama3"),
+        num_ctx=int(os.getenv("OLLAMA_NUM_CTX", "4096")),
+        timeout=float(os.getenv("OLLAMA_TIMEOUT", "120")),
+        connect_timeout=1,
+        pool_size=int(os.getenv("OLLAMA_POOL_SIZE", "4")),
+    )
+
+
+BACKEND_FACTORIES = {
+    "openrouter": _build_openrouter,
+    "openai": _build_openai,
+    "ollama": _build_ollama,
+}
+
+_lock = threading.Lock()
+_backends: Dict[str, LLMBackend] = {}
+
+
+def get_backend(name: Optional[str] = None) -> LLMBackend:
+    """Backend by name (defaults to LLM_BACKEND); instances and their pools are shared"""
+    name = name or DEFAULT_BACKEND
+    if name not in BACKEND_FACTORIES:
+        raise ValueError(f"Unknown LLM backend '{name}', expected one of {', '.join(BACKEND_FACTORIES)}")
+
+    with _lock:
+        backend = _backends.get(name)
+        if backend is None:
+            backend = BACKEND_FACTORIES[name]()
+            _backends[name] = backend
+        return backend
+
+
+def close_all():
+    with _lock:
+        backends = list(_backends.values())
+        _backends.clear()
+    for backend in backends:
+        backend.close()
@@ -1,46 +1,118 @@
 import re
 from typing import List, Dict, Optional
 from models import ExternalDBCredential
-from getschemas import get_user_database_schemas, format_schema_for_llm, get_external_db_connection, get_sample_data
-import requests
+from getschemas import (
+    get_user_database_schemas,
+    format_schema_for_llm,
+    external_connection,
+    get_sample_data,
+    DEFAULT_SCHEMA_FORMAT
+)
+from llmbackends import get_backend, DEFAULT_BACKEND
+from llmresilience import LLMError, complete_with_resilience
+from fewshot import nearest_examples
+from llmscheduler import scheduler as llm_scheduler
+from singleflight import SingleFlight
+from conversations import is_followup, relevant_tables, tables_in_sql
+from cachebackend import get_cache
+from federation import FederationError, parse_plan, render_plan
+import preparedstatements
+import tracing
+import hashlib
 import json
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
+# Bump whenever the prompt template below changes so responses and logs can be
+# tied back to the exact prompt that produced them.
+PROMPT_TEMPLATE_VERSION = "3"
+
+# Nearest stored question -> SQL pairs injected into the prompt
+FEW_SHOT_EXAMPLES = 3
+
+# Identical prompts in flight at the same time (dashboard refreshes) share one LLM call
+_llm_flight = SingleFlight("llm")
+
+# Model output for a prompt seen recently is reused by every worker (see cachebackend).
+# The prompt embeds the schema, examples and conversation context, so a schema change
+# produces a new key rather than a stale answer. 0 disables.
+SQL_CACHE_TTL_SECONDS = int(os.getenv("SQL_CACHE_TTL_SECONDS", "3600"))
+
+
+def get_prompt_version(schema_format: Optional[str] = None) -> str:
+    """Prompt identifier recorded with each request, e.g. v2-ddl"""
+    return f"v{PROMPT_TEMPLATE_VERSION}-{schema_format or DEFAULT_SCHEMA_FORMAT}"
+
 
 def query_model(
     prompt,
-    model="openai/gpt-oss-20b",  # OpenRouter model name
-    url="https://openrouter.ai/api/v1/chat/completions"
+    model: Optional[str] = None,
+    backend: Optional[str] = None
 ):
-    """Query the OpenRouter GPT-OSS-20B model"""
+    """
+    Query the configured LLM backend (OpenRouter by default, see llmbackends).
+
+    Retries, deadlines and the circuit breaker live in llmresilience; failures
+    are raised as LLMError rather than returned as text.
+    """
     try:
-        api_key = os.getenv("OPENROUTER_API_KEY")  # Store API key in env
-        if not api_key:
-            raise ValueError("Missing OPENROUTER_API_KEY environment variable")
+        llm = get_backend(backend)
+    except ValueError as e:
+        raise LLMError("configuration", str(e), backend=backend or DEFAULT_BACKEND)
+    with tracing.span("llmcall.query_model", **{
+        "llm.backend": llm.name, "llm.model": model or llm.model, "llm.prompt_chars": len(prompt)
+    }) as span:
+        response = complete_with_resilience(llm, prompt, model=model)
+        span.set_attribute("llm.response_chars", len(response))
+        return response
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
 
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": "You are an expert SQL query generator."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0,
-            "max_tokens": 1024
-        }
+def query_model_coalesced(prompt: str, backend: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    query_model inside this user's scheduler slot, sharing the backend call with
+    any identical call already in flight. Returns (response, queue_info).
+    """
+    # Every caller waits for (and is rate limited by) its own slot, so a leader's
+    # queue timeout or rate limit never reaches users who weren't throttled;
+    # only the backend call itself is shared
+    with llm_scheduler.slot(user_id) as ticket:
+        response, shared = _llm_flight.do(_prompt_key(prompt, backend), query_model, prompt, None, backend)
+        queue_info = ticket.to_dict()
+    if shared:
+        queue_info = {**queue_info, "coalesced": True}
+    return response, queue_info
 
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
 
-        return data["choices"][0]["message"]["content"].strip()
+def _prompt_key(prompt: str, backend: Optional[str]) -> str:
+    return hashlib.sha256(f"{backend or DEFAULT_BACKEND}\0{prompt}".encode()).hexdigest()
 
-    except Exception as e:
-        return f"Error querying OpenRouter: {str(e)}"
+
+def query_model_cached(prompt: str, backend: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    query_model_coalesced, answered from the shared SQL cache when this exact
+    prompt was answered recently. Returns (response, queue_info).
+    """
+    key = f"sql:{_prompt_key(prompt, backend)}"
+    if SQL_CACHE_TTL_SECONDS > 0:
+        cached = get_cache().get(key)
+        if cached is not None:
+            return cached, {"position": 0, "wait_ms": 0, "cached": True}
+    response, queue_info = query_model_coalesced(prompt, backend, user_id)
+    if SQL_CACHE_TTL_SECONDS > 0 and clean_sql_query(response).strip(';'):
+        get_cache().set(key, response, SQL_CACHE_TTL_SECONDS)
+    return response, queue_info
+
+
+def discard_cached_response(prompt: str, backend: Optional[str] = None):
+    """Forget a cached model response that turned out to be unusable"""
+    discard_response_key(_prompt_key(prompt, backend))
+
+
+def discard_response_key(response_key: str):
+    """discard_cached_response by the response_key a generate_* result carries, e.g. once its SQL failed to run"""
+    get_cache().delete(f"sql:{response_key}")
 
 
 def clean_sql_query(sql_query: str) -> str:
@@ -108,7 +180,8 @@ def build_enhanced_prompt(
     user_input: str, 
     schema_info: str, 
     available_databases: List[str],
-    preferred_db: Optional[str] = None
+    preferred_db: Optional[str] = None,
+    examples: Optional[List[Dict]] = None
 ) -> str:
     """Build an enhanced prompt for the LLM with better context"""
     
@@ -147,20 +220,238 @@ OUTPUT REQUIREMENTS:
 - Ensure the query is syntactically correct
 - Use standard PostgreSQL syntax
 - Include appropriate table prefixes when using JOINs
+"""
 
+    if examples:
+        # Past questions against these same databases beat generic patterns
+        prompt += "\nEXAMPLES FROM THESE DATABASES:\n"
+        for example in examples:
+            prompt += f'- For "{example["question"]}": {example["sql"]}\n'
+    else:
+        prompt += """
 EXAMPLE PATTERNS:
 - For "find customers named John": SELECT * FROM customers WHERE name ILIKE '%john%';
 - For "sales in 2023": SELECT * FROM sales WHERE date_created >= '2023-01-01' AND date_created < '2024-01-01';
 - For "top 10 products": SELECT * FROM products ORDER BY some_metric DESC LIMIT 10;
+"""
 
-Generate the SQL query now:"""
+    prompt += "\nGenerate the SQL query now:"
+
+    return prompt
+
+def build_followup_prompt(
+    user_input: str,
+    schema_info: str,
+    database: str,
+    context: Dict
+) -> str:
+    """Compact prompt for a follow-up: previous SQL plus only the tables it touches"""
+    prompt = f"""You are an expert SQL query generator continuing a conversation about the '{database}' database.
+
+"""
+    if context.get("summary"):
+        prompt += f"EARLIER IN THIS CONVERSATION:\n{context['summary']}\n\n"
+
+    recent = [turn for turn in context.get("recent", []) if turn.get("sql")]
+    if len(recent) > 1:
+        prompt += "RECENT QUESTIONS:\n"
+        for turn in recent[:-1]:
+            prompt += f'- "{turn["question"]}": {turn["sql"]}\n'
+        prompt += "\n"
+
+    prompt += f"""PREVIOUS QUESTION: "{context['previous_question']}"
+PREVIOUS SQL: {context['previous_sql']}
 
+RELEVANT TABLES:
+{schema_info}
+
+FOLLOW-UP QUESTION: "{user_input}"
+
+Rewrite or extend the previous SQL to answer the follow-up question. Return ONLY the
+PostgreSQL query, no explanations or comments.
+
+Generate the SQL query now:"""
     return prompt
 
+def build_federated_prompt(user_input: str, schema_info: str, available_databases: List[str]) -> str:
+    """Prompt for a question spanning several databases; the model answers with a JSON plan"""
+    return f"""You are an expert PostgreSQL query planner. The user's data is split across
+several separate databases that cannot query each other, so answer with a
+plan: one read-only sub-query per database, combined by the application.
+
+USER QUESTION: "{user_input}"
+
+{schema_info}
+
+AVAILABLE DATABASES: {', '.join(available_databases)}
+
+Return ONLY a JSON object of this shape, no explanations:
+{{
+  "subqueries": [
+    {{"name": "o", "database": "<database>", "sql": "SELECT ..."}},
+    {{"name": "c", "database": "<database>", "sql": "SELECT ..."}}
+  ],
+  "joins": [{{"right": "c", "on": [["o.<column>", "c.<column>"]], "type": "inner"}}],
+  "group_by": ["c.<column>"],
+  "aggregates": [{{"func": "sum", "column": "o.<column>", "as": "<name>"}}],
+  "select": ["c.<column>", "<aggregate name>"],
+  "order_by": [{{"column": "<aggregate name or name.column>", "desc": true}}],
+  "limit": 10
+}}
+
+RULES:
+- Each sub-query runs on its own database: only tables from that database, SELECT only
+- Put every filter that concerns one database inside its sub-query's WHERE clause
+- Select only the columns needed for joins, grouping, aggregates and the answer
+- The first sub-query is joined, in order, with each "right" sub-query; "type" is inner or left
+- Refer to columns as <sub-query name>.<column as returned by its SELECT>
+- func is one of count, sum, avg, min, max; use "column": "*" with count for row counts
+- Leave out group_by/aggregates/select/order_by/limit when they are not needed
+
+Generate the JSON plan now:"""
+
+def generate_federated_plan(
+    user_input: str,
+    user_db_credentials: List[ExternalDBCredential],
+    schema_format: Optional[str] = None,
+    llm_backend: Optional[str] = None,
+    user_id: Optional[str] = None
+) -> Dict:
+    """
+    Plan for a question that needs data from more than one database (see federation)
+
+    Returns:
+        Dict with 'plan', 'sql' (the rendered plan), 'database', 'tables',
+        'error', 'prompt_version' and 'queue' keys
+    """
+    with tracing.span("llmcall.generate_federated_plan", databases=len(user_db_credentials or [])) as span:
+        if not user_input or not user_input.strip():
+            return {"error": "User input cannot be empty", "sql": "", "database": ""}
+
+        user_schemas = get_user_database_schemas(user_db_credentials)
+        reachable = {name: info for name, info in user_schemas.items() if 'error' not in info}
+        if len(reachable) < 2:
+            return {
+                "error": "Federated questions need at least two reachable databases",
+                "error_type": "federation",
+                "sql": "",
+                "database": ""
+            }
+
+        prompt = build_federated_prompt(user_input, format_schema_for_llm(reachable, schema_format), list(reachable))
+        prompt_version = f"{get_prompt_version(schema_format)}-federated"
+        logger.info(f"LLM prompt {prompt_version}: {len(prompt)} chars")
+        try:
+            raw_plan, queue_info = query_model_cached(prompt, llm_backend, user_id)
+        except LLMError as e:
+            logger.error(f"LLM call failed ({e.kind}): {e.message}")
+            return {
+                "error": e.message,
+                "error_type": e.kind,
+                "sql": "",
+                "database": "",
+                "prompt_version": prompt_version,
+                "queue": None
+            }
+
+        try:
+            plan = parse_plan(raw_plan, list(reachable))
+        except FederationError as e:
+            discard_cached_response(prompt, llm_backend)
+            span.record_error(e)
+            return {
+                "error": str(e),
+                "error_type": "invalid_plan",
+                "sql": "",
+                "database": "",
+                "prompt_version": prompt_version,
+                "queue": queue_info
+            }
+
+        databases = list(dict.fromkeys(subquery["database"] for subquery in plan["subqueries"]))
+        tables = []
+        for subquery in plan["subqueries"]:
+            schema = reachable[subquery["database"]].get('schema') or {}
+            tables.extend(t for t in tables_in_sql(subquery["sql"], schema) if t not in tables)
+        span.set_attributes(**{"federation.subqueries": len(plan["subqueries"]), "prompt_version": prompt_version})
+        return {
+            "plan": plan,
+            "sql": render_plan(plan),
+            "database": " + ".join(databases),
+            "tables": tables,
+            "error": "",
+            "prompt_version": prompt_version,
+            "queue": queue_info,
+            "response_key": _prompt_key(prompt, llm_backend)
+        }
+
+def _build_full_prompt(
+    user_input: str,
+    user_schemas: Dict[str, Dict],
+    user_db_credentials: List[ExternalDBCredential],
+    preferred_db_name: Optional[str],
+    schema_format: Optional[str]
+):
+    """Full-schema prompt for a fresh question; returns (prompt, prompt_version, preferred_db_name)"""
+    formatted_schema = format_schema_for_llm(user_schemas, schema_format)
+    prompt_version = get_prompt_version(schema_format)
+    available_dbs = list(user_schemas.keys())
+
+    # Try to determine preferred database
+    if not preferred_db_name:
+        preferred_db_name = extract_database_preference(user_input, available_dbs)
+
+    # Retrieve similar past questions for the database(s) in play
+    credential_ids_by_name = {
+        (credential.name or f"DB_{credential.id}"): credential.id
+        for credential in user_db_credentials
+    }
+    if preferred_db_name in credential_ids_by_name:
+        example_sources = [credential_ids_by_name[preferred_db_name]]
+    else:
+        example_sources = list(credential_ids_by_name.values())
+    examples = nearest_examples(example_sources, user_input, k=FEW_SHOT_EXAMPLES)
+
+    prompt = build_enhanced_prompt(
+        user_input,
+        formatted_schema,
+        available_dbs,
+        preferred_db_name,
+        examples
+    )
+    return prompt, prompt_version, preferred_db_name
+
+def _followup_schema(user_schemas: Dict[str, Dict], user_input: str, context: Optional[Dict]) -> Optional[Dict]:
+    """Schema dict cut down to the follow-up's tables, or None to fall back to the full prompt"""
+    other_databases = [name for name in user_schemas if name != (context or {}).get("database")]
+    if not is_followup(user_input, context, other_databases):
+        # A new question in the same conversation gets every database's schema
+        return None
+    db_info = user_schemas.get(context.get("database"))
+    if not db_info or 'error' in db_info:
+        return None
+
+    schema = db_info.get('schema') or {}
+    tables = relevant_tables(schema, context.get("tables") or [], user_input)
+    if not tables:
+        return None
+    profiles = db_info.get('profiles') or {}
+    return {
+        context["database"]: {
+            **db_info,
+            'schema': {table: schema[table] for table in tables},
+            'profiles': {table: profiles[table] for table in tables if table in profiles}
+        }
+    }
+
 def generate_sql_response(
     user_input: str, 
     user_db_credentials: List[ExternalDBCredential],
-    preferred_db_name: Optional[str] = None
+    preferred_db_name: Optional[str] = None,
+    schema_format: Optional[str] = None,
+    llm_backend: Optional[str] = None,
+    user_id: Optional[str] = None,
+    context: Optional[Dict] = None
 ) -> Dict[str, str]:
     """
     Generate SQL response based on user input and their available databases
@@ -169,10 +460,40 @@ def generate_sql_response(
         user_input: The user's natural language query
         user_db_credentials: List of user's database connections
         preferred_db_name: Optional preferred database name
+        schema_format: Schema encoding for the prompt ("verbose", "ddl" or "json")
+        llm_backend: LLM backend name (see llmbackends); deployment default if omitted
+        user_id: Requesting user, for fair scheduling of LLM calls
+        context: Previous turn of the conversation (see conversations.load_context);
+            when given, a compact follow-up prompt replaces the full schema prompt
     
     Returns:
-        Dict with 'sql', 'database', 'error' keys
+        Dict with 'sql', 'database', 'tables', 'error', 'prompt_version' and 'queue' keys
     """
+    with tracing.span("llmcall.generate_sql_response", **{
+        "question_chars": len(user_input or ""), "databases": len(user_db_credentials or []), "followup": bool(context)
+    }) as span:
+        result = _generate_sql_response(
+            user_input, user_db_credentials, preferred_db_name, schema_format, llm_backend, user_id, context
+        )
+        span.set_attributes(**{
+            "db.name": result.get("database") or "",
+            "prompt_version": result.get("prompt_version") or "",
+            "sql.tables": len(result.get("tables") or []),
+        })
+        if result.get("error"):
+            span.set_attribute("error_type", result.get("error_type") or "generation")
+            span.record_error(result["error"])
+        return result
+
+def _generate_sql_response(
+    user_input: str,
+    user_db_credentials: List[ExternalDBCredential],
+    preferred_db_name: Optional[str],
+    schema_format: Optional[str],
+    llm_backend: Optional[str],
+    user_id: Optional[str],
+    context: Optional[Dict]
+) -> Dict[str, str]:
     if not user_input or not user_input.strip():
         return {"error": "User input cannot be empty", "sql": "", "database": ""}
     
@@ -186,36 +507,72 @@ def generate_sql_response(
         if not user_schemas:
             return {"error": "No accessible databases found", "sql": "", "database": ""}
         
-        # Format schema for LLM
-        formatted_schema = format_schema_for_llm(user_schemas)
-        
         # Get list of available database names
         available_dbs = list(user_schemas.keys())
+
+        followup_schema = _followup_schema(user_schemas, user_input, context)
+        if followup_schema is not None:
+            # Follow-up: previous SQL plus only the tables it (and the new question) touch
+            preferred_db_name = context["database"]
+            prompt = build_followup_prompt(
+                user_input,
+                format_schema_for_llm(followup_schema, schema_format),
+                preferred_db_name,
+                context
+            )
+            prompt_version = f"{get_prompt_version(schema_format)}-followup"
+        else:
+            prompt, prompt_version, preferred_db_name = _build_full_prompt(
+                user_input, user_schemas, user_db_credentials, preferred_db_name, schema_format
+            )
         
-        # Try to determine preferred database
-        if not preferred_db_name:
-            preferred_db_name = extract_database_preference(user_input, available_dbs)
-        
-        # Build enhanced prompt
-        prompt = build_enhanced_prompt(
-            user_input, 
-            formatted_schema, 
-            available_dbs,
-            preferred_db_name
-        )
-        
-        # Query the model
-        raw_sql = query_model(prompt=prompt)
+        logger.info(f"LLM prompt {prompt_version}: {len(prompt)} chars")
+        tracing.current_span().set_attributes(**{
+            "llm.prompt_chars": len(prompt), "llm.prompt_tokens_estimate": len(prompt) // 4
+        })
+
+        # Query the model once the scheduler gives this user a slot
+        try:
+            raw_sql, queue_info = query_model_cached(prompt, llm_backend, user_id)
+        except LLMError as e:
+            logger.error(f"LLM call failed ({e.kind}): {e.message}")
+            return {
+                "error": e.message,
+                "error_type": e.kind,
+                "sql": "",
+                "database": "",
+                "prompt_version": prompt_version,
+                "queue": None
+            }
+        tracing.current_span().set_attributes(**{
+            "llm.queue_wait_ms": (queue_info or {}).get("wait_ms", 0),
+            "llm.coalesced": bool((queue_info or {}).get("coalesced")),
+            "llm.cached": bool((queue_info or {}).get("cached"))
+        })
         clean_sql = clean_sql_query(raw_sql)
+        if not clean_sql or clean_sql == ';':
+            return {
+                "error": "The model returned no SQL",
+                "error_type": "empty_response",
+                "sql": "",
+                "database": "",
+                "prompt_version": prompt_version,
+                "queue": queue_info
+            }
         
         # Determine which database to use
         target_database = preferred_db_name or available_dbs[0]
+        target_schema = user_schemas.get(target_database, {}).get('schema') or {}
         
         return {
             "sql": clean_sql,
             "database": target_database,
+            "tables": tables_in_sql(clean_sql, target_schema),
             "error": "",
-            "available_databases": available_dbs
+            "available_databases": available_dbs,
+            "prompt_version": prompt_version,
+            "queue": queue_info,
+            "response_key": _prompt_key(prompt, llm_backend)
         }
         
     except Exception as e:
@@ -227,40 +584,46 @@ def execute_sql_query(
     limit: int = 100
 ) -> Dict:
     """Execute SQL query on the specified database"""
+    with tracing.span("llmcall.execute_sql_query", **{"db.id": str(db_credential.id), "sql.limit": limit}) as span:
+        result = _execute_sql_query(sql_query, db_credential, limit)
+        span.set_attribute("db.rows", result.get("row_count", result.get("affected_rows", 0)))
+        if result.get("error"):
+            span.record_error(result["error"])
+        return result
+
+def _execute_sql_query(sql_query: str, db_credential: ExternalDBCredential, limit: int) -> Dict:
     try:
-        conn = get_external_db_connection(db_credential)
-        if not conn:
-            return {"error": "Failed to connect to database", "data": []}
-        
-        with conn.cursor() as cur:
-            # Add LIMIT if not already present in SELECT queries
-            if sql_query.strip().upper().startswith('SELECT') and 'LIMIT' not in sql_query.upper():
-                sql_query = sql_query.rstrip(';') + f' LIMIT {limit};'
-            
-            cur.execute(sql_query)
-            
-            # For SELECT queries, fetch results
-            if sql_query.strip().upper().startswith('SELECT'):
-                columns = [desc[0] for desc in cur.description]
-                rows = cur.fetchall()
-                
-                return {
-                    "data": [dict(zip(columns, row)) for row in rows],
-                    "columns": columns,
-                    "row_count": len(rows),
-                    "error": ""
-                }
-            else:
-                # For non-SELECT queries, return affected rows
-                conn.commit()
-                return {
-                    "data": [],
-                    "affected_rows": cur.rowcount,
-                    "error": ""
-                }
-                
+        with external_connection(db_credential) as conn:
+            if not conn:
+                return {"error": "Failed to connect to database", "data": []}
+
+            with conn.cursor() as cur:
+                # Add LIMIT if not already present in SELECT queries
+                if sql_query.strip().upper().startswith('SELECT') and 'LIMIT' not in sql_query.upper():
+                    sql_query = sql_query.rstrip(';') + f' LIMIT {limit};'
+
+                # Repeated questions reuse the pooled connection's prepared statement
+                preparedstatements.execute(cur, sql_query)
+
+                # For SELECT queries, fetch results
+                if sql_query.strip().upper().startswith('SELECT'):
+                    columns = [desc[0] for desc in cur.description]
+                    rows = cur.fetchall()
+
+                    return {
+                        "data": [dict(zip(columns, row)) for row in rows],
+                        "columns": columns,
+                        "row_count": len(rows),
+                        "error": ""
+                    }
+                else:
+                    # For non-SELECT queries, return affected rows
+                    conn.commit()
+                    return {
+                        "data": [],
+                        "affected_rows": cur.rowcount,
+                        "error": ""
+                    }
+
     except Exception as e:
         return {"error": f"Query execution error: {str(e)}", "data": []}
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
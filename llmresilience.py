@@ -0,0 +1,248 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+from llmbackends import LLMBackend
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "45"))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+
+# Hedging sends a second identical request once the first has been outstanding
+# longer than the recent p95. It trades some extra provider cost for tail latency.
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_MAX_IN_FLIGHT", "32")), thread_name_prefix="llm")
+
+
+class LLMError(Exception):
+    """Structured LLM failure; kind is stable and safe to return to clients"""
+
+    def __init__(self, kind: str, message: str, status_code: Optional[int] = None,
+                 retryable: bool = False, backend: Optional[str] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.status_code = status_code
+        self.retryable = retryable
+        self.backend = backend
+        self.retry_after = retry_after
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": self.kind,
+            "message": self.message,
+            "status_code": self.status_code,
+            "backend": self.backend,
+            "retryable": self.retryable
+        }
+
+
+def classify_error(exc: Exception, backend: str) -> LLMError:
+    """Map a backend exception to an LLMError"""
+    if isinstance(exc, LLMError):
+        return exc
+    import json
+
+    import requests
+
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        retry_after = exc.response.headers.get("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        if status == 429:
+            return LLMError("rate_limited", "LLM provider rate limit exceeded", status, True, backend, retry_after)
+        if status >= 500:
+            return LLMError("provider_error", f"LLM provider returned {status}", status, True, backend, retry_after)
+        if status in (401, 403):
+            return LLMError("auth_error", f"LLM provider rejected credentials ({status})", status, False, backend)
+        return LLMError("bad_request", f"LLM provider returned {status}", status, False, backend)
+    if isinstance(exc, (requests.Timeout, TimeoutError)):
+        return LLMError("timeout", "LLM request timed out", None, True, backend)
+    if isinstance(exc, requests.ConnectionError):
+        return LLMError("unavailable", "Could not reach the LLM provider", None, True, backend)
+    if isinstance(exc, (json.JSONDecodeError, requests.JSONDecodeError)):
+        # A truncated or garbled body, e.g. a proxy's error page; worth another try
+        return LLMError("bad_response", "LLM provider returned a response that isn't valid JSON", None, True, backend)
+    if isinstance(exc, ValueError):
+        return LLMError("configuration", str(exc), None, False, backend)
+    return LLMError("bad_response", f"Unexpected LLM response: {exc}", None, False, backend)
+
+
+class CircuitBreaker:
+    """Fails fast after consecutive provider failures, then lets one probe through"""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release(self):
+        """Outcome says nothing about provider health; just end any probe"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    logger.warning("LLM circuit breaker opened")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies"""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+_state_lock = threading.Lock()
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, LatencyTracker] = {}
+
+
+def get_breaker(backend_name: str) -> CircuitBreaker:
+    with _state_lock:
+        return _breakers.setdefault(backend_name, CircuitBreaker())
+
+
+def breaker_states() -> Dict[str, str]:
+    with _state_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.state for name, breaker in breakers.items()}
+
+
+def _get_latency_tracker(backend_name: str) -> LatencyTracker:
+    with _state_lock:
+        return _latencies.setdefault(backend_name, LatencyTracker())
+
+
+def _timed_complete(backend: LLMBackend, prompt: str, model: Optional[str], deadline: float):
+    start = time.monotonic()
+    # The HTTP call gives up with the attempt instead of holding an executor thread past it
+    result = backend.complete(prompt, model=model, timeout=deadline - start)
+    return result, time.monotonic() - start
+
+
+def _attempt(backend: LLMBackend, prompt: str, model: Optional[str], timeout: float) -> str:
+    """One attempt with a hard deadline, hedged after the recent p95 if enabled"""
+    tracker = _get_latency_tracker(backend.name)
+    deadline = time.monotonic() + timeout
+    futures = {_executor.submit(_timed_complete, backend, prompt, model, deadline)}
+
+    hedge_delay = tracker.percentile(0.95) if HEDGE_ENABLED else None
+    if hedge_delay is not None and hedge_delay < timeout:
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done:
+            logger.info(f"Hedging LLM request to {backend.name} after {hedge_delay:.2f}s")
+            futures.add(_executor.submit(_timed_complete, backend, prompt, model, deadline))
+
+    last_error = None
+    while futures:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, futures = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result, elapsed = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            tracker.record(elapsed)
+            return result
+
+    if last_error is not None and not futures:
+        raise classify_error(last_error, backend.name)
+    raise LLMError("timeout", f"LLM request exceeded {timeout:g}s", None, True, backend.name)
+
+
+def complete_with_resilience(backend: LLMBackend, prompt: str, model: Optional[str] = None) -> str:
+    """
+    Call backend.complete with per-attempt deadlines, jittered retries on
+    429/5xx/timeouts and a per-backend circuit breaker. Raises LLMError.
+    """
+    breaker = get_breaker(backend.name)
+    if not breaker.allow():
+        raise LLMError("circuit_open", "LLM provider is temporarily unavailable", None, True, backend.name)
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            result = _attempt(backend, prompt, model, ATTEMPT_TIMEOUT_SECONDS)
+            breaker.record_success()
+            return result
+        except Exception as e:
+            error = classify_error(e, backend.name)
+
+        if not error.retryable:
+            # Client-side problems (bad key, bad request) say nothing about provider health
+            breaker.release()
+            raise error
+        if attempt == MAX_ATTEMPTS:
+            breaker.record_failure()
+            raise error
+
+        # Full jitter, but never retry sooner than the provider asked us to
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+        if error.retry_after:
+            delay = max(delay, min(error.retry_after, BACKOFF_MAX_SECONDS))
+        logger.warning(f"LLM attempt {attempt} failed ({error.kind}), retrying in {delay:.2f}s")
+        time.sleep(delay)
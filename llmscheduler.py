@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import metrics
+from llmresilience import LLMError
+
+# Global cap on LLM calls in flight, shared fairly between users
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Per-user token bucket: sustained requests per minute and burst size
+USER_RATE_PER_MINUTE = float(os.getenv("LLM_USER_RATE_PER_MINUTE", "20"))
+USER_BURST = int(os.getenv("LLM_USER_BURST", "5"))
+MAX_QUEUED_PER_USER = int(os.getenv("LLM_MAX_QUEUED_PER_USER", "10"))
+# Waiters block a threadpool thread each (AnyIO's default limit is 40), so the
+# whole queue stays well under that and requests fail fast past it
+MAX_QUEUED_TOTAL = int(os.getenv("LLM_MAX_QUEUED_TOTAL", "16"))
+MAX_QUEUE_WAIT_SECONDS = float(os.getenv("LLM_MAX_QUEUE_WAIT", "60"))
+# How often buckets of users with nothing queued are dropped once they've refilled
+BUCKET_EVICT_INTERVAL_SECONDS = 60
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def seconds_until_token(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Ticket:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.position = 0
+
+    @property
+    def wait_ms(self) -> float:
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return round((end - self.enqueued_at) * 1000, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"position": self.position, "wait_ms": self.wait_ms}
+
+
+class FairScheduler:
+    """
+    Admission control in front of the LLM provider.
+
+    Each user has a FIFO queue and a token bucket. Free slots (up to
+    max_concurrency) are handed out round-robin across users whose bucket has a
+    token, so one user's script can't starve everybody else.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, rate_per_minute: float = USER_RATE_PER_MINUTE,
+                 burst: int = USER_BURST, max_queued_per_user: int = MAX_QUEUED_PER_USER,
+                 max_queued_total: int = MAX_QUEUED_TOTAL, max_wait: float = MAX_QUEUE_WAIT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_queued_per_user = max_queued_per_user
+        self.max_queued_total = max_queued_total
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._active = 0
+        self._queued = 0
+        self._evicted_at = time.monotonic()
+
+    def _bucket(self, user_id: str) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate_per_second, self.burst)
+        return bucket
+
+    def _evict_idle_buckets(self, now: float):
+        """A full bucket with no queue behaves like a new one, so it needn't be kept"""
+        if now - self._evicted_at < BUCKET_EVICT_INTERVAL_SECONDS:
+            return
+        self._evicted_at = now
+        for user_id, bucket in list(self._buckets.items()):
+            if user_id in self._queues:
+                continue
+            bucket._refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self._buckets[user_id]
+
+    def _fair_position(self, user_id: str) -> int:
+        """Slots handed out before this ticket under round-robin, counting itself"""
+        own_index = len(self._queues[user_id]) - 1
+        ahead = sum(min(len(queue), own_index + 1) for user, queue in self._queues.items() if user != user_id)
+        return ahead + own_index + 1
+
+    def _dispatch(self, now: float) -> float:
+        """Grant free slots round-robin; returns how long until a rate-limited user can go"""
+        next_refill = self.max_wait
+        while self._active < self.max_concurrency and self._queues:
+            granted = False
+            for user_id in list(self._queues):
+                bucket = self._bucket(user_id)
+                if not bucket.try_take(now):
+                    next_refill = min(next_refill, bucket.seconds_until_token(now))
+                    continue
+                queue = self._queues[user_id]
+                ticket = queue.popleft()
+                ticket.granted_at = now
+                self._active += 1
+                self._queued -= 1
+                if queue:
+                    self._queues.move_to_end(user_id)
+                else:
+                    del self._queues[user_id]
+                granted = True
+                break
+            if not granted:
+                break
+        self._evict_idle_buckets(now)
+        self._record_gauges()
+        self._cond.notify_all()
+        return next_refill
+
+    def _record_gauges(self):
+        metrics.set_gauge("llm.scheduler.active", self._active)
+        metrics.set_gauge("llm.scheduler.queued", self._queued)
+        metrics.set_gauge("llm.scheduler.queued_users", len(self._queues))
+
+    @contextmanager
+    def slot(self, user_id: Optional[Any] = None):
+        """Block until this user may call the LLM; yields the Ticket"""
+        user_id = str(user_id) if user_id is not None else "anonymous"
+        ticket = Ticket(user_id)
+
+        with self._cond:
+            if self._queued >= self.max_queued_total:
+                metrics.incr("llm.scheduler.rejected")
+                raise LLMError("queue_full", "The assistant is busy right now, please try again shortly", retryable=True)
+            queue = self._queues.setdefault(user_id, deque())
+            if len(queue) >= self.max_queued_per_user:
+                metrics.incr("llm.scheduler.rejected")
+                raise LLMError("queue_full", "Too many pending questions, please wait for the previous ones", retryable=True)
+            queue.append(ticket)
+            self._queued += 1
+            ticket.position = self._fair_position(user_id)
+
+            deadline = ticket.enqueued_at + self.max_wait
+            while ticket.granted_at is None:
+                now = time.monotonic()
+                next_refill = self._dispatch(now)
+                if ticket.granted_at is not None:
+                    break
+                if now >= deadline:
+                    queue = self._queues.get(user_id)
+                    if queue is not None:
+                        queue.remove(ticket)
+                        if not queue:
+                            del self._queues[user_id]
+                    self._queued -= 1
+                    self._record_gauges()
+                    metrics.incr("llm.scheduler.timed_out")
+                    raise LLMError("queue_timeout", "Timed out waiting for an LLM slot", retryable=True)
+                self._cond.wait(timeout=max(0.01, min(deadline - now, next_refill)))
+
+        metrics.incr("llm.scheduler.granted")
+        metrics.observe("llm.scheduler.wait_ms", ticket.wait_ms)
+        try:
+            yield ticket
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._dispatch(time.monotonic())
+
+
+scheduler = FairScheduler()
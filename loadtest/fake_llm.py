@@ -0,0 +1,107 @@
+"""
+Stand-in LLM server for load tests: speaks the OpenAI chat-completions API
+(/v1/chat/completions) and Ollama's /api/generate, sleeps for a latency drawn
+from a configurable distribution and answers with canned SQL for the synthetic
+schema (see synthetic.py). Point the app at it with
+
+    LLM_BACKEND=openai OPENAI_COMPAT_URL=http://127.0.0.1:8001/v1
+
+    python loadtest/fake_llm.py --port 8001 --latency lognormal:0.8,0.5 --error-rate 0.01
+
+Latency specs: fixed:SECONDS, uniform:LOW,HIGH, lognormal:MEDIAN,SIGMA,
+exponential:MEAN. --error-rate returns 500s (and --rate-limit-rate 429s) at random.
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import uvicorn  # noqa: E402
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from synthetic import sql_for_prompt  # noqa: E402
+
+
+def parse_latency(spec: str):
+    """Latency spec -> zero-argument sampler returning seconds"""
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    if kind == "exponential":
+        return lambda: random.expovariate(1.0 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def create_app(latency: str = "lognormal:0.8,0.5", error_rate: float = 0.0, rate_limit_rate: float = 0.0) -> FastAPI:
+    sample_latency = parse_latency(latency)
+    app = FastAPI(title="Stand-in LLM")
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0, "started_at": time.time()}
+
+    async def respond(prompt: str):
+        stats["requests"] += 1
+        await asyncio.sleep(sample_latency())
+        roll = random.random()
+        if roll < error_rate:
+            stats["errors"] += 1
+            return None, JSONResponse({"error": "injected failure"}, status_code=500)
+        if roll < error_rate + rate_limit_rate:
+            stats["rate_limited"] += 1
+            return None, JSONResponse({"error": "injected rate limit"}, status_code=429, headers={"Retry-After": "1"})
+        return sql_for_prompt(prompt), None
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+        sql, error = await respond(prompt)
+        if error is not None:
+            return error
+        return {
+            "id": "loadtest",
+            "object": "chat.completion",
+            "model": body.get("model", "loadtest"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": sql}, "finish_reason": "stop"}],
+        }
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        sql, error = await respond(body.get("prompt", ""))
+        if error is not None:
+            return error
+        return {"model": body.get("model", "loadtest"), "response": sql, "done": True}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", default="lognormal:0.8,0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.error_rate, args.rate_limit_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Stand-in OTLP/HTTP collector: accepts JSON span exports on /v1/traces and
+appends them to a file in the same JSON-lines shape as TRACE_EXPORTER=file,
+so `python tracing.py <file> <trace_id>` works on either.
+
+    python loadtest/fake_otlp.py --port 4318 --out otlp_traces.jsonl
+    TRACE_EXPORTER=otlp TRACE_OTLP_ENDPOINT=http://127.0.0.1:4318/v1/traces uvicorn main:app
+"""
+import argparse
+import json
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+
+def _attribute_value(value: dict):
+    for key in ("stringValue", "boolValue", "doubleValue"):
+        if key in value:
+            return value[key]
+    if "intValue" in value:
+        return int(value["intValue"])
+    return None
+
+
+def flatten(body: dict):
+    """OTLP resourceSpans -> tracing.Span.to_dict()-shaped records"""
+    for resource_spans in body.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                start, end = int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"])
+                status = span.get("status", {})
+                yield {
+                    "trace_id": span["traceId"],
+                    "span_id": span["spanId"],
+                    "parent_id": span.get("parentSpanId") or None,
+                    "name": span["name"],
+                    "start_ns": start,
+                    "end_ns": end,
+                    "duration_ms": round((end - start) / 1e6, 3),
+                    "status": "error" if status.get("code") == 2 else "ok",
+                    "error": status.get("message") or None,
+                    "attributes": {a["key"]: _attribute_value(a["value"]) for a in span.get("attributes", [])},
+                }
+
+
+def create_app(out: str) -> FastAPI:
+    app = FastAPI(title="Stand-in OTLP collector")
+
+    @app.post("/v1/traces")
+    async def traces(request: Request):
+        records = list(flatten(await request.json()))
+        with open(out, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        return {"accepted": len(records)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--out", default="otlp_traces.jsonl")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.out), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
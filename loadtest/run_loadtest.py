@@ -0,0 +1,144 @@
+"""
+One-shot load test: seed tenant databases, boot the stand-in LLM and main:app
+under uvicorn, run the driver and print the report. Nothing external is called:
+the app's LLM backend points at fake_llm.py and its app database lives on the
+same (local or --docker) Postgres as the tenants.
+
+    python loadtest/run_loadtest.py --docker --duration 60 --concurrency 50
+    python loadtest/run_loadtest.py --admin-dsn postgresql://postgres:pw@localhost/postgres \\
+        --llm-latency lognormal:1.5,0.7 --llm-error-rate 0.02 --workers 2
+
+Per-user LLM rate limits are lifted by default so the test measures capacity
+rather than the limiter; pass --keep-rate-limits to test with the real ones.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import httpx  # noqa: E402
+import psycopg2  # noqa: E402
+
+import driver  # noqa: E402
+import seed_postgres  # noqa: E402
+
+APP_DATABASE = "lt_app"
+
+
+def wait_for(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{url} did not come up within {timeout:g}s")
+        time.sleep(0.5)
+
+
+def create_app_database(admin_dsn: str) -> str:
+    admin = psycopg2.connect(admin_dsn)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{APP_DATABASE}"')
+            cur.execute(f'CREATE DATABASE "{APP_DATABASE}"')
+    finally:
+        admin.close()
+    dsn = seed_postgres.tenant_dsn(admin_dsn, APP_DATABASE)
+    # The app schema needs gen_random_uuid() on older servers
+    conn = psycopg2.connect(dsn)
+    with conn, conn.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
+    conn.close()
+    return dsn.replace("postgresql://", "postgresql+psycopg2://", 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--admin-dsn", default=os.getenv("LOADTEST_ADMIN_DSN"))
+    parser.add_argument("--docker", action="store_true")
+    parser.add_argument("--tenants", type=int, default=5)
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--extra-tables", type=int, default=20)
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.5")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-port", type=int, default=8001)
+    parser.add_argument("--app-port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for main:app")
+    parser.add_argument("--keep-rate-limits", action="store_true")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--connections-per-user", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--mix", default=driver.DEFAULT_MIX)
+    parser.add_argument("--json", help="also write the full report to this file")
+    args = parser.parse_args()
+
+    admin_dsn = seed_postgres.start_docker_postgres() if args.docker else args.admin_dsn
+    if not admin_dsn:
+        parser.error("--admin-dsn (or LOADTEST_ADMIN_DSN) or --docker is required")
+
+    tenant_dsns = seed_postgres.seed(admin_dsn, args.tenants, args.customers, args.extra_tables)
+    app_database_url = create_app_database(admin_dsn)
+
+    llm_url = f"http://127.0.0.1:{args.llm_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    # Shared by the app and the driver, which reads the server's /metrics with it
+    os.environ.setdefault("OPS_TOKEN", "loadtest-ops")
+    env = {
+        **os.environ,
+        "DATABASE_URL": app_database_url,
+        "SECRET_KEY": os.getenv("SECRET_KEY", "loadtest-secret"),
+        "LLM_BACKEND": "openai",
+        "OPENAI_COMPAT_URL": f"{llm_url}/v1",
+        "OPENAI_COMPAT_MODEL": "loadtest",
+    }
+    if not args.keep_rate_limits:
+        env.update({"LLM_USER_RATE_PER_MINUTE": "1000000", "LLM_USER_BURST": "1000000"})
+
+    processes = []
+    try:
+        processes.append(subprocess.Popen([
+            sys.executable, os.path.join(HERE, "fake_llm.py"), "--port", str(args.llm_port),
+            "--latency", args.llm_latency, "--error-rate", str(args.llm_error_rate)
+        ]))
+        wait_for(f"{llm_url}/stats")
+
+        subprocess.run([sys.executable, "migrate.py"], cwd=ROOT, env=env, check=True)
+        processes.append(subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port),
+            "--workers", str(args.workers), "--log-level", "warning"
+        ], cwd=ROOT, env=env))
+        wait_for(f"{app_url}/readyz")
+
+        report = asyncio.run(driver.run(
+            app_url, tenant_dsns, args.users, args.concurrency, args.duration, args.mix,
+            args.connections_per_user
+        ))
+        report["llm"] = httpx.get(f"{llm_url}/stats").json()
+        driver.print_report(report)
+        print(f"stand-in LLM: {report['llm']['requests']} calls")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2, default=str)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+The synthetic tenant schema shared by the seeder, the stand-in LLM and the driver:
+questions the driver asks, and the SQL the stand-in LLM answers them with, are
+valid against what seed_postgres.py creates.
+"""
+
+CORE_TABLES = """
+CREATE TABLE IF NOT EXISTS customers (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    email VARCHAR(150),
+    country VARCHAR(2),
+    created_at TIMESTAMP NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    category VARCHAR(30),
+    price NUMERIC(10, 2) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id SERIAL PRIMARY KEY,
+    customer_id INTEGER NOT NULL REFERENCES customers(id),
+    status VARCHAR(20) NOT NULL,
+    total NUMERIC(12, 2) NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+CREATE TABLE IF NOT EXISTS order_items (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id),
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    quantity INTEGER NOT NULL
+);
+"""
+
+EXTRA_TABLE = """
+CREATE TABLE IF NOT EXISTS {name} (
+    id SERIAL PRIMARY KEY,
+    customer_id INTEGER REFERENCES customers(id),
+    kind VARCHAR(20),
+    payload TEXT,
+    amount NUMERIC(10, 2),
+    created_at TIMESTAMP
+);
+"""
+
+COUNTRIES = ["US", "DE", "FR", "GB", "IN", "BR", "JP"]
+CATEGORIES = ["books", "games", "garden", "kitchen", "music", "toys"]
+STATUSES = ["pending", "paid", "shipped", "cancelled"]
+
+# (question, SQL) pairs; the stand-in LLM returns the SQL for the question it finds in the prompt
+CANNED = [
+    ("How many customers do we have?",
+     "SELECT COUNT(*) AS customers FROM customers;"),
+    ("Show the 20 most recent orders",
+     "SELECT id, customer_id, status, total, created_at FROM orders ORDER BY created_at DESC LIMIT 20;"),
+    ("Top 10 customers by total order value",
+     "SELECT c.name, SUM(o.total) AS spent FROM customers c JOIN orders o ON o.customer_id = c.id "
+     "GROUP BY c.name ORDER BY spent DESC LIMIT 10;"),
+    ("Revenue per product category",
+     "SELECT p.category, SUM(oi.quantity * p.price) AS revenue FROM order_items oi "
+     "JOIN products p ON p.id = oi.product_id GROUP BY p.category ORDER BY revenue DESC;"),
+    ("Orders per status",
+     "SELECT status, COUNT(*) FROM orders GROUP BY status;"),
+    ("Customers per country",
+     "SELECT country, COUNT(*) FROM customers GROUP BY country ORDER BY 2 DESC;"),
+    ("List all products in the toys category",
+     "SELECT id, name, price FROM products WHERE category = 'toys' LIMIT 100;"),
+    ("Average order value by month",
+     "SELECT date_trunc('month', created_at) AS month, AVG(total) FROM orders GROUP BY 1 ORDER BY 1;"),
+]
+
+QUESTIONS = [question for question, _ in CANNED]
+DEFAULT_SQL = CANNED[0][1]
+
+
+def sql_for_prompt(prompt: str) -> str:
+    """Canned SQL for whichever known question appears in the prompt"""
+    for question, sql in CANNED:
+        if question in prompt:
+            return sql
+    return DEFAULT_SQL
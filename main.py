@@ -1,7 +1,9 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from models import User
-from database import Base, engine, get_db
+from database import get_db
 from schemas import UserCreate, UserLogin  # Add missing imports
 from uuid import uuid4
 from datetime import datetime, timedelta
@@ -16,12 +18,49 @@ from auth import (
 from routes.dbcredentials import router as db_router
 from routes.llm import router as llm_router
 from routes.llmchat import router as llm_chat_router
+from warmup import schedule_user_warmup
+from reqprofiler import ProfilerMiddleware
+from tracing import TracingMiddleware
+from lifecycle import lifespan, health, readiness
+import metrics
+import hmac
+import logging
+import os
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Admin token for /metrics and the detailed /readyz report (X-Ops-Token header);
+# unset, both stay closed and /readyz only says whether the worker is ready
+OPS_TOKEN = os.getenv("OPS_TOKEN")
 
-app = FastAPI(title="Database Connection Manager", version="1.0.0")
+
+def _ops_authorized(request: Request) -> bool:
+    token = request.headers.get("x-ops-token")
+    if not OPS_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token.encode("latin-1"), OPS_TOKEN.encode())
+
+# Tables are created by `python migrate.py`, not on import
+app = FastAPI(title="Database Connection Manager", version="1.0.0", lifespan=lifespan)
+# Send X-Profile-Token: $PROFILE_TOKEN to profile a single request (see reqprofiler)
+app.add_middleware(ProfilerMiddleware)
+# Spans are exported when TRACE_EXPORTER is set (see tracing)
+app.add_middleware(TracingMiddleware)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the worker is up and serving"""
+    return health()
+
+@app.get("/readyz")
+async def readyz(request: Request):
+    """Readiness: startup warmup finished and the app database answers"""
+    report = await run_in_threadpool(readiness)
+    status_code = 200 if report["ready"] else 503
+    if not _ops_authorized(request):
+        # Pool, cache and tenant database details are for operators only
+        report = {"ready": report["ready"], "prewarm": report["prewarm"], "app_db": {"ok": report["app_db"]["ok"]}}
+    return JSONResponse(report, status_code=status_code)
 
 @app.post("/users/", status_code=status.HTTP_201_CREATED)
 async def create_user(user: UserCreate, db: Session = Depends(get_db)):
@@ -70,6 +109,9 @@ def login(
         data={"sub": user.email},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
+
+    # Pre-connect and pre-introspect the user's databases before their first question
+    schedule_user_warmup(user.id)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/me")
@@ -81,6 +123,13 @@ def read_me(current_user: User = Depends(get_current_user)):
         "created_at": current_user.created_at
     }
 
+@app.get("/metrics")
+def read_metrics(request: Request):
+    """In-process counters, gauges and latency percentiles for this worker; needs X-Ops-Token"""
+    if not _ops_authorized(request):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Ops token required")
+    return metrics.snapshot()
+
 # Include routers
 app.include_router(db_router)
 
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Dict
+
+# In-process metrics, exposed as JSON on GET /metrics to callers with the ops token
+# (see main). Histograms keep a bounded window of recent observations, which is
+# plenty for p50/p95/p99 on one worker.
+HISTOGRAM_WINDOW = 1024
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_histograms: Dict[str, deque] = {}
+
+
+def incr(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def get_counter(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    with _lock:
+        _histograms.setdefault(name, deque(maxlen=HISTOGRAM_WINDOW)).append(value)
+
+
+def _summarize(samples) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    return {
+        "count": len(ordered),
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+        "max": ordered[-1],
+    }
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {name: list(samples) for name, samples in _histograms.items()}
+
+    return {
+        "counters": counters,
+        "gauges": gauges,
+        "histograms": {name: _summarize(samples) for name, samples in histograms.items()},
+    }
+
+
+async def monitor_event_loop(interval: float = 0.5) -> None:
+    """
+    Record how late the event loop wakes up from a sleep as eventloop.lag_ms.
+    Anything blocking the loop (sync I/O in an async route) shows up here.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag_ms = max(0.0, (loop.time() - start - interval) * 1000)
+        observe("eventloop.lag_ms", round(lag_ms, 2))
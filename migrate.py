@@ -0,0 +1,82 @@
+"""
+Create the app database tables. Run once per deploy, before starting workers;
+the app itself no longer touches the schema at import or startup.
+
+    python migrate.py
+    python migrate.py --encrypt-credentials   # after setting CREDENTIAL_MASTER_KEY
+
+--encrypt-credentials seals plaintext passwords and re-wraps ones encrypted
+under a previous master key (see crypto.py); it is safe to run repeatedly.
+"""
+import logging
+import os
+import sys
+import time
+
+from sqlalchemy.exc import OperationalError
+
+import crypto
+import models  # noqa: F401  (registers every table on Base.metadata)
+from database import Base, SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+MIGRATE_RETRY_SECONDS = float(os.getenv("MIGRATE_RETRY_SECONDS", "30"))
+ENCRYPT_BATCH_SIZE = 500
+
+
+def migrate(retry_seconds: float = MIGRATE_RETRY_SECONDS):
+    """create_all, retrying while the database is still coming up"""
+    deadline = time.monotonic() + retry_seconds
+    delay = 0.5
+    while True:
+        try:
+            Base.metadata.create_all(bind=engine)
+            return
+        except OperationalError as e:
+            if time.monotonic() + delay > deadline:
+                raise
+            logger.warning(f"App database not reachable yet ({e.orig}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+
+
+def encrypt_credentials(batch_size: int = ENCRYPT_BATCH_SIZE) -> int:
+    """Bring every stored password under the active master key; returns how many rows changed"""
+    if not crypto.encryption_enabled():
+        raise crypto.CredentialKeyError("Set CREDENTIAL_MASTER_KEY before encrypting credentials")
+    changed = 0
+    db = SessionLocal()
+    try:
+        last_id = None
+        while True:
+            query = db.query(models.ExternalDBCredential).order_by(models.ExternalDBCredential.id)
+            if last_id is not None:
+                query = query.filter(models.ExternalDBCredential.id > last_id)
+            batch = query.limit(batch_size).all()
+            if not batch:
+                return changed
+            for credential in batch:
+                stored = crypto.rewrap(credential.db_password)
+                if stored != credential.db_password:
+                    credential.db_password = stored
+                    changed += 1
+            last_id = batch[-1].id
+            # One commit per batch, so an interrupted run keeps its progress
+            db.commit()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        migrate()
+    except OperationalError as e:
+        sys.exit(f"Migration failed: {e.orig}")
+    print("App database schema is up to date")
+    if "--encrypt-credentials" in sys.argv[1:]:
+        try:
+            print(f"Encrypted or re-wrapped {encrypt_credentials()} stored credentials")
+        except crypto.CredentialKeyError as e:
+            sys.exit(f"Credential encryption failed: {e}")
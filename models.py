@@ -1,5 +1,5 @@
-from sqlalchemy import Column,String, Text,Integer,TIMESTAMP, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column,String, Text,Integer,Float,TIMESTAMP, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID, ARRAY
 from sqlalchemy.sql import func
 import uuid
 
@@ -29,4 +29,54 @@ class ExternalDBCredential(Base):
     dbname = Column(Text, nullable=False)
     db_user = Column(Text, nullable=False)
     db_password = Column(Text, nullable=False)
-    created_at = Column(TIMESTAMP, server_default=func.now())
\ No newline at end of file
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+class ConnectionHealth(Base):
+    """Last background health check of an external database (see healthmonitor)"""
+    __tablename__ = "connection_health"
+
+    credential_id = Column(UUID(as_uuid=True), ForeignKey("external_db_credentials.id", ondelete="CASCADE"), primary_key=True)
+
+    status = Column(String(20), nullable=False)  # 'connected' or 'failed'
+    latency_ms = Column(Float)
+    table_count = Column(Integer)
+    last_error = Column(Text)
+    consecutive_failures = Column(Integer, nullable=False, default=0)
+    checked_at = Column(TIMESTAMP, nullable=False)
+    last_success_at = Column(TIMESTAMP)
+    next_check_at = Column(TIMESTAMP, nullable=False, index=True)
+
+class FewShotExample(Base):
+    __tablename__ = "fewshot_examples"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    credential_id = Column(UUID(as_uuid=True), ForeignKey("external_db_credentials.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    question = Column(Text, nullable=False)
+    sql = Column(Text, nullable=False)
+    source = Column(String(20), nullable=False)  # 'executed' or 'confirmed'
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+class Conversation(Base):
+    __tablename__ = "conversations"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    title = Column(Text)
+    summary = Column(Text)  # bounded digest of turns that fell out of the recent window
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+class ConversationTurn(Base):
+    __tablename__ = "conversation_turns"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    question = Column(Text, nullable=False)
+    sql = Column(Text)
+    database = Column(String(100))
+    tables = Column(ARRAY(Text))  # tables the SQL used, the follow-up prompt's schema subset
+    answer = Column(Text)
+    created_at = Column(TIMESTAMP, server_default=func.now())
@@ -0,0 +1,136 @@
+"""
+Server-side prepared statements for repeated generated SQL.
+
+Pooled external connections are created with StatementCachingConnection
+(see dbpool), which keeps an LRU of statements it has PREPAREd, keyed by
+normalized SQL text. execute() runs a query through that cache, so a question
+asked again on the same connection skips parse and plan. Prepared statements
+are per session and not transactional, so they survive the rollback dbpool
+does between borrowers and go away with the connection.
+
+Set PREPARED_STATEMENTS_PER_CONNECTION=0 to turn this off, e.g. behind a
+transaction-pooling pgbouncer where sessions aren't kept per client.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from psycopg2 import errorcodes
+from psycopg2.extensions import connection as _connection
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PREPARED_STATEMENTS_PER_CONNECTION = int(os.getenv("PREPARED_STATEMENTS_PER_CONNECTION", "64"))
+
+# Only plain reads are prepared; anything else runs as before
+_PREPARABLE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+# Quoted strings and identifiers keep their whitespace, the rest collapses
+_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\s+|[^'\"\s]+|['\"]")
+
+_counts_lock = threading.Lock()
+_counts = {"hit": 0, "miss": 0}
+
+
+def normalize(sql: str) -> str:
+    """Cache key: trailing semicolons dropped and whitespace collapsed outside quotes"""
+    sql = sql.strip().rstrip(";").strip()
+    if "$" in sql or "--" in sql or "/*" in sql or "\\" in sql:
+        # Dollar quotes, comments and E'' escapes need a real lexer; key those on the exact text
+        return sql
+    return "".join(" " if token.isspace() else token for token in _TOKENS.findall(sql))
+
+
+class StatementCachingConnection(_connection):
+    """psycopg2 connection that remembers which statements it has prepared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # normalized SQL -> statement name, or None for SQL PREPARE refused
+        self.prepared: "OrderedDict[str, Optional[str]]" = OrderedDict()
+
+
+def _record(hit: bool):
+    with _counts_lock:
+        _counts["hit" if hit else "miss"] += 1
+        total = _counts["hit"] + _counts["miss"]
+        hit_rate = _counts["hit"] / total
+    metrics.incr("prepared.hit" if hit else "prepared.miss")
+    metrics.set_gauge("prepared.hit_rate", round(hit_rate, 4))
+
+
+def _remember(conn: StatementCachingConnection, key: str, name: Optional[str]):
+    conn.prepared[key] = name
+    while len(conn.prepared) > PREPARED_STATEMENTS_PER_CONNECTION:
+        _, evicted = conn.prepared.popitem(last=False)
+        if evicted is not None:
+            with conn.cursor() as cur:
+                cur.execute(f"DEALLOCATE {evicted}")
+            metrics.incr("prepared.evicted")
+
+
+def _prepare(cur, key: str) -> Optional[str]:
+    """PREPARE key on cur's connection; None if Postgres won't prepare it"""
+    conn = cur.connection
+    name = "gen_" + hashlib.sha1(key.encode()).hexdigest()[:20]
+    try:
+        cur.execute(f"PREPARE {name} AS {key}")
+    except Exception as e:
+        # E.g. several statements in one string; the plain execute reports real errors
+        conn.rollback()
+        logger.debug(f"Not preparing statement: {e}")
+        metrics.incr("prepared.unpreparable")
+        name = None
+    _remember(conn, key, name)
+    return name
+
+
+def execute(cur, sql: str):
+    """cur.execute(sql), through the connection's prepared statements when it has them"""
+    conn = cur.connection
+    if (PREPARED_STATEMENTS_PER_CONNECTION <= 0 or not isinstance(conn, StatementCachingConnection)
+            or not _PREPARABLE.match(sql)):
+        cur.execute(sql)
+        return
+
+    key = normalize(sql)
+    if key in conn.prepared:
+        conn.prepared.move_to_end(key)
+        name = conn.prepared[key]
+        # Only a statement that is actually prepared skips parse and plan
+        _record(hit=name is not None)
+    else:
+        name = _prepare(cur, key)
+        _record(hit=False)
+    if name is None:
+        cur.execute(sql)
+        return
+
+    try:
+        cur.execute(f"EXECUTE {name}")
+    except Exception as e:
+        # A table changed shape under the cached plan ("cached plan must not change result type"):
+        # prepare it again, once. Any other error is the query's own
+        if getattr(e, "pgcode", None) != errorcodes.FEATURE_NOT_SUPPORTED:
+            raise
+        conn.rollback()
+        del conn.prepared[key]
+        with conn.cursor() as cleanup:
+            cleanup.execute(f"DEALLOCATE {name}")
+        metrics.incr("prepared.replanned")
+        name = _prepare(cur, key)
+        if name is None:
+            cur.execute(sql)
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+
+def stats() -> Dict[str, float]:
+    with _counts_lock:
+        hits, misses = _counts["hit"], _counts["miss"]
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0}
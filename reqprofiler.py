@@ -0,0 +1,202 @@
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# On-demand sampling profiler for single requests. A request is profiled when it
+# carries the admin token in the X-Profile-Token header or ?profile= query
+# parameter; unset PROFILE_TOKEN disables the feature entirely.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+# Sampling backs off (longer interval) while it costs more than this share of wall time
+PROFILE_MAX_OVERHEAD = float(os.getenv("PROFILE_MAX_OVERHEAD", "0.05"))
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "1"))
+MAX_SAMPLES = 20000
+MAX_STACK_DEPTH = 128
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+# Leaf functions of a thread that is parked, not working
+IDLE_LEAVES = {
+    ("threading", "wait"), ("selectors", "select"), ("queue", "get"),
+    ("concurrent.futures.thread", "_worker"), ("asyncio.base_events", "_run_once"),
+}
+
+_active = threading.BoundedSemaphore(PROFILE_MAX_CONCURRENT)
+
+
+def _is_project_frame(frame) -> bool:
+    filename = frame.f_code.co_filename
+    return (filename.startswith(PROJECT_ROOT) and "site-packages" not in filename
+            and not filename.endswith("reqprofiler.py"))
+
+
+def _module_name(frame) -> str:
+    return frame.f_globals.get("__name__", "?")
+
+
+class RequestProfiler:
+    """
+    Samples the Python stacks of every thread that is running project code
+    (event loop, threadpool, LLM executor) until stopped, then writes collapsed
+    stacks and a per-module summary to PROFILE_DIR.
+    """
+
+    def __init__(self, request_id: str, label: str, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.request_id = request_id
+        self.label = label
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.buckets: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.sampling_seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{request_id}", daemon=True)
+        self._started_at = 0.0
+        self._elapsed = 0.0
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            leaf = frame
+            frames = []
+            while frame is not None and len(frames) < MAX_STACK_DEPTH:
+                frames.append(frame)
+                frame = frame.f_back
+            if not any(_is_project_frame(f) for f in frames):
+                continue
+            if (_module_name(leaf), leaf.f_code.co_name) in IDLE_LEAVES:
+                self.idle_samples += 1
+                continue
+
+            # Attribute the sample to the innermost project module on the stack
+            bucket = next(_module_name(f) for f in frames if _is_project_frame(f))
+            self.buckets[bucket] += 1
+            path = ";".join(f"{_module_name(f)}:{f.f_code.co_name}" for f in reversed(frames))
+            self.stacks[f"{names.get(thread_id, thread_id)};{path}"] += 1
+            self.samples += 1
+
+    def _run(self):
+        deadline = self._started_at + PROFILE_MAX_SECONDS
+        while not self._stop.wait(self.interval):
+            started = time.perf_counter()
+            if started > deadline or self.samples >= MAX_SAMPLES:
+                break
+            self._sample()
+            self.sampling_seconds += time.perf_counter() - started
+            if self.sampling_seconds > (started - self._started_at) * PROFILE_MAX_OVERHEAD:
+                # Keep total sampling cost under the cap by sampling less often
+                self.interval = min(self.interval * 2, 1.0)
+            elif self.interval > PROFILE_INTERVAL_MS / 1000 and \
+                    self.sampling_seconds < (started - self._started_at) * PROFILE_MAX_OVERHEAD / 2:
+                self.interval = max(self.interval / 2, PROFILE_INTERVAL_MS / 1000)
+        self._elapsed = time.perf_counter() - self._started_at
+        try:
+            self._write()
+        except Exception as e:
+            logger.error(f"Failed to write profile {self.request_id}: {e}")
+
+    def summary(self) -> Dict:
+        total = sum(self.buckets.values()) or 1
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "request_id": self.request_id,
+            "request": self.label,
+            "duration_ms": round(self._elapsed * 1000, 1),
+            "samples": self.samples,
+            "idle_samples": self.idle_samples,
+            "final_interval_ms": round(self.interval * 1000, 2),
+            "overhead": round(self.sampling_seconds / self._elapsed, 4) if self._elapsed else 0,
+            "modules": {module: round(count / total, 4) for module, count in self.buckets.most_common()},
+            "top_functions": [{"frame": frame, "samples": count} for frame, count in leaves.most_common(25)],
+        }
+
+    def _write(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.request_id)
+        # flamegraph.pl / speedscope / inferno all read this format
+        with open(f"{base}.collapsed", "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(f"{base}.json", "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        metrics.incr("profiler.profiles")
+        logger.info(f"Wrote profile {base}.collapsed ({self.samples} samples)")
+
+
+def _requested_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile-token":
+            return value.decode("latin-1")
+    for part in scope.get("query_string", b"").decode("latin-1").split("&"):
+        key, _, value = part.partition("=")
+        if key == "profile":
+            return value
+    return None
+
+
+def profiling_requested(scope) -> bool:
+    if not PROFILE_TOKEN or scope.get("type") != "http":
+        return False
+    token = _requested_token(scope)
+    # As bytes: compare_digest raises TypeError on non-ASCII str, and tokens arrive as latin-1
+    return token is not None and hmac.compare_digest(token.encode("latin-1"), PROFILE_TOKEN.encode())
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware: profiles the whole request, streaming bodies included, and
+    returns the profile id in X-Profile-Id. Requests beyond PROFILE_MAX_CONCURRENT
+    simultaneous profiles run unprofiled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not profiling_requested(scope) or not _active.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        profiler = RequestProfiler(request_id, f"{scope.get('method')} {scope.get('path')}")
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers: List = list(message.get("headers", []))
+                headers.append((b"x-profile-id", request_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                profiler.stop()
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.stop()
+            _active.release()
@@ -0,0 +1,54 @@
+import os
+import uuid
+from typing import Any, Dict, List, Optional
+
+from cachebackend import get_cache, limit_namespace
+
+# Query results are kept server-side behind an opaque handle so clients only
+# receive the first page up front and fetch further pages on demand. They live
+# in the shared cache (see cachebackend), so any worker can serve the next page.
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = 500
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "1000"))
+RESULT_TTL_SECONDS = int(os.getenv("RESULT_TTL_SECONDS", "1800"))
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "500"))
+
+limit_namespace("result", RESULT_STORE_MAX_ENTRIES)
+
+
+def store_result(user_id, rows: List[Dict[str, Any]], columns: Optional[List[str]] = None) -> str:
+    """Keep a result for later paging; returns its handle"""
+    handle = uuid.uuid4().hex
+    if columns is None:
+        columns = list(rows[0].keys()) if rows else []
+    get_cache().set(f"result:{handle}", {
+        "user_id": str(user_id),
+        "columns": columns,
+        "rows": rows,
+    }, RESULT_TTL_SECONDS)
+    return handle
+
+
+def get_page(handle: str, user_id, page: int = 0, page_size: int = RESULT_PAGE_SIZE) -> Optional[Dict[str, Any]]:
+    """One page of a stored result, or None if it expired or belongs to someone else"""
+    page = max(0, page)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    entry = get_cache().get(f"result:{handle}")
+    if entry is None or entry["user_id"] != str(user_id):
+        return None
+    rows = entry["rows"]
+
+    start = page * page_size
+    return {
+        "handle": handle,
+        "page": page,
+        "page_size": page_size,
+        "total_rows": len(rows),
+        "page_count": (len(rows) + page_size - 1) // page_size,
+        "columns": entry["columns"],
+        "rows": rows[start:start + page_size],
+    }
+
+
+def discard(handle: str):
+    get_cache().delete(f"result:{handle}")
@@ -1,12 +1,24 @@
 
 from typing import Any, Dict
-from fastapi import APIRouter, Depends, HTTPException, logger
-import psycopg2
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, logger
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+import csv
+import io
+import json
+import os
 from sqlalchemy.orm import Session
 from models import ExternalDBCredential, User
 from schemas import ExternalDBCredentialCreate, ExternalDBCredential as ExternalDBCredentialSchema
 from database import get_db
 from auth import get_current_user
+import crypto
+import dbpool
+import healthmonitor
+import schemacache
+from getschemas import usable_config
+from warmup import schedule_credential_validation, schedule_credential_warmup, probe_servers
+from fewshot import forget_database
 from typing import Union, Optional, List
 from datetime import datetime
 from pydantic import BaseModel
@@ -18,17 +30,48 @@ class DatabaseWithStatus(BaseModel):
     db_user: str
     db_host: str
     db_port: int
-    connection_status: str
+    connection_status: str  # connected, failed, or unknown until first checked
     table_count: int
     error: Optional[str]
+    latency_ms: Optional[float] = None
+    checked_at: Optional[datetime] = None  # when the status was last checked
+    next_check_at: Optional[datetime] = None
     created_at: datetime
 
 class DatabasesWithStatusResponse(BaseModel):
     user_id: str
     total_databases: int
     databases: List[DatabaseWithStatus]
+    status_as_of: Optional[datetime] = None  # oldest checked_at among the databases
+    refreshed: bool = False
 
 
+# Bulk imports: how many credentials one request may carry, and how long
+# connectivity checks may take in total before unfinished ones count as timed out
+BULK_IMPORT_MAX_ITEMS = int(os.getenv("BULK_IMPORT_MAX_ITEMS", "200"))
+BULK_VALIDATION_DEADLINE_SECONDS = float(os.getenv("BULK_VALIDATION_DEADLINE_SECONDS", "15"))
+MAX_BULK_VALIDATION_DEADLINE_SECONDS = 60
+
+class BulkImportRequest(BaseModel):
+    credentials: List[Dict[str, Any]]  # same fields as POST /db-connections
+    all_or_nothing: bool = False  # insert nothing unless every item validates
+    deadline_seconds: Optional[float] = None  # total time for connectivity checks
+
+class BulkImportItem(BaseModel):
+    index: int
+    name: Optional[str] = None
+    host: Optional[str] = None
+    dbname: Optional[str] = None
+    status: str  # created, invalid, duplicate, failed, timeout or skipped
+    id: Optional[str] = None
+    error: Optional[str] = None
+    server_version: Optional[str] = None
+
+class BulkImportResponse(BaseModel):
+    created: int
+    rejected: int
+    items: List[BulkImportItem]
+
 
 router = APIRouter(prefix="/db-connections", tags=["Database Connections"])
 
@@ -47,14 +90,163 @@ def create_db_connection(
         port=db_data.port,
         dbname=db_data.dbname,
         db_user=db_data.db_user,
-        db_password=db_data.db_password
+        db_password=crypto.seal(db_data.db_password)
     )
     
     db.add(db_conn)
     db.commit()
     db.refresh(db_conn)
+
+    # Check the credential works and warm its pool/schema without delaying the response
+    schedule_credential_validation(db_conn.id)
     return db_conn
 
+def _credential_identity(host: str, port: int, dbname: str, db_user: str):
+    return (host.strip().lower(), int(port), dbname, db_user)
+
+def _insert_validated(user_id, items: List[BulkImportItem], validated: Dict[int, ExternalDBCredentialCreate],
+                      db: Session):
+    """Add every validated credential in one transaction and mark those items created"""
+    rows = []
+    for item in items:
+        if item.status != "connected":
+            continue
+        data = validated[item.index]
+        rows.append((item, ExternalDBCredential(
+            user_id=user_id,
+            name=data.name,
+            db_owner_username=data.db_owner_username,
+            host=data.host,
+            port=data.port,
+            dbname=data.dbname,
+            db_user=data.db_user,
+            db_password=crypto.seal(data.db_password)
+        )))
+    db.add_all([row for _, row in rows])
+    db.flush()
+    ids = [str(row.id) for _, row in rows]
+    db.commit()
+    for (item, _), credential_id in zip(rows, ids):
+        item.status = "created"
+        item.id = credential_id
+
+async def _bulk_import(raw_items: List[Any], all_or_nothing: bool, deadline_seconds: Optional[float],
+                       db: Session, current_user: User) -> BulkImportResponse:
+    if not raw_items:
+        raise HTTPException(status_code=400, detail="No credentials to import")
+    if len(raw_items) > BULK_IMPORT_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_IMPORT_MAX_ITEMS} credentials per import")
+    deadline = min(deadline_seconds or BULK_VALIDATION_DEADLINE_SECONDS, MAX_BULK_VALIDATION_DEADLINE_SECONDS)
+
+    existing = {
+        _credential_identity(cred.host, cred.port, cred.dbname, cred.db_user)
+        for cred in db.query(ExternalDBCredential).filter(ExternalDBCredential.user_id == current_user.id).all()
+    }
+
+    items: List[BulkImportItem] = []
+    validated: Dict[int, ExternalDBCredentialCreate] = {}
+    for index, raw in enumerate(raw_items):
+        if not isinstance(raw, dict):
+            items.append(BulkImportItem(index=index, status="invalid", error="Each credential must be an object"))
+            continue
+        item = BulkImportItem(index=index, name=raw.get("name"), host=raw.get("host"), dbname=raw.get("dbname"),
+                              status="pending")
+        items.append(item)
+        try:
+            data = ExternalDBCredentialCreate.model_validate(raw)
+        except ValidationError as e:
+            item.status = "invalid"
+            item.error = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            continue
+        identity = _credential_identity(data.host, data.port, data.dbname, data.db_user)
+        if identity in existing:
+            item.status = "duplicate"
+            item.error = "A connection to this database with this user already exists"
+            continue
+        existing.add(identity)
+        validated[index] = data
+
+    # Connectivity checks all run at once; the whole batch waits at most `deadline`
+    to_probe = sorted(validated)
+    results = await probe_servers([
+        {
+            'host': validated[i].host, 'port': validated[i].port, 'dbname': validated[i].dbname,
+            'user': validated[i].db_user, 'password': validated[i].db_password
+        }
+        for i in to_probe
+    ], deadline)
+    server_info = {}
+    for index, result in zip(to_probe, results):
+        item = items[index]
+        item.status = result["status"]
+        item.error = result.get("error")
+        item.server_version = result.get("server_version")
+        server_info[index] = result
+
+    if all_or_nothing and any(item.status != "connected" for item in items):
+        for item in items:
+            if item.status == "connected":
+                item.status = "skipped"
+                item.error = "Not imported because other items failed (all_or_nothing)"
+    else:
+        try:
+            await run_in_threadpool(_insert_validated, current_user.id, items, validated, db)
+        except Exception as e:
+            db.rollback()
+            logger.logger.error(f"Bulk import insert failed: {e}")
+            raise HTTPException(status_code=500, detail="Could not save the imported connections")
+
+        # Validation already ran: keep its result and just warm pools and schemas
+        for item in items:
+            if item.status == "created":
+                schemacache.set_server_info(item.id, server_info[item.index])
+                schedule_credential_warmup(item.id)
+
+    created_count = sum(1 for item in items if item.status == "created")
+    return BulkImportResponse(created=created_count, rejected=len(items) - created_count, items=items)
+
+@router.post("/bulk", response_model=BulkImportResponse)
+async def bulk_create_db_connections(
+    request: BulkImportRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Import many connections at once. Every credential is checked for connectivity
+    concurrently within the deadline; the ones that connect are saved in a single
+    transaction, and each item reports its own status.
+    """
+    return await _bulk_import(request.credentials, request.all_or_nothing, request.deadline_seconds, db, current_user)
+
+@router.post("/bulk/file", response_model=BulkImportResponse)
+async def bulk_create_db_connections_from_file(
+    file: UploadFile = File(...),
+    all_or_nothing: bool = Form(False),
+    deadline_seconds: Optional[float] = Form(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    /bulk with the credentials in an uploaded file: a JSON list, or CSV with a
+    header row of name,host,port,dbname,db_user,db_password[,db_owner_username]
+    """
+    content = (await file.read()).decode("utf-8-sig")
+    if (file.filename or "").lower().endswith(".json") or content.lstrip().startswith(("[", "{")):
+        try:
+            parsed = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e.msg}")
+        raw_items = parsed.get("credentials", []) if isinstance(parsed, dict) else parsed
+        if not isinstance(raw_items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON list of credentials")
+    else:
+        raw_items = [
+            # Empty CSV cells are missing values, not empty strings
+            {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+            for row in csv.DictReader(io.StringIO(content))
+        ]
+    return await _bulk_import(raw_items, all_or_nothing, deadline_seconds, db, current_user)
+
 # @router.get("/", response_model=list[ExternalDBCredentialSchema])
 # def list_user_connections(
 #     db: Session = Depends(get_db),
@@ -68,12 +260,14 @@ def create_db_connection(
 @router.get("/")
 async def list_db_connections(
     include_status: bool = False,
+    refresh: bool = False,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ) -> Union[List[ExternalDBCredentialSchema], DatabasesWithStatusResponse]:
     """
     Get user's database connections. 
     Use ?include_status=true to get enhanced version with connection status and table counts.
+    Statuses come from the background health monitor; add &refresh=true to check them now.
     """
     credentials = db.query(ExternalDBCredential).filter(
         ExternalDBCredential.user_id == current_user.id
@@ -90,10 +284,12 @@ async def list_db_connections(
             "databases": []
         }
 
+    if refresh:
+        await healthmonitor.refresh(credentials)
+    statuses = await run_in_threadpool(healthmonitor.cached_status, db, credentials)
+
     databases = []
     for cred in credentials:
-        # Test connection status
-        connection_status = await test_database_connection(cred)
         databases.append({
             "id": str(cred.id),
             "name": cred.name or f"Database_{cred.id}",
@@ -101,60 +297,34 @@ async def list_db_connections(
             "db_user": cred.db_user,
             "db_host": cred.host,
             "db_port": cred.port,
-            "connection_status": connection_status["status"],
-            "table_count": connection_status.get("table_count", 0),
-            "error": connection_status.get("error"),
+            **statuses[str(cred.id)],
             "created_at": cred.created_at
         })
     
+    checked = [database["checked_at"] for database in databases if database["checked_at"] is not None]
     return DatabasesWithStatusResponse(
         user_id=str(current_user.id),
         total_databases=len(databases),
-        databases=databases
+        databases=databases,
+        status_as_of=min(checked) if len(checked) == len(databases) else None,
+        refreshed=refresh
     )
 
-async def test_database_connection(credential: ExternalDBCredential) -> Dict[str, Any]:
-    """Test connection to an external database"""
-    try:
-        conn = psycopg2.connect(
-            host=credential.host,
-            port=credential.port,
-            dbname=credential.dbname,
-            user=credential.db_user,
-            password=credential.db_password,
-            connect_timeout=10
-        )
-        
-        with conn.cursor() as cur:
-            # Test basic connectivity
-            cur.execute("SELECT current_database(), current_user;")
-            db_info = cur.fetchone()
-            
-            # Get table count
-            cur.execute("""
-                SELECT COUNT(*)
-                FROM information_schema.tables
-                WHERE table_schema = 'public' AND table_type = 'BASE TABLE'
-            """)
-            table_count = cur.fetchone()[0]
-        
-        conn.close()
-        
-        return {
-            "status": "connected",
-            "current_database": db_info[0],
-            "current_user": db_info[1],
-            "table_count": table_count
-        }
-        
-    except Exception as e:
-        logger.error(f"Connection test failed for {credential.host}:{credential.port}/{credential.dbname}: {str(e)}")
-        return {
-            "status": "failed",
-            "error": str(e),
-            "table_count": 0
-        }
 
+def _pool_still_used(db: Session, config: dict) -> bool:
+    """Whether another stored credential (any user's) shares this DSN's pool"""
+    key = dbpool.pool_key(config)
+    others = db.query(ExternalDBCredential).filter(
+        ExternalDBCredential.host == config['host'],
+        ExternalDBCredential.port == config['port'],
+        ExternalDBCredential.dbname == config['dbname'],
+        ExternalDBCredential.db_user == config['user']
+    ).all()
+    for other in others:
+        other_config = usable_config(other)
+        if other_config is not None and dbpool.pool_key(other_config) == key:
+            return True
+    return False
 
 @router.delete("/{connection_id}")
 def delete_db_connection(
@@ -170,6 +340,14 @@ def delete_db_connection(
     if not db_conn:
         raise HTTPException(status_code=404, detail="Connection not found")
     
+    # A password that no longer decrypts has no pool to close; deleting must still work
+    config = usable_config(db_conn)
+    stored_password = db_conn.db_password
     db.delete(db_conn)
     db.commit()
+    schemacache.invalidate(connection_id)
+    if config is not None and not _pool_still_used(db, config):
+        dbpool.close_pool(config)
+    crypto.forget(stored_password)
+    forget_database(connection_id)
     return {"message": "Connection deleted successfully"}
\ No newline at end of file
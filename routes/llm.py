@@ -1,4 +1,5 @@
 from fastapi import APIRouter,Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from models import ExternalDBCredential, User
 from schemas import ExternalDBCredentialCreate, ExternalDBCredential as ExternalDBCredentialSchema
@@ -8,12 +9,16 @@ from pydantic import BaseModel
 from typing import Optional,List, Dict, Any
 import logging
 import psycopg2
-from llmcall import generate_sql_response, execute_sql_query
+import healthmonitor
+from getschemas import credential_config
+from llmcall import generate_sql_response, execute_sql_query, discard_response_key
 
 class ChatRequest(BaseModel):
     question: str
     database_id: Optional[str] = None  # Specific database ID to use
     execute_query: bool = False  # Whether to execute the generated SQL
+    schema_format: Optional[str] = None  # "verbose", "ddl" or "json"; server default if omitted
+    llm_backend: Optional[str] = None  # "openrouter", "openai" or "ollama"; server default if omitted
 
 
 class ChatResponse(BaseModel):
@@ -23,6 +28,9 @@ class ChatResponse(BaseModel):
     execution_results: Optional[Dict[str, Any]] = None
     available_databases: List[Dict[str, Any]]
     error: Optional[str] = None
+    error_type: Optional[str] = None
+    prompt_version: Optional[str] = None
+    queue: Optional[Dict[str, Any]] = None  # position and wait_ms in the LLM scheduler
 
 class DatabaseTestRequest(BaseModel):
     database_id: str
@@ -35,10 +43,14 @@ router=APIRouter(prefix="/llm",tags=["LLM Interaction"])
 
 @router.get("/databases-with-status")
 async def get_databases_with_connection_status(
+    refresh: bool = False,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Get user's databases with connection status (enhanced version of /db-connections/)"""
+    """
+    Get user's databases with connection status (enhanced version of /db-connections/).
+    Statuses come from the background health monitor; ?refresh=true checks them now.
+    """
     credentials = db.query(ExternalDBCredential).filter(
         ExternalDBCredential.user_id == current_user.id
     ).all()
@@ -49,11 +61,12 @@ async def get_databases_with_connection_status(
             "databases": []
         }
     
+    if refresh:
+        await healthmonitor.refresh(credentials)
+    statuses = await run_in_threadpool(healthmonitor.cached_status, db, credentials)
+
     databases = []
     for cred in credentials:
-        # Test connection status
-        connection_status = await test_database_connection(cred)
-        
         databases.append({
             "id": str(cred.id),
             "name": cred.name or f"Database_{cred.id}",
@@ -61,16 +74,17 @@ async def get_databases_with_connection_status(
             "db_user": cred.db_user,
             "db_host": cred.host,
             "db_port": cred.port,
-            "connection_status": connection_status["status"],
-            "table_count": connection_status.get("table_count", 0),
-            "error": connection_status.get("error"),
+            **statuses[str(cred.id)],
             "created_at": cred.created_at
         })
     
+    checked = [database["checked_at"] for database in databases if database["checked_at"] is not None]
     return {
         "user_id": str(current_user.id),
         "total_databases": len(databases),
-        "databases": databases
+        "databases": databases,
+        "status_as_of": min(checked) if len(checked) == len(databases) else None,
+        "refreshed": refresh
     }
 
 
@@ -78,12 +92,8 @@ async def test_database_connection(credential: ExternalDBCredential) -> Dict[str
     """Test connection to an external database"""
     try:
         conn = psycopg2.connect(
-            host=credential.host,
-            port=credential.port,
-            dbname=credential.dbname,
-            user=credential.db_user,
-            password=credential.db_password,
-            connect_timeout=10
+            connect_timeout=10,
+            **credential_config(credential)
         )
         
         with conn.cursor() as cur:
@@ -166,13 +176,7 @@ async def get_database_schema(
         )
     
     try:
-        conn = psycopg2.connect(
-            host=credential.host,
-            port=credential.port,
-            dbname=credential.dbname,
-            user=credential.db_user,
-            password=credential.db_password
-        )
+        conn = psycopg2.connect(**credential_config(credential))
         
         schema_info = {}
         
@@ -295,10 +299,14 @@ async def chat_with_database(
     
     try:
         # Generate SQL using your existing LLM system
-        sql_result = generate_sql_response(
+        sql_result = await run_in_threadpool(
+            generate_sql_response,
             user_input=request.question,
             user_db_credentials=credentials,
-            preferred_db_name=target_database["name"]
+            preferred_db_name=target_database["name"],
+            schema_format=request.schema_format,
+            llm_backend=request.llm_backend,
+            user_id=current_user.id
         )
         
         if sql_result.get("error"):
@@ -307,7 +315,9 @@ async def chat_with_database(
                 generated_sql="",
                 target_database=target_database,
                 available_databases=available_databases,
-                error=sql_result["error"]
+                error=sql_result["error"],
+                error_type=sql_result.get("error_type"),
+                queue=sql_result.get("queue")
             )
         
         generated_sql = sql_result["sql"]
@@ -315,7 +325,9 @@ async def chat_with_database(
             user_question=request.question,
             generated_sql=generated_sql,
             target_database=target_database,
-            available_databases=available_databases
+            available_databases=available_databases,
+            prompt_version=sql_result.get("prompt_version"),
+            queue=sql_result.get("queue")
         )
         
         # Execute query if requested
@@ -326,6 +338,7 @@ async def chat_with_database(
                 
                 if execution_result.get("error"):
                     response.error = f"Execution error: {execution_result['error']}"
+                    await run_in_threadpool(discard_response_key, sql_result["response_key"])
                     
             except Exception as e:
                 response.error = f"Execution failed: {str(e)}"
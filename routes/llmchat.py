@@ -1,5 +1,8 @@
 # Updated routes/llm.py
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from models import ExternalDBCredential, User
 from database import get_db
@@ -8,27 +11,77 @@ from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from llmcall import (  # Import your LLM functions
     generate_sql_response,
+    generate_federated_plan,
     execute_sql_query,
+    discard_response_key,
     get_user_database_schemas,
     format_schema_for_llm
 )
+from getschemas import get_credential_stats, credential_config
+from federation import execute_plan
+from sqlguard import validate_read_only
+import export
+import asyncio
+import json
+from fewshot import record_example
+import resultstore
+import tracing
+from conversations import start_conversation, load_context, record_turn, list_conversations, get_conversation
 import logging
 
 router = APIRouter(prefix="/llm-chat", tags=["Natural Language Database Chat"])
 
 logger = logging.getLogger(__name__)
 
+# llmresilience error kinds that mean "try again later" rather than "rephrase"
+LLM_UNAVAILABLE_ERRORS = {
+    "rate_limited", "provider_error", "timeout", "unavailable", "circuit_open", "queue_full", "queue_timeout"
+}
+
 # Request/Response Models (unchanged)
 class SimpleQuestionRequest(BaseModel):
     question: str
+    schema_format: Optional[str] = None  # "verbose", "ddl" or "json"; server default if omitted
+    llm_backend: Optional[str] = None  # "openrouter", "openai" or "ollama"; server default if omitted
+    conversation_id: Optional[str] = None  # continue a conversation
+    new_conversation: bool = False  # start one when conversation_id is omitted; its id comes back in the answer
+    federated: bool = False  # answer from several databases at once (see federation)
+
+class FeedbackRequest(BaseModel):
+    question: str
+    sql: str
+    database: str  # database id or connection name the SQL ran against
+
+class ExportRequest(BaseModel):
+    sql: str
+    database: str  # database id or connection name, as in ChatResponse.database
+    format: str = "csv"  # "csv" or "parquet"
 
 class ChatResponse(BaseModel):
     question: str
     answer: str
     sql_used: Optional[str] = None
-    data: Optional[List[Dict[str, Any]]] = None
+    database: Optional[str] = None
+    data: Optional[List[Dict[str, Any]]] = None  # first page only; see result_handle
     suggestion: Optional[str] = None
     error: Optional[str] = None
+    error_type: Optional[str] = None
+    prompt_version: Optional[str] = None
+    queue: Optional[Dict[str, Any]] = None  # position and wait_ms in the LLM scheduler; cached when the SQL cache answered
+    result_handle: Optional[str] = None  # fetch more rows from /llm-chat/results/{handle}
+    total_rows: Optional[int] = None
+    page_size: Optional[int] = None
+    conversation_id: Optional[str] = None
+    plan: Optional[Dict[str, Any]] = None  # sub-queries and join steps of a federated answer
+
+class ResultPage(BaseModel):
+    handle: str
+    page: int
+    page_size: int
+    total_rows: int
+    page_count: int
+    columns: List[str]
+    rows: List[Dict[str, Any]]
 
 class DatabaseSummaryResponse(BaseModel):
     databases: List[Dict[str, Any]]
@@ -50,7 +103,7 @@ async def get_database_summary(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Get summary using llmcall.py functions"""
+    """Status, table counts, approximate rows and size per database, from the catalog only"""
     credentials = db.query(ExternalDBCredential).filter(
         ExternalDBCredential.user_id == current_user.id
     ).all()
@@ -61,22 +114,25 @@ async def get_database_summary(
             detail="No database connections found."
         )
     
-    # Get database info using llmcall
-    schemas = get_user_database_schemas(credentials)
-    total_tables = sum(len(tables) for tables in schemas.values())
-     
+    # One catalog query per database, all databases in parallel
+    all_stats = await asyncio.gather(*(
+        run_in_threadpool(get_credential_stats, cred) for cred in credentials
+    ))
+
     databases_response = []
-    for cred in credentials:
-        db_info = {
+    for cred, stats in zip(credentials, all_stats):
+        databases_response.append({
             "name": cred.name or f"Database_{cred.id}",
             "host": cred.host,
             "database": cred.dbname,
-            "status": "connected" if cred.dbname in schemas else "failed",
-            "table_count": len(schemas.get(cred.dbname, []))
-        }
-        databases_response.append(db_info)
-    
-    context = get_comprehensive_database_context(credentials)
+            "status": "failed" if "error" in stats else "connected",
+            "table_count": stats.get("table_count", 0),
+            "approx_rows": stats.get("approx_rows"),
+            "total_size_bytes": stats.get("total_size_bytes"),
+            "error": stats.get("error")
+        })
+    total_tables = sum(item["table_count"] for item in databases_response)
+
     sample_questions = [
         "How many records do we have?",
         "Show me sample customer data",
@@ -89,37 +145,124 @@ async def get_database_summary(
         sample_questions=sample_questions
     )
 
-@router.post("/ask", response_model=ChatResponse)
-async def ask_question(
-    request: SimpleQuestionRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Main endpoint using llmcall.py functions"""
-    credentials = db.query(ExternalDBCredential).filter(
-        ExternalDBCredential.user_id == current_user.id
-    ).all()
-    
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="No database connections found."
+async def _federated_events(request: SimpleQuestionRequest, credentials: List[ExternalDBCredential], user_id):
+    """_pipeline_events for a question answered from several databases through a federation plan"""
+    result = await run_in_threadpool(
+        generate_federated_plan,
+        user_input=request.question,
+        user_db_credentials=credentials,
+        schema_format=request.schema_format,
+        llm_backend=request.llm_backend,
+        user_id=user_id
+    )
+    if result.get("error"):
+        unavailable = result.get("error_type") in LLM_UNAVAILABLE_ERRORS
+        yield "answer", ChatResponse(
+            question=request.question,
+            answer="The language model is unavailable right now." if unavailable
+            else "I couldn't plan a query across your databases.",
+            error=result["error"],
+            error_type=result.get("error_type"),
+            suggestion="Please try again in a few seconds." if unavailable
+            else "Try naming the databases and how their records relate.",
+            prompt_version=result.get("prompt_version"),
+            queue=result.get("queue")
         )
-    
+        return
+
+    yield "sql", {
+        "sql": result["sql"],
+        "database": result["database"],
+        "tables": result.get("tables", []),
+        "prompt_version": result.get("prompt_version"),
+        "queue": result.get("queue"),
+        "plan": result["plan"]
+    }
+
+    credentials_by_name = {(cred.name or f"DB_{cred.id}"): cred for cred in credentials}
+    execution_result = await run_in_threadpool(
+        execute_plan, result["plan"], credentials_by_name, resultstore.RESULT_MAX_ROWS
+    )
+    if execution_result.get("error"):
+        # Don't keep serving a plan that fails from the shared cache
+        await run_in_threadpool(discard_response_key, result["response_key"])
+        yield "answer", ChatResponse(
+            question=request.question,
+            answer="Couldn't execute the query plan.",
+            sql_used=result["sql"],
+            error=execution_result["error"],
+            error_type="federation",
+            prompt_version=result.get("prompt_version"),
+            queue=result.get("queue"),
+            plan=result["plan"]
+        )
+        return
+    logger.info(f"Federated answer: {json.dumps(execution_result['stats'], default=str)}")
+
+    data = execution_result.get("data", [])
+    handle = None
+    if data:
+        handle = await run_in_threadpool(resultstore.store_result, user_id, data, execution_result.get("columns"))
+    yield "answer", ChatResponse(
+        question=request.question,
+        answer=format_answer(question=request.question, data=data, row_count=len(data)),
+        sql_used=result["sql"],
+        database=result["database"],
+        data=data[:resultstore.RESULT_PAGE_SIZE],
+        suggestion=get_suggestion_based_on_results(data),
+        prompt_version=result.get("prompt_version"),
+        queue=result.get("queue"),
+        result_handle=handle,
+        total_rows=len(data),
+        page_size=resultstore.RESULT_PAGE_SIZE,
+        plan=result["plan"]
+    )
+
+async def _pipeline_events(request: SimpleQuestionRequest, credentials: List[ExternalDBCredential], user_id,
+                           context: Optional[Dict[str, Any]] = None):
+    """
+    The ask pipeline as a stream of (event, payload) pairs: "sql" as soon as
+    the SQL is generated, then always a final "answer" with the ChatResponse.
+    """
     try:
-        # Step 1: Generate SQL using llmcall
-        result = generate_sql_response(
+        if request.federated:
+            async for event, payload in _federated_events(request, credentials, user_id):
+                yield event, payload
+            return
+
+        # Step 1: Generate SQL using llmcall (off the event loop: it may queue for an LLM slot)
+        result = await run_in_threadpool(
+            generate_sql_response,
             user_input=request.question,
-            user_db_credentials=credentials
+            user_db_credentials=credentials,
+            schema_format=request.schema_format,
+            llm_backend=request.llm_backend,
+            user_id=user_id,
+            context=context
         )
         
         if result.get("error"):
-            return ChatResponse(
+            if result.get("error_type") in LLM_UNAVAILABLE_ERRORS:
+                yield "answer", ChatResponse(
+                    question=request.question,
+                    answer="The language model is unavailable right now.",
+                    error=result["error"],
+                    error_type=result["error_type"],
+                    suggestion="Please try again in a few seconds.",
+                    prompt_version=result.get("prompt_version"),
+                    queue=result.get("queue")
+                )
+                return
+            yield "answer", ChatResponse(
                 question=request.question,
                 answer="I couldn't understand your question.",
                 error=result["error"],
-                suggestion="Try asking differently."
+                error_type=result.get("error_type"),
+                suggestion="Try asking differently.",
+                queue=result.get("queue")
             )
+            return
+        prompt_version = result.get("prompt_version")
         
         # Step 2: Execute the query
         target_db = next(
@@ -127,44 +270,281 @@ async def ask_question(
              if cred.name == result["database"] or cred.dbname == result["database"]),
             credentials[0]  # fallback
         )
+        database_name = target_db.name or f"DB_{target_db.id}"
+
+        yield "sql", {
+            "sql": result["sql"],
+            "database": database_name,
+            "tables": result.get("tables", []),
+            "prompt_version": prompt_version,
+            "queue": result.get("queue")
+        }
         
-        execution_result = execute_sql_query(
+        execution_result = await run_in_threadpool(
+            execute_sql_query,
             sql_query=result["sql"],
-            db_credential=target_db
+            db_credential=target_db,
+            limit=resultstore.RESULT_MAX_ROWS
         )
         
         # Step 3: Format response
         if execution_result.get("error"):
-            return ChatResponse(
+            # Asking again should get fresh SQL, not the same broken statement from the shared cache
+            await run_in_threadpool(discard_response_key, result["response_key"])
+            yield "answer", ChatResponse(
                 question=request.question,
                 answer="Couldn't execute the query.",
                 sql_used=result["sql"],
-                error=execution_result["error"]
+                error=execution_result["error"],
+                prompt_version=prompt_version,
+                queue=result.get("queue")
             )
+            return
         
+        # Successful executions become few-shot examples for similar future questions.
+        # Off the loop: a cold index is loaded from the app DB and vectorized first
+        await run_in_threadpool(record_example, target_db.id, request.question, result["sql"], source="executed")
+
         data = execution_result.get("data", [])
         answer = format_answer(
             question=request.question,
             data=data,
             row_count=len(data)
         )
+
+        # Only the first page goes out with the answer; the rest stays behind a handle
+        handle = None
+        if data:
+            handle = await run_in_threadpool(resultstore.store_result, user_id, data, execution_result.get("columns"))
         
-        return ChatResponse(
+        yield "answer", ChatResponse(
             question=request.question,
             answer=answer,
             sql_used=result["sql"],
-            data=data,
-            suggestion=get_suggestion_based_on_results(data)
+            database=database_name,
+            data=data[:resultstore.RESULT_PAGE_SIZE],
+            suggestion=get_suggestion_based_on_results(data),
+            prompt_version=prompt_version,
+            queue=result.get("queue"),
+            result_handle=handle,
+            total_rows=len(data),
+            page_size=resultstore.RESULT_PAGE_SIZE
         )
         
     except Exception as e:
         logger.error(f"Error in ask_question: {str(e)}", exc_info=True)
-        return ChatResponse(
+        yield "answer", ChatResponse(
             question=request.question,
             answer="An error occurred.",
             error=str(e)
         )
 
+async def _answer_events(request: SimpleQuestionRequest, credentials: List[ExternalDBCredential], user_id,
+                         conversation_id: Optional[str] = None):
+    """_pipeline_events with follow-up context loaded from, and each turn saved to, the conversation"""
+    context = None
+    if conversation_id and request.conversation_id:
+        context = await run_in_threadpool(load_context, conversation_id)
+
+    generated = None
+    async for event, payload in _pipeline_events(request, credentials, user_id, context):
+        if event == "sql":
+            generated = payload
+        elif event == "answer":
+            tracing.current_span().set_attributes(**{
+                "chat.conversation_id": conversation_id or "",
+                "chat.followup": bool(context),
+                "db.name": payload.database or "",
+                "db.rows": payload.total_rows or 0,
+                "error_type": payload.error_type or ("execution" if payload.error else "")
+            })
+        if event == "answer" and conversation_id:
+            payload.conversation_id = conversation_id
+            await run_in_threadpool(
+                record_turn,
+                conversation_id,
+                request.question,
+                sql=generated["sql"] if generated else None,
+                database=generated["database"] if generated else None,
+                tables=generated["tables"] if generated else None,
+                answer=payload.answer
+            )
+        yield event, payload
+
+async def _resolve_conversation(request: SimpleQuestionRequest, current_user: User) -> Optional[str]:
+    if not request.conversation_id and not request.new_conversation:
+        # One-off question: nothing to keep
+        return None
+    conversation_id = await run_in_threadpool(
+        start_conversation, current_user.id, request.conversation_id, request.question
+    )
+    if request.conversation_id and conversation_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
+    return conversation_id
+
+def _get_user_credentials(db: Session, current_user: User) -> List[ExternalDBCredential]:
+    credentials = db.query(ExternalDBCredential).filter(
+        ExternalDBCredential.user_id == current_user.id
+    ).all()
+    
+    if not credentials:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No database connections found."
+        )
+    return credentials
+
+@router.post("/ask", response_model=ChatResponse)
+async def ask_question(
+    request: SimpleQuestionRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Main endpoint using llmcall.py functions"""
+    credentials = _get_user_credentials(db, current_user)
+    conversation_id = await _resolve_conversation(request, current_user)
+
+    response = None
+    async for event, payload in _answer_events(request, credentials, current_user.id, conversation_id):
+        if event == "answer":
+            response = payload
+    return response
+
+@router.post("/ask/stream")
+async def ask_question_stream(
+    request: SimpleQuestionRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Same as /ask, streamed as newline-delimited JSON events so clients can show
+    progress: {"event": "status"}, then {"event": "sql"}, then {"event": "answer"}.
+    """
+    credentials = _get_user_credentials(db, current_user)
+    conversation_id = await _resolve_conversation(request, current_user)
+    user_id = current_user.id
+
+    async def event_stream():
+        yield json.dumps({"event": "status", "message": "Generating SQL"}) + "\n"
+        async for event, payload in _answer_events(request, credentials, user_id, conversation_id):
+            if isinstance(payload, BaseModel):
+                payload = payload.model_dump()
+            yield json.dumps(jsonable_encoder({"event": event, **payload})) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@router.get("/conversations")
+async def get_conversations(current_user: User = Depends(get_current_user)):
+    """The user's conversations, most recently active first"""
+    return await run_in_threadpool(list_conversations, current_user.id)
+
+@router.get("/conversations/{conversation_id}")
+async def get_conversation_turns(conversation_id: str, current_user: User = Depends(get_current_user)):
+    """One conversation with its summary and every turn"""
+    conversation = await run_in_threadpool(get_conversation, current_user.id, conversation_id)
+    if conversation is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
+    return conversation
+
+@router.get("/results/{handle}", response_model=ResultPage)
+async def get_result_page(
+    handle: str,
+    page: int = 0,
+    page_size: int = resultstore.RESULT_PAGE_SIZE,
+    current_user: User = Depends(get_current_user)
+):
+    """One page of a previous answer's rows"""
+    result = await run_in_threadpool(resultstore.get_page, handle, current_user.id, page, page_size)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Result not found or expired"
+        )
+    return result
+
+@router.post("/export")
+async def export_query(
+    request: ExportRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """All rows of a read-only query as a CSV or Parquet download, streamed with COPY"""
+    if request.format not in export.EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of {', '.join(export.EXPORT_FORMATS)}"
+        )
+    if request.format == "parquet" and not export.parquet_available():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Parquet export is not available on this server"
+        )
+    problem = validate_read_only(request.sql)
+    if problem:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Only read-only queries can be exported: {problem}"
+        )
+
+    credentials = _get_user_credentials(db, current_user)
+    target_db = next(
+        (cred for cred in credentials
+         if request.database in (str(cred.id), cred.name, f"DB_{cred.id}")),
+        None
+    )
+    if not target_db:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Database not found or not accessible"
+        )
+
+    try:
+        chunks = await run_in_threadpool(
+            export.open_export, request.sql, credential_config(target_db), request.format
+        )
+    except export.ExportBusy as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    except export.ExportError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Export failed: {e}")
+
+    filename = f"{target_db.name or target_db.dbname}-export.{request.format}"
+    return StreamingResponse(
+        chunks,
+        media_type=export.MEDIA_TYPES[request.format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.post("/feedback")
+async def confirm_answer(
+    request: FeedbackRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Mark a question/SQL pair as correct so it is preferred as a few-shot example"""
+    credentials = db.query(ExternalDBCredential).filter(
+        ExternalDBCredential.user_id == current_user.id
+    ).all()
+
+    target_db = next(
+        (cred for cred in credentials
+         if request.database in (str(cred.id), cred.name, f"DB_{cred.id}")),
+        None
+    )
+    if not target_db:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Database not found or not accessible"
+        )
+
+    await run_in_threadpool(record_example, target_db.id, request.question, request.sql, source="confirmed")
+    return {"message": "Thanks, this answer will be used to improve similar questions"}
+
 # Helper functions for response formatting
 def format_answer(question: str, data: list, row_count: int) -> str:
     """Format a user-friendly answer"""
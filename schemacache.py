@@ -0,0 +1,64 @@
+from typing import Any, Dict, Optional
+
+from cachebackend import delete_many, get_cache
+
+# Schema introspection is by far the most expensive part of a chat request, so the
+# result (and anything derived from the catalog, like column profiles) is kept per
+# external database credential for a short while, in the cache every worker shares
+# (see cachebackend).
+SCHEMA_TTL_SECONDS = 300
+PROFILE_TTL_SECONDS = 1800
+SERVER_INFO_TTL_SECONDS = 86400
+STATS_TTL_SECONDS = 60
+
+FIELDS = ('schema', 'profiles', 'server_info', 'stats')
+
+
+def credential_key(credential) -> str:
+    """Cache key for an ExternalDBCredential"""
+    return str(credential.id)
+
+
+def _get_fresh(key: str, field: str) -> Optional[Any]:
+    return get_cache().get(f"schema:{key}:{field}")
+
+
+def _store(key: str, field: str, value: Any, ttl: int) -> None:
+    get_cache().set(f"schema:{key}:{field}", value, ttl)
+
+
+def get_schema(key: str) -> Optional[Dict]:
+    return _get_fresh(key, 'schema')
+
+
+def set_schema(key: str, schema: Dict) -> None:
+    _store(key, 'schema', schema, SCHEMA_TTL_SECONDS)
+
+
+def get_profiles(key: str) -> Optional[Dict]:
+    return _get_fresh(key, 'profiles')
+
+
+def set_profiles(key: str, profiles: Dict) -> None:
+    _store(key, 'profiles', profiles, PROFILE_TTL_SECONDS)
+
+
+def get_server_info(key: str) -> Optional[Dict]:
+    return _get_fresh(key, 'server_info')
+
+
+def set_server_info(key: str, server_info: Dict) -> None:
+    _store(key, 'server_info', server_info, SERVER_INFO_TTL_SECONDS)
+
+
+def get_stats(key: str) -> Optional[Dict]:
+    return _get_fresh(key, 'stats')
+
+
+def set_stats(key: str, stats: Dict) -> None:
+    _store(key, 'stats', stats, STATS_TTL_SECONDS)
+
+
+def invalidate(key: str) -> None:
+    """Drop everything cached for a credential (e.g. after it was deleted), in every worker"""
+    delete_many([f"schema:{key}:{field}" for field in FIELDS])
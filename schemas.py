@@ -39,7 +39,6 @@ class ExternalDBCredential(BaseModel):
     port: int
     dbname: str
     db_user: str
-    db_password: str
     created_at: datetime
 
     class Config:
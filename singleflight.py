@@ -0,0 +1,58 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical work: while a call for a key is in flight,
+    later callers for the same key wait for it and share its result (or error)
+    instead of running it again. Nothing is cached once the call finishes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Tuple[Any, bool]:
+        """Run fn once per concurrent key; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._record(shared=True)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        self._record(shared=False)
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def _record(self, shared: bool):
+        prefix = f"singleflight.{self.name}"
+        metrics.incr(f"{prefix}.shared" if shared else f"{prefix}.executed")
+        executed = metrics.get_counter(f"{prefix}.executed")
+        shared_count = metrics.get_counter(f"{prefix}.shared")
+        metrics.set_gauge(f"{prefix}.coalescing_ratio", round(shared_count / (executed + shared_count), 4))
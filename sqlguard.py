@@ -0,0 +1,56 @@
+"""
+Checks for SQL that must only read: federated sub-queries and exports.
+
+This is a first line of defence that gives the user a readable reason. The
+lexing is deliberately conservative: anything it can't read the way Postgres
+would (backslashes in plain strings, stray semicolons) is rejected. The
+executors also run the statement in a session whose transactions all default
+to read only (dbpool.read_only_session), so a COMMIT that slipped through
+still couldn't open a writable transaction.
+"""
+import re
+from typing import Optional
+
+_LITERALS = re.compile(r"""
+    --[^\n]*                       # line comment
+  | /\*.*?\*/                      # block comment
+  | \b[eE]'(?:[^'\\]|\\.|'')*'      # escape string: backslash escapes
+  | '(?:[^']|'')*'                 # string literal
+  | "(?:[^"]|"")*"                 # quoted identifier
+  | \$(\w*)\$.*?\$\1\$             # dollar-quoted string
+""", re.S | re.X)
+_WRITE_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|merge|truncate|drop|alter|create|grant|revoke|copy|call|into)\b"
+    r"|\bfor\s+(update|share|no\s+key\s+update|key\s+share)\b"
+    # Transaction and session control; END only with its noise word, since CASE ... END is a read
+    r"|\b(commit|rollback|begin|abort|savepoint|set|reset|discard|prepare|execute|do)\b"
+    r"|\bstart\s+transaction\b|\bend\s+(transaction|work)\b",
+    re.I
+)
+_UNSAFE_FUNCTIONS = re.compile(
+    r"\b(pg_terminate_backend|pg_cancel_backend|pg_reload_conf|set_config|pg_read_file|pg_read_binary_file"
+    r"|pg_ls_dir|lo_import|lo_export|dblink\w*|pg_sleep\w*|nextval|setval)\s*\(",
+    re.I
+)
+
+
+def validate_read_only(sql: str) -> Optional[str]:
+    """Why sql isn't a single read-only SELECT, or None if it is"""
+    for match in _LITERALS.finditer(sql or ""):
+        literal = match.group(0)
+        if literal.startswith("'") and "\\" in literal:
+            # Escapes in a plain literal depend on standard_conforming_strings; write E'...' instead
+            return "backslashes are only allowed in E'...' strings"
+    stripped = _LITERALS.sub(" ? ", sql or "").strip().rstrip(";").strip()
+    if not stripped:
+        return "empty query"
+    if ";" in stripped:
+        return "more than one statement"
+    if "\\" in stripped:
+        return "backslashes are only allowed in E'...' strings"
+    if not re.match(r"(select|with)\b", stripped, re.I):
+        return "only SELECT queries are allowed"
+    match = _WRITE_KEYWORDS.search(stripped) or _UNSAFE_FUNCTIONS.search(stripped)
+    if match:
+        return f"'{match.group(0).strip().rstrip('(').strip()}' is not allowed in a read-only query"
+    return None
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The app is a flat set of modules at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database.py builds its engine on import; nothing here connects to it
+os.environ.setdefault("DATABASE_URL", "postgresql+psycopg2://test@localhost/test")
+os.environ.setdefault("SECRET_KEY", "test-secret")
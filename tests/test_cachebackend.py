@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+import cachebackend
+from cachebackend import SQLiteCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache" / "cache.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def test_round_trip_and_private_file(cache, tmp_path):
+    cache._set("schema:a", {"tables": ["t"]}, 60)
+    assert cache._get("schema:a") == {"tables": ["t"]}
+    assert (tmp_path / "cache" / "cache.sqlite3").stat().st_mode & 0o077 == 0
+    assert (tmp_path / "cache").stat().st_mode & 0o077 == 0
+
+
+def test_entries_with_a_bad_signature_are_misses(cache):
+    cache._set("schema:a", "value", 60)
+    cache._connection().execute("UPDATE cache_entries SET value = ? WHERE key = ?",
+                                (b"\0" * 32 + b"not a pickle", "schema:a"))
+    assert cache._get("schema:a") is None
+
+
+def test_entries_signed_with_another_key_are_misses(cache, monkeypatch):
+    cache._set("schema:a", "value", 60)
+    monkeypatch.setattr(cachebackend, "CACHE_SIGNING_KEY", "another key")
+    other = SQLiteCache(cache.path)
+    try:
+        assert other._get("schema:a") is None
+    finally:
+        other.close()
+
+
+def test_close_closes_every_threads_connection(cache):
+    threads = [threading.Thread(target=cache._set, args=(f"result:{i}", i, 60)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    connections = list(cache._connections)
+    assert len(connections) >= 4
+
+    cache.close()
+    for conn in connections:
+        with pytest.raises(Exception):
+            conn.execute("SELECT 1")
+    # Usable again afterwards, on a fresh connection
+    cache._set("result:x", "x", 60)
+    assert cache._get("result:x") == "x"
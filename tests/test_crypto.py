@@ -0,0 +1,119 @@
+import base64
+import os
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+import crypto  # noqa: E402
+
+
+def new_key() -> str:
+    return base64.b64encode(os.urandom(32)).decode()
+
+
+@pytest.fixture
+def master_keys(monkeypatch):
+    """Configure the master keys as the environment would; call with (active, *previous)"""
+
+    def configure(active: str, *previous: str):
+        monkeypatch.setattr(crypto, "CREDENTIAL_MASTER_KEY", active)
+        monkeypatch.setattr(crypto, "CREDENTIAL_PREVIOUS_MASTER_KEYS", ",".join(previous))
+        monkeypatch.setattr(crypto, "_keys", None)
+        monkeypatch.setattr(crypto, "_active_key_id", None)
+        crypto.clear_cache()
+
+    yield configure
+    crypto.clear_cache()
+
+
+def test_without_a_master_key_passwords_stay_plaintext(master_keys):
+    master_keys("")
+    assert not crypto.encryption_enabled()
+    assert crypto.seal("hunter2") == "hunter2"
+    assert crypto.reveal("hunter2") == "hunter2"
+
+
+def test_seal_then_reveal(master_keys):
+    master_keys(new_key())
+    token = crypto.seal("correct horse")
+    assert crypto.is_sealed(token)
+    assert "correct horse" not in token
+    assert crypto.seal("correct horse") != token  # fresh data key and nonces each time
+    assert crypto.reveal(token) == "correct horse"
+
+
+def test_reveal_caches_by_token(master_keys, monkeypatch):
+    master_keys(new_key())
+    token = crypto.seal("pw")
+    assert crypto.reveal(token) == "pw"
+    monkeypatch.setattr(crypto, "_decrypt", lambda stored: pytest.fail("decrypted again"))
+    assert crypto.reveal(token) == "pw"
+    crypto.forget(token)
+    with pytest.raises(pytest.fail.Exception):
+        crypto.reveal(token)
+
+
+def test_wrong_master_key_is_a_credential_key_error(master_keys):
+    master_keys(new_key())
+    token = crypto.seal("pw")
+    master_keys(new_key())
+    with pytest.raises(crypto.CredentialKeyError, match="not configured"):
+        crypto.reveal(token)
+
+
+def test_tampered_token_is_rejected(master_keys):
+    master_keys(new_key())
+    prefix, key_id, wrapped, sealed = crypto.seal("pw").split("$")
+    raw = bytearray(base64.b64decode(sealed))
+    raw[-1] ^= 1
+    with pytest.raises(crypto.CredentialKeyError, match="failed to decrypt"):
+        crypto.reveal("$".join([prefix, key_id, wrapped, base64.b64encode(bytes(raw)).decode()]))
+    with pytest.raises(crypto.CredentialKeyError, match="Malformed"):
+        crypto.reveal(crypto.TOKEN_PREFIX + "only-one-part")
+
+
+def test_rewrap_moves_tokens_to_the_active_key(master_keys):
+    old, new = new_key(), new_key()
+    master_keys(old)
+    token = crypto.seal("pw")
+    assert crypto.rewrap(token) == token
+
+    master_keys(new, old)
+    rewrapped = crypto.rewrap(token)
+    assert rewrapped != token
+    assert rewrapped.split("$")[3] == token.split("$")[3]  # only the data key is re-wrapped
+    assert crypto.reveal(token) == "pw"  # the retired key still decrypts while rotating
+
+    master_keys(new)
+    assert crypto.reveal(rewrapped) == "pw"
+    with pytest.raises(crypto.CredentialKeyError):
+        crypto.reveal(token)
+
+
+def test_rewrap_seals_plaintext(master_keys):
+    master_keys(new_key())
+    token = crypto.rewrap("pw")
+    assert crypto.is_sealed(token)
+    assert crypto.reveal(token) == "pw"
+
+
+def test_master_keys_must_be_32_bytes(master_keys):
+    master_keys(base64.b64encode(b"short").decode())
+    with pytest.raises(crypto.CredentialKeyError, match="32 bytes"):
+        crypto.encryption_enabled()
+
+
+@pytest.mark.parametrize("bad_key", ["not base64!", "abc", "é" * 44])
+def test_malformed_master_keys_are_credential_key_errors(master_keys, bad_key):
+    master_keys(bad_key)
+    with pytest.raises(crypto.CredentialKeyError, match="valid base64"):
+        crypto.encryption_enabled()
+
+
+def test_malformed_previous_key_fails_reveal_cleanly(master_keys):
+    master_keys(new_key())
+    token = crypto.seal("pw")
+    master_keys(new_key(), "typo$$")
+    with pytest.raises(crypto.CredentialKeyError):
+        crypto.reveal(token)
@@ -0,0 +1,108 @@
+import threading
+
+import psycopg2
+import pytest
+
+import dbpool
+
+
+class FakeConnection:
+    def __init__(self, *args, **kwargs):
+        self.closed = 0
+        self.log = []
+        self.info = FakeInfo()
+        self.autocommit = False
+
+    def close(self):
+        self.closed = 1
+
+    def cursor(self):
+        return FakeCursor(self.log)
+
+    def commit(self):
+        self.log.append("COMMIT")
+
+    def rollback(self):
+        self.log.append("ROLLBACK")
+
+
+class FakeInfo:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    def __init__(self, log):
+        self.log = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.log.append(sql)
+
+
+def test_read_only_session_is_committed_before_and_reset_after():
+    conn = FakeConnection()
+    with dbpool.read_only_session(conn):
+        conn.log.append("work")
+    assert conn.log == [
+        "SET SESSION default_transaction_read_only = on", "COMMIT",
+        "work",
+        "ROLLBACK", "RESET default_transaction_read_only", "COMMIT",
+    ]
+
+
+def test_read_only_session_resets_after_an_error():
+    conn = FakeConnection()
+    try:
+        with dbpool.read_only_session(conn):
+            raise RuntimeError("query failed")
+    except RuntimeError:
+        pass
+    assert conn.log[-2:] == ["RESET default_transaction_read_only", "COMMIT"]
+
+
+CONFIG = {"host": "db.example", "port": 5432, "dbname": "app", "user": "reader", "password": "pw"}
+
+
+@pytest.fixture
+def fake_connect(monkeypatch):
+    monkeypatch.setattr(psycopg2, "connect", FakeConnection)
+    monkeypatch.setattr(dbpool, "POOL_MAX_CONNECTIONS", 2)
+    monkeypatch.setattr(dbpool, "POOL_WAIT_SECONDS", 0.05)
+    yield
+    dbpool.close_all()
+
+
+def test_stats_count_borrowed_connections(fake_connect):
+    key = "db.example:5432/app"
+    with dbpool.connection(CONFIG):
+        assert dbpool.stats()[key] == {"in_use": 1, "free": 1, "max": 2}
+        with dbpool.connection(CONFIG):
+            assert dbpool.stats()[key]["in_use"] == 2
+            with pytest.raises(dbpool.PoolExhausted):
+                with dbpool.connection(CONFIG):
+                    pass
+    assert dbpool.stats()[key] == {"in_use": 0, "free": 2, "max": 2}
+
+
+def test_concurrent_first_borrowers_share_one_pool(fake_connect):
+    barrier = threading.Barrier(4)
+
+    def borrow():
+        barrier.wait()
+        try:
+            with dbpool.connection(CONFIG):
+                pass
+        except dbpool.PoolExhausted:
+            pass
+
+    threads = [threading.Thread(target=borrow) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(dbpool.stats()) == 1
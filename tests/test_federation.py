@@ -0,0 +1,144 @@
+import json
+
+import pytest
+
+import federation
+from federation import FederationError, _Budget, _hash_join, parse_plan
+
+DATABASES = ["shop_db", "crm_db"]
+
+
+def plan_text(**overrides):
+    plan = {
+        "subqueries": [
+            {"name": "o", "database": "shop_db", "sql": "SELECT customer_id, total FROM orders"},
+            {"name": "c", "database": "crm_db", "sql": "SELECT id, name FROM customers"},
+        ],
+        "joins": [{"right": "c", "on": [["o.customer_id", "c.id"]], "type": "inner"}],
+        "group_by": ["c.name"],
+        "aggregates": [{"func": "sum", "column": "o.total", "as": "total"}],
+        "select": ["c.name", "total"],
+        "order_by": [{"column": "total", "desc": True}],
+        "limit": 10,
+    }
+    plan.update(overrides)
+    return json.dumps(plan)
+
+
+def test_parses_a_plan_wrapped_in_prose():
+    plan = parse_plan("Here is the plan:\n```json\n" + plan_text() + "\n```", DATABASES)
+    assert [s["name"] for s in plan["subqueries"]] == ["o", "c"]
+    assert plan["limit"] == 10
+
+
+def test_order_by_a_select_alias():
+    plan = parse_plan(plan_text(select=[{"column": "total", "as": "revenue"}],
+                                order_by=[{"column": "revenue"}]), DATABASES)
+    assert plan["order_by"] == [{"column": "revenue"}]
+
+
+def test_ungrouped_plan_refers_to_qualified_columns():
+    parse_plan(plan_text(group_by=[], aggregates=[], select=["o.total", "c.name"],
+                         order_by=[{"column": "o.total"}]), DATABASES)
+    parse_plan(plan_text(group_by=[], aggregates=[], select=[], order_by=[{"column": "c.name"}]), DATABASES)
+
+
+@pytest.mark.parametrize("text, message", [
+    ("no plan here", "did not return a query plan"),
+    ("{not json}", "not valid JSON"),
+    ("[1, 2]", "did not return a query plan"),
+    (plan_text(subqueries=[]), "no sub-queries"),
+    (plan_text(subqueries="SELECT 1"), "'subqueries' must be a list"),
+    (plan_text(subqueries=["SELECT 1"]), "Sub-queries must be objects"),
+])
+def test_rejects_malformed_plans(text, message):
+    with pytest.raises(FederationError, match=message):
+        parse_plan(text, DATABASES)
+
+
+@pytest.mark.parametrize("overrides, message", [
+    ({"subqueries": [{"name": "o", "database": "other_db", "sql": "SELECT 1"}], "joins": []},
+     "unknown database 'other_db'"),
+    ({"subqueries": [{"name": "o", "database": "shop_db", "sql": "DELETE FROM orders"}], "joins": []},
+     "was rejected: only SELECT"),
+    ({"subqueries": [{"name": "o", "database": "shop_db", "sql": 42}], "joins": []}, "must be a non-empty string"),
+    ({"subqueries": [{"name": "1o", "database": "shop_db", "sql": "SELECT 1"}], "joins": []}, "unique identifiers"),
+    ({"joins": []}, r"\['c'\] are never joined"),
+    ({"joins": [{"right": "c", "on": [["o.customer_id", "o.id"]]}]}, "join with 'c': 'o.id'"),
+    ({"joins": [{"right": "c", "on": [["customer_id", "c.id"]]}]}, "<sub-query name>.<column>"),
+    ({"joins": [{"right": "c", "on": [["o.customer_id", "c.id"]], "type": "full"}]}, "Join type"),
+    ({"joins": [{"right": "c", "on": []}]}, "no join keys"),
+    ({"aggregates": [{"func": "median", "column": "o.total", "as": "total"}]}, "Aggregate must be one of"),
+    ({"aggregates": [{"func": "sum", "column": "o.total"}]}, "'as' name must be a non-empty string"),
+    ({"group_by": [["c.name"]]}, "group_by columns must be a non-empty string"),
+    ({"select": ["o.total"]}, "'o.total' is not a group_by column or aggregate name"),
+    ({"select": [{"column": None}]}, "select columns must be a non-empty string"),
+    ({"order_by": [{"column": "c.id"}]}, "'c.id' is not one of the selected columns"),
+    ({"order_by": ["total"]}, "order_by entries must be objects"),
+    ({"limit": 0}, "limit must be a positive integer"),
+    ({"limit": True}, "limit must be a positive integer"),
+    ({"limit": "10"}, "limit must be a positive integer"),
+])
+def test_rejects_invalid_steps(overrides, message):
+    with pytest.raises(FederationError, match=message):
+        parse_plan(plan_text(**overrides), DATABASES)
+
+
+class FakeSource:
+    """Stands in for a running sub-query: a name, its columns and its rows"""
+
+    def __init__(self, name, columns, rows):
+        self.name = name
+        self.columns = [f"{name}.{column}" for column in columns]
+        self._rows = [dict(zip(self.columns, row)) for row in rows]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+def run_join(probe_rows, build, how, budget_bytes, tmp_path):
+    stats = {"spills": [], "spilled_bytes": 0}
+    probe = [dict(zip(["o.customer_id", "o.total"], row)) for row in probe_rows]
+    rows = list(_hash_join(iter(probe), build, ["o.customer_id"], ["c.id"], how, _Budget(budget_bytes),
+                           str(tmp_path), stats))
+    return sorted(rows, key=lambda row: (row["o.customer_id"] is None, row["o.customer_id"] or 0, row["o.total"])), stats
+
+
+ORDERS = [(1, 10), (2, 20), (1, 5), (3, 7), (None, 1)]
+CUSTOMERS = [(1, "ann"), (2, "bob"), (4, "dan"), (None, "nobody")]
+
+
+@pytest.mark.parametrize("budget_bytes", [1 << 30, 1])
+def test_inner_join_matches_with_and_without_spilling(budget_bytes, tmp_path, monkeypatch):
+    monkeypatch.setattr(federation, "SPILL_FLUSH_ROWS", 2)
+    rows, stats = run_join(ORDERS, FakeSource("c", ["id", "name"], CUSTOMERS), "inner", budget_bytes, tmp_path)
+    assert [(row["o.customer_id"], row["o.total"], row["c.name"]) for row in rows] == [
+        (1, 5, "ann"), (1, 10, "ann"), (2, 20, "bob"),
+    ]
+    assert stats["spills"] == ([] if budget_bytes > 1 else ["c"])
+
+
+@pytest.mark.parametrize("budget_bytes", [1 << 30, 1])
+def test_left_join_keeps_unmatched_probe_rows(budget_bytes, tmp_path):
+    rows, stats = run_join(ORDERS, FakeSource("c", ["id", "name"], CUSTOMERS), "left", budget_bytes, tmp_path)
+    assert [(row["o.customer_id"], row["o.total"], row["c.name"]) for row in rows] == [
+        (1, 5, "ann"), (1, 10, "ann"), (2, 20, "bob"), (3, 7, None), (None, 1, None),
+    ]
+    if budget_bytes == 1:
+        assert stats["spilled_bytes"] > 0
+        # Partitions are read once and removed
+        assert list(tmp_path.iterdir()) == []
+
+
+def test_join_on_a_missing_column_is_reported():
+    build = FakeSource("c", ["id"], [(1,)])
+    with pytest.raises(FederationError, match="not returned by sub-query 'c'"):
+        list(_hash_join(iter([{"o.customer_id": 1}]), build, ["o.customer_id"], ["c.missing"], "inner",
+                        _Budget(1 << 30), "/unused", {"spills": [], "spilled_bytes": 0}))
+
+
+def test_escape_string_payloads_are_rejected():
+    sql = r"SELECT E'\'' FROM t; COMMIT; DELETE FROM t; SELECT E'\''"
+    with pytest.raises(FederationError, match="more than one statement"):
+        parse_plan(plan_text(subqueries=[{"name": "o", "database": "shop_db", "sql": sql}], joins=[],
+                             group_by=[], aggregates=[], select=[], order_by=[]), DATABASES)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import fewshot
+from fewshot import ExampleIndex, vectorize
+
+
+def test_vectors_are_unit_length():
+    assert np.linalg.norm(vectorize("How many orders last month?")) == pytest.approx(1.0)
+    assert not vectorize("").any()
+
+
+def test_search_ranks_similar_questions_first():
+    index = ExampleIndex()
+    index.add("how many orders were placed last month", "SELECT count(*) FROM orders", "executed")
+    index.add("list customers in Germany", "SELECT * FROM customers WHERE country = 'DE'", "executed")
+    index.add("total revenue per product", "SELECT product, sum(total) FROM orders GROUP BY 1", "executed")
+
+    results = index.search(vectorize("how many orders were placed this month"), k=2)
+    assert [r["sql"] for r in results][0] == "SELECT count(*) FROM orders"
+    assert len(results) == 2
+    assert results[0]["score"] >= results[1]["score"]
+    assert ExampleIndex().search(vectorize("anything"), k=3) == []
+
+
+def test_duplicates_are_ignored_but_confirmations_upgrade_them():
+    index = ExampleIndex()
+    assert index.add("How many users?", "SELECT count(*) FROM users", "executed")
+    assert not index.add("  how many   USERS? ", "select count(*) from users", "executed")
+    assert len(index) == 1
+    assert not index.add("how many users?", "SELECT count(*) FROM users", "confirmed")
+    assert index.sources == ["confirmed"]
+
+
+def test_confirmed_examples_win_ties():
+    index = ExampleIndex()
+    index.add("count the users", "SELECT count(*) FROM users", "executed")
+    index.add("count the users", "SELECT count(id) FROM users", "confirmed")
+    top = index.search(vectorize("count the users"), k=1)[0]
+    assert top["source"] == "confirmed"
+    assert top["score"] == pytest.approx(1.0 + fewshot.CONFIRMED_BOOST, abs=1e-5)
+
+
+def test_grows_past_capacity_and_drops_the_oldest(monkeypatch):
+    monkeypatch.setattr(fewshot, "MAX_EXAMPLES_PER_DATABASE", 5)
+    index = ExampleIndex(capacity=2)
+    for i in range(7):
+        index.add(f"question number {i}", f"SELECT {i}", "executed")
+    assert index.questions == [f"question number {i}" for i in range(2, 7)]
+    top = index.search(vectorize("question number 6"), k=1)[0]
+    assert top["sql"] == "SELECT 6"
+    # A dropped example can be added again
+    assert index.add("question number 0", "SELECT 0", "executed")
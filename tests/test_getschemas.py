@@ -0,0 +1,64 @@
+import pytest
+
+from getschemas import MAX_HINT_VALUE_LENGTH, format_column_hint, parse_pg_array
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("{paid,pending,refunded}", ["paid", "pending", "refunded"]),
+    ('{"New York","San Francisco",Paris}', ["New York", "San Francisco", "Paris"]),
+    ('{"a,b","c}d"}', ["a,b", "c}d"]),
+    (r'{"say \"hi\"","back\\slash"}', ['say "hi"', "back\\slash"]),
+    ("{a,NULL,b,NULL}", ["a", "b"]),
+    ('{"NULL",""}', ["NULL", ""]),
+    ("{}", []),
+    ("", []),
+    (None, []),
+    ("not an array", []),
+])
+def test_parse_pg_array(text, expected):
+    assert parse_pg_array(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("{{1,2},{3,4}}", ["{1,2}", "{3,4}"]),
+    ('{{"a,}",NULL},{c,d}}', ['{"a,}",NULL}', "{c,d}"]),
+    ("{{{1}},{{2}}}", ["{{1}}", "{{2}}"]),
+])
+def test_parse_pg_array_keeps_sub_arrays_whole(text, expected):
+    assert parse_pg_array(text) == expected
+
+
+def test_no_profile_no_hint():
+    assert format_column_hint(None) == ""
+    assert format_column_hint({}) == ""
+
+
+def test_unique_columns():
+    assert format_column_hint({"n_distinct": -1, "common_values": ["a"]}) == "unique"
+
+
+def test_enum_like_columns_list_their_values():
+    profile = {"n_distinct": 3, "common_values": ["paid", "pending", "refunded"]}
+    assert format_column_hint(profile) == "values: 'paid'|'pending'|'refunded'"
+
+
+def test_value_lists_are_truncated():
+    profile = {"n_distinct": 20, "common_values": ["a", "b", "c", "d", "e", "f"]}
+    assert format_column_hint(profile) == "values: 'a'|'b'|'c'|'d'|'e'|…"
+    long_value = "x" * (MAX_HINT_VALUE_LENGTH + 10)
+    assert format_column_hint({"n_distinct": 1, "common_values": [long_value]}) == \
+        f"values: '{'x' * MAX_HINT_VALUE_LENGTH}'"
+
+
+def test_negative_n_distinct_scales_with_row_count():
+    profile = {"n_distinct": -0.5, "common_values": ["a", "b"], "histogram_min": "a", "histogram_max": "z"}
+    assert format_column_hint(profile, row_estimate=10) == "values: 'a'|'b'|…"
+    # Too many distinct values for a list, so the range is shown instead
+    assert format_column_hint(profile, row_estimate=1000) == "range: a..z"
+    assert format_column_hint(profile) == "range: a..z"
+
+
+def test_ranges_and_nulls():
+    profile = {"n_distinct": 5000, "histogram_min": "2019-01-02", "histogram_max": "2024-06-30", "null_frac": 0.75}
+    assert format_column_hint(profile) == "range: 2019-01-02..2024-06-30; 75% null"
+    assert format_column_hint({"null_frac": 0.2}) == ""
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from llmresilience import LLMError
+from llmscheduler import FairScheduler
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline, "scheduler never reached the expected state"
+        time.sleep(0.005)
+
+
+class Requests:
+    """Requests through a scheduler on their own threads, recording the order they're granted a slot"""
+
+    def __init__(self, scheduler: FairScheduler):
+        self.scheduler = scheduler
+        self.granted = []
+        self.errors = {}
+        self.threads = []
+
+    def start(self, user_id, label, hold: threading.Event = None):
+        def run():
+            try:
+                with self.scheduler.slot(user_id):
+                    self.granted.append(label)
+                    if hold is not None:
+                        hold.wait(5)
+            except LLMError as e:
+                self.errors[label] = e.kind
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+
+    def queue(self, user_id, label):
+        """Start a request and wait until it's waiting in the queue"""
+        queued = self.scheduler._queued
+        self.start(user_id, label)
+        wait_until(lambda: self.scheduler._queued == queued + 1)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(5)
+
+
+def test_slots_alternate_between_users():
+    scheduler = FairScheduler(max_concurrency=1, rate_per_minute=60000, burst=100, max_wait=5)
+    requests = Requests(scheduler)
+    hold = threading.Event()
+    requests.start("alice", "a1", hold)
+    wait_until(lambda: requests.granted == ["a1"])
+    for label in ("a2", "a3", "a4"):
+        requests.queue("alice", label)
+    requests.queue("bob", "b1")
+    requests.queue("bob", "b2")
+
+    hold.set()
+    requests.join()
+    # Bob queued last but isn't stuck behind all of Alice's requests
+    assert requests.granted == ["a1", "a2", "b1", "a3", "b2", "a4"]
+
+
+def test_rate_limited_user_does_not_block_others():
+    scheduler = FairScheduler(max_concurrency=4, rate_per_minute=0.001, burst=1, max_wait=0.3)
+    requests = Requests(scheduler)
+    requests.start("alice", "a1")
+    requests.join()
+    requests.start("alice", "a2")
+    requests.start("bob", "b1")
+    requests.join()
+    assert requests.granted == ["a1", "b1"]
+    assert requests.errors == {"a2": "queue_timeout"}
+
+
+def test_queue_limits():
+    scheduler = FairScheduler(max_concurrency=1, rate_per_minute=60000, burst=100,
+                              max_queued_per_user=2, max_queued_total=3, max_wait=5)
+    requests = Requests(scheduler)
+    hold = threading.Event()
+    requests.start("alice", "a1", hold)
+    wait_until(lambda: requests.granted == ["a1"])
+    requests.queue("alice", "a2")
+    requests.queue("alice", "a3")
+    with pytest.raises(LLMError, match="Too many pending questions"):
+        with scheduler.slot("alice"):
+            pass
+    requests.queue("bob", "b1")
+    with pytest.raises(LLMError, match="busy"):
+        with scheduler.slot("carol"):
+            pass
+
+    hold.set()
+    requests.join()
+    assert sorted(requests.granted) == ["a1", "a2", "a3", "b1"]
+    assert scheduler._active == 0 and scheduler._queued == 0
+
+
+def test_idle_buckets_are_evicted(monkeypatch):
+    import llmscheduler
+
+    monkeypatch.setattr(llmscheduler, "BUCKET_EVICT_INTERVAL_SECONDS", 0)
+    scheduler = FairScheduler(max_concurrency=2, rate_per_minute=60000, burst=1)
+    with scheduler.slot("alice"):
+        pass
+    time.sleep(0.01)  # alice's single token refills in 1ms
+    with scheduler.slot("bob"):
+        assert "alice" not in scheduler._buckets
@@ -0,0 +1,32 @@
+import pytest
+
+from preparedstatements import normalize
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT 1", "SELECT 1"),
+    ("  SELECT   id,\n\tname\nFROM  t ;;  ", "SELECT id, name FROM t"),
+    ("SELECT * FROM t WHERE name = 'a   b'", "SELECT * FROM t WHERE name = 'a   b'"),
+    ("SELECT  'it''s  here'  FROM t", "SELECT 'it''s  here' FROM t"),
+    ('SELECT  "first   name"  FROM t', 'SELECT "first   name" FROM t'),
+])
+def test_collapses_whitespace_outside_quotes(sql, expected):
+    assert normalize(sql) == expected
+
+
+def test_reformatted_queries_share_a_key():
+    assert normalize("SELECT id\nFROM orders\nWHERE total > 10;") == normalize("SELECT id FROM orders WHERE total > 10")
+
+
+def test_quoted_whitespace_keeps_queries_apart():
+    assert normalize("SELECT 'a b'") != normalize("SELECT 'a  b'")
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT $$a   b$$",
+    "SELECT 1  -- note",
+    "SELECT /* a   b */ 1",
+    "SELECT E'a\\n  b'",
+])
+def test_text_a_simple_lexer_cant_handle_is_kept_exactly(sql):
+    assert normalize(sql + " ;") == sql
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+import metrics
+from singleflight import SingleFlight
+
+
+def start_callers(flight, fn, callers):
+    """Run flight.do("key", fn) on several threads, the first one leading; returns (threads, outcomes)"""
+    outcomes = [None] * callers
+
+    def call(i):
+        try:
+            outcomes[i] = flight.do("key", fn)
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def wait_for_followers(flight, count):
+    deadline = time.monotonic() + 5
+    while metrics.get_counter(f"singleflight.{flight.name}.shared") < count:
+        assert time.monotonic() < deadline, "followers never joined the call"
+        time.sleep(0.005)
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test_shared")
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    threads, outcomes = start_callers(flight, work, 5)
+    wait_for_followers(flight, 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(outcomes, key=lambda outcome: outcome[1]) == [("result", False)] + [("result", True)] * 4
+
+
+def test_errors_are_shared_with_waiting_callers():
+    flight = SingleFlight("test_errors")
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("boom")
+
+    threads, outcomes = start_callers(flight, fail, 3)
+    wait_for_followers(flight, 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+
+
+def test_nothing_is_cached_after_the_call():
+    flight = SingleFlight("test_sequential")
+    counter = iter(range(10))
+    assert flight.do("key", lambda: next(counter)) == (0, False)
+    assert flight.do("key", lambda: next(counter)) == (1, False)
+    with pytest.raises(KeyError):
+        flight.do("other", lambda: {}["missing"])
+    assert flight.do("other", lambda: "recovered") == ("recovered", False)
@@ -0,0 +1,81 @@
+import pytest
+
+from sqlguard import validate_read_only
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1",
+    "select id, name from customers where region = 'EU';",
+    "WITH recent AS (SELECT * FROM orders) SELECT count(*) FROM recent",
+    "SELECT 'drop table users; --' AS note",
+    'SELECT "update" FROM "insert"',
+    "SELECT $tag$ delete from x $tag$",
+    "SELECT id FROM t -- then insert into t\n",
+    "SELECT updated_at, created_by FROM audit",
+])
+def test_accepts_plain_reads(sql):
+    assert validate_read_only(sql) is None
+
+
+@pytest.mark.parametrize("sql, reason", [
+    ("", "empty query"),
+    ("  ;  ", "empty query"),
+    ("SELECT 1; SELECT 2", "more than one statement"),
+    ("SELECT 1; DROP TABLE users", "more than one statement"),
+    ("UPDATE users SET admin = true", "only SELECT queries are allowed"),
+    ("EXPLAIN ANALYZE DELETE FROM users", "only SELECT queries are allowed"),
+])
+def test_rejects_non_select(sql, reason):
+    assert validate_read_only(sql) == reason
+
+
+@pytest.mark.parametrize("sql, word", [
+    ("WITH gone AS (DELETE FROM users RETURNING *) SELECT * FROM gone", "DELETE"),
+    ("SELECT * INTO backup FROM users", "INTO"),
+    ("SELECT * FROM accounts FOR UPDATE", "FOR UPDATE"),
+    ("SELECT * FROM accounts for  no key update", "for  no key update"),
+    ("SELECT pg_sleep(10)", "pg_sleep"),
+    ("SELECT nextval ('seq')", "nextval"),
+    ("SELECT pg_terminate_backend(pid) FROM pg_stat_activity", "pg_terminate_backend"),
+])
+def test_rejects_writes_and_unsafe_functions(sql, word):
+    assert validate_read_only(sql) == f"'{word}' is not allowed in a read-only query"
+
+
+def test_comments_cannot_hide_a_second_statement():
+    assert validate_read_only("SELECT 1 /* ; */ ; DELETE FROM t") == "more than one statement"
+
+
+@pytest.mark.parametrize("sql", [
+    # Closes the E-string with \' and smuggles statements past COPY ( ... )
+    r"SELECT E'\'' ) TO STDOUT; COMMIT; DELETE FROM t; COPY (SELECT E'\''",
+    r"select e'\\';delete from t",
+    r"SELECT 1 \; DELETE FROM t",
+])
+def test_escape_strings_cannot_hide_statements(sql):
+    assert validate_read_only(sql) == "more than one statement"
+
+
+def test_escape_strings_are_lexed_with_backslashes():
+    assert validate_read_only(r"SELECT E'it\'s; fine', E'a\\' FROM t") is None
+
+
+def test_backslashes_in_plain_strings_are_rejected():
+    # What they mean depends on standard_conforming_strings
+    assert validate_read_only(r"SELECT 'a\' ; DELETE FROM t; SELECT '") == "backslashes are only allowed in E'...' strings"
+
+
+@pytest.mark.parametrize("sql, word", [
+    ("SELECT 1 COMMIT", "COMMIT"),
+    ("WITH x AS (SELECT 1) SELECT * FROM x rollback", "rollback"),
+    ("SELECT begin", "begin"),
+    ("SELECT 1 END TRANSACTION", "END TRANSACTION"),
+    ("SELECT 1 set search_path = x", "set"),
+    ("SELECT 1 RESET ALL", "RESET"),
+])
+def test_rejects_transaction_and_session_control(sql, word):
+    assert validate_read_only(sql) == f"'{word}' is not allowed in a read-only query"
+
+
+def test_case_end_is_still_a_read():
+    assert validate_read_only("SELECT CASE WHEN total > 10 THEN 'big' END AS size FROM orders") is None
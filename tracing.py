@@ -0,0 +1,285 @@
+"""
+Minimal OpenTelemetry-style tracing: spans with attributes, parented through a
+contextvar (so run_in_threadpool calls join the request's trace), exported in
+batches by a background thread.
+
+TRACE_EXPORTER selects where spans go (comma-separated):
+    none  (default) spans are created but dropped
+    file  JSON lines to TRACE_FILE (default traces.jsonl)
+    otlp  OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT (default http://localhost:4318/v1/traces)
+
+Print one request's span tree from a file export:
+
+    python tracing.py traces.jsonl <trace_id>
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTERS = [name.strip() for name in os.getenv("TRACE_EXPORTER", "none").split(",") if name.strip()]
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "api-connect")
+EXPORT_BATCH_SIZE = 200
+EXPORT_INTERVAL_SECONDS = 1.0
+MAX_QUEUED_SPANS = 10000
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_error(self, error):
+        self.status = "error"
+        self.error = str(error)
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.sampled:
+                _exporter.enqueue(self)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan(Span):
+    """Returned by current_span() outside any trace so callers never need a None check"""
+
+    def __init__(self):
+        super().__init__("noop", "0" * 32, None, False)
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def current_span() -> Span:
+    return _current_span.get() or _NOOP
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def start_span(name: str, **attributes) -> Span:
+    """A span under the current one (or a new trace); the caller must end() it"""
+    parent = _current_span.get()
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+    sampled = bool(TRACE_EXPORTERS) and "none" not in TRACE_EXPORTERS and random.random() < TRACE_SAMPLE_RATE
+    return Span(name, f"{random.getrandbits(128):032x}", None, sampled, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Run the block in a child span of the current one; exceptions mark it as failed"""
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: List[Span]) -> Dict[str, Any]:
+    """OTLP/HTTP JSON body for a batch of spans"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": "api-connect.tracing"},
+                "spans": [
+                    {
+                        "traceId": s.trace_id,
+                        "spanId": s.span_id,
+                        "parentSpanId": s.parent_id or "",
+                        "name": s.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(s.start_ns),
+                        "endTimeUnixNano": str(s.end_ns),
+                        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                        "status": {"code": 2, "message": s.error or ""} if s.status == "error" else {"code": 1},
+                    }
+                    for s in spans
+                ],
+            }],
+        }]
+    }
+
+
+class _Exporter:
+    """Batches finished spans off the request path; drops them when the queue is full"""
+
+    def __init__(self):
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=MAX_QUEUED_SPANS)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._session = None
+
+    def enqueue(self, finished: Span):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            metrics.incr("tracing.dropped_spans")
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + EXPORT_INTERVAL_SECONDS
+            while len(batch) < EXPORT_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.export(batch)
+
+    def export(self, batch: List[Span]):
+        for name in TRACE_EXPORTERS:
+            try:
+                if name == "file":
+                    with open(TRACE_FILE, "a") as f:
+                        for finished in batch:
+                            f.write(json.dumps(finished.to_dict(), default=str) + "\n")
+                elif name == "otlp":
+                    if self._session is None:
+                        import requests
+                        self._session = requests.Session()
+                    self._session.post(TRACE_OTLP_ENDPOINT, json=to_otlp(batch), timeout=5).raise_for_status()
+            except Exception as e:
+                metrics.incr("tracing.export_errors")
+                logger.warning(f"Trace export to {name} failed: {e}")
+        metrics.incr("tracing.exported_spans", len(batch))
+
+
+_exporter = _Exporter()
+
+
+class TracingMiddleware:
+    """ASGI middleware: one root span per HTTP request, trace id echoed in X-Trace-Id"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with span(f"{scope.get('method')} {scope.get('path')}", **{
+            "http.method": scope.get("method"), "http.target": scope.get("path")
+        }) as root:
+            async def send_with_trace(message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("http.status_code", message.get("status"))
+                    if root.sampled:
+                        headers = list(message.get("headers", []))
+                        headers.append((b"x-trace-id", root.trace_id.encode()))
+                        message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace)
+
+
+def print_trace(path: str, trace_id: str):
+    """Indented span tree for one trace from a TRACE_FILE export"""
+    with open(path) as f:
+        spans = [record for record in map(json.loads, f) if record["trace_id"] == trace_id]
+    children: Dict[Optional[str], List[Dict]] = {}
+    for record in spans:
+        children.setdefault(record["parent_id"], []).append(record)
+
+    def walk(parent_id, depth):
+        for record in sorted(children.get(parent_id, []), key=lambda r: r["start_ns"]):
+            attributes = " ".join(f"{k}={v}" for k, v in record["attributes"].items())
+            error = f" ERROR {record['error']}" if record["status"] == "error" else ""
+            print(f"{'  ' * depth}{record['name']} {record['duration_ms']:.1f} ms {attributes}{error}")
+            walk(record["span_id"], depth + 1)
+
+    known = {record["span_id"] for record in spans}
+    for root_parent in {record["parent_id"] for record in spans if record["parent_id"] not in known}:
+        walk(root_parent, 0)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    print_trace(sys.argv[1], sys.argv[2])
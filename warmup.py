@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import psycopg2
+
+import dbpool
+import schemacache
+from background import scheduler
+from database import SessionLocal
+from getschemas import credential_config, get_credential_schema, schedule_profiling
+from models import ExternalDBCredential
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_TIMEOUT_SECONDS = 5
+# Bulk imports validate this many credentials at once, on threads of their own
+BULK_VALIDATION_CONCURRENCY = int(os.getenv("BULK_VALIDATION_CONCURRENCY", "16"))
+
+_validation_pool = ThreadPoolExecutor(max_workers=BULK_VALIDATION_CONCURRENCY, thread_name_prefix="validate")
+
+
+def probe_server(config: dict, timeout: int = VALIDATION_TIMEOUT_SECONDS) -> Dict[str, Any]:
+    """Check that a credential works and capture the server version and capabilities"""
+    try:
+        conn = psycopg2.connect(
+            connect_timeout=timeout, options=f"-c statement_timeout={timeout * 1000}", **config
+        )
+    except Exception as e:
+        return {"status": "failed", "error": str(e)}
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT
+                    current_setting('server_version'),
+                    current_setting('server_version_num')::int,
+                    pg_is_in_recovery(),
+                    current_setting('transaction_read_only') = 'on',
+                    has_database_privilege(current_database(), 'TEMP'),
+                    ARRAY(SELECT extname FROM pg_extension ORDER BY extname)
+            """)
+            version, version_num, in_recovery, read_only, can_temp, extensions = cur.fetchone()
+
+        return {
+            "status": "connected",
+            "server_version": version,
+            "server_version_num": version_num,
+            "capabilities": {
+                "in_recovery": in_recovery,
+                "read_only": read_only,
+                "temp_tables": can_temp,
+                "extensions": list(extensions),
+            }
+        }
+    except Exception as e:
+        return {"status": "failed", "error": str(e)}
+    finally:
+        conn.close()
+
+
+async def probe_servers(configs: List[dict], deadline_seconds: float) -> List[Dict[str, Any]]:
+    """
+    probe_server for many credentials concurrently; whatever hasn't answered
+    when the deadline passes is reported with status "timeout"
+    """
+    if not configs:
+        return []
+    loop = asyncio.get_running_loop()
+    timeout = max(1, min(VALIDATION_TIMEOUT_SECONDS, int(deadline_seconds)))
+    futures = [loop.run_in_executor(_validation_pool, probe_server, config, timeout) for config in configs]
+    done, _ = await asyncio.wait(futures, timeout=deadline_seconds)
+
+    results = []
+    for future in futures:
+        if future in done:
+            results.append(future.result())
+        else:
+            # Not started yet: never starts. Already connecting: ends at its own connect timeout
+            future.cancel()
+            results.append({"status": "timeout", "error": f"No answer within {deadline_seconds:g}s"})
+    return results
+
+
+def warm_credential(credential: ExternalDBCredential, validate: bool = False):
+    """Pre-connect, pre-introspect and (optionally) validate one external database"""
+    key = schemacache.credential_key(credential)
+    config = credential_config(credential)
+
+    if validate:
+        server_info = probe_server(config)
+        schemacache.set_server_info(key, server_info)
+        if server_info["status"] != "connected":
+            logger.warning(f"Credential {key} failed validation: {server_info['error']}")
+            return
+
+    if not dbpool.warm(config):
+        return
+    if get_credential_schema(credential) is not None:
+        schedule_profiling(credential)
+
+
+def _warm_stored_credential(credential_id: str, validate: bool):
+    db = SessionLocal()
+    try:
+        credential = db.query(ExternalDBCredential).filter(
+            ExternalDBCredential.id == credential_id
+        ).first()
+        if credential:
+            warm_credential(credential, validate=validate)
+    finally:
+        db.close()
+
+
+def _warm_user(user_id: str):
+    db = SessionLocal()
+    try:
+        credentials = db.query(ExternalDBCredential).filter(
+            ExternalDBCredential.user_id == user_id
+        ).all()
+        for credential in credentials:
+            # One job per database so a slow host doesn't hold up the others
+            scheduler.submit(
+                f"warm:{credential.id}",
+                warm_credential,
+                credential,
+                validate=schemacache.get_server_info(str(credential.id)) is None
+            )
+    finally:
+        db.close()
+
+
+def schedule_credential_validation(credential_id) -> bool:
+    """Validate a freshly created credential and warm its caches in the background"""
+    return scheduler.submit(f"validate:{credential_id}", _warm_stored_credential, str(credential_id), True)
+
+
+def schedule_credential_warmup(credential_id) -> bool:
+    """Warm pool and schema caches for a credential that was already validated"""
+    return scheduler.submit(f"warm:{credential_id}", _warm_stored_credential, str(credential_id), False)
+
+
+def schedule_user_warmup(user_id) -> bool:
+    """Warm pools and schema caches for all of a user's databases in the background"""
+    return scheduler.submit(f"warm-user:{user_id}", _warm_user, str(user_id))